@@ -1,3 +1,23 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ImageLibrary, OneDriveImage, SyncJob
+
+
+@admin.register(SyncJob)
+class SyncJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "user_id", "kind", "status", "stage", "done", "total", "created_at", "finished_at")
+    list_filter = ("status", "kind")
+    exclude = ("access_token", "session_key")
+
+
+@admin.register(OneDriveImage)
+class OneDriveImageAdmin(admin.ModelAdmin):
+    list_display = ("name", "user_id", "model_version", "modified_at", "last_scanned")
+    list_filter = ("model_version",)
+    search_fields = ("name", "file_id", "content_hash")
+    exclude = ("embedding",)
+
+
+@admin.register(ImageLibrary)
+class ImageLibraryAdmin(admin.ModelAdmin):
+    list_display = ("user_id", "version", "updated_at")
@@ -0,0 +1,366 @@
+import logging
+import os
+import shutil
+import time
+import numpy as np
+from django.conf import settings
+
+from .index_registry import REGISTRY, strings_nbytes
+from .storage import TornFiles, recover, remove_temps, write_together
+
+logger = logging.getLogger(__name__)
+
+try:
+    import hnswlib
+except ImportError:  # optional backend
+    hnswlib = None
+
+ANN_DIRNAME = "ann"
+JOURNAL_FILE = "save.journal"  # present only while a save swaps its files in
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def fingerprints(vectors, chunk=65536):
+    """
+    One float per row, its projection on a fixed random direction, to tell
+    whether an indexed vector has since been replaced (see update_ann).
+    """
+    vectors = np.asarray(vectors)  # a view, not a copy, of a memory-mapped store
+    probe = np.random.default_rng(0).standard_normal(vectors.shape[1]).astype(np.float32)
+    out = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), chunk):
+        out[start:start + chunk] = np.asarray(vectors[start:start + chunk], dtype=np.float32) @ probe
+    return out
+
+
+def _load_fingerprints(path, count):
+    """Saved fingerprints, or None for indexes saved before they were kept."""
+    try:
+        saved = np.load(path)
+    except FileNotFoundError:
+        return None
+    if len(saved) != count:
+        raise TornFiles(f"{path} doesn't match its index")
+    return saved
+
+
+def _read_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().split("\n")[:-1]
+
+
+def _write_lines(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(f"{line}\n" for line in lines))
+
+
+def _write_npy(path, array):
+    with open(path, "wb") as f:  # np.save(path) would append ".npy" to a temporary name
+        np.save(f, array)
+
+
+def _save_files(path, writers):
+    """Swap an index's files in together (storage.write_together), the meta file with the counts last."""
+    os.makedirs(path, exist_ok=True)
+    write_together(os.path.join(path, JOURNAL_FILE),
+                   [(os.path.join(path, name), write) for name, write in writers])
+
+
+class IVFIndex:
+    """
+    Pure-NumPy IVF-flat index: spherical k-means centroids, and one inverted
+    list of file ids per centroid. A query probes the nprobe closest lists and
+    returns their members as candidates for exact re-scoring.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, centroids=None, ids=None, assign=None, prints=None):
+        self.centroids = centroids
+        self.ids = list(ids or [])
+        self.assign = np.asarray(assign if assign is not None else [], dtype=np.int32)
+        self.prints = prints  # fingerprint of each id's vector, None if unknown
+        self.trained_size = len(self.ids)
+        self._lists = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Approximate memory use: centroids, assignments, ids and the inverted lists."""
+        centroids = self.centroids.nbytes if self.centroids is not None else 0
+        return centroids + self.assign.nbytes + 12 * len(self.ids) + strings_nbytes(self.ids)
+
+    def indexed_prints(self):
+        """{file id: fingerprint of the vector it was indexed with}, or None if unknown."""
+        return None if self.prints is None else dict(zip(self.ids, self.prints.tolist()))
+
+    # --------- Build / update ---------
+    def _nearest(self, vectors, chunk=65536):
+        out = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk):
+            block = _normalize(vectors[start:start + chunk])
+            out[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return out
+
+    def build(self, ids, vectors, nlist=None, niter=10, seed=0):
+        n = len(ids)
+        nlist = nlist or int(np.clip(np.sqrt(n), 1, 4096))
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, max(nlist * 64, 20000))
+        sample = _normalize(np.asarray(vectors)[np.sort(rng.choice(n, sample_size, replace=False))])
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(niter):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            # Re-seed empty clusters from random sample points
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+        self.ids = list(ids)
+        self.assign = self._nearest(np.asarray(vectors))
+        self.prints = fingerprints(vectors)
+        self.trained_size = n
+        self._lists = None
+        return self
+
+    def update(self, add_ids, add_vectors, delete_ids):
+        drop = set(delete_ids) | set(add_ids)
+        if drop:
+            keep = [i for i, fid in enumerate(self.ids) if fid not in drop]
+            self.ids = [self.ids[i] for i in keep]
+            self.assign = self.assign[keep]
+            self.prints = self.prints[keep]
+        if len(add_ids):
+            self.ids.extend(add_ids)
+            self.assign = np.concatenate([self.assign, self._nearest(np.asarray(add_vectors))])
+            self.prints = np.concatenate([self.prints, fingerprints(add_vectors)])
+        self._lists = None
+
+    # --------- Search ---------
+    def _build_lists(self):
+        order = np.argsort(self.assign, kind="stable")
+        bounds = np.searchsorted(self.assign[order], np.arange(len(self.centroids) + 1))
+        ids = np.asarray(self.ids, dtype=object)[order]
+        self._lists = [ids[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+
+    def candidates(self, query, k, nprobe=None):
+        if self.centroids is None or not self.ids:
+            return []
+        if self._lists is None:
+            self._build_lists()
+        nprobe = min(nprobe or getattr(settings, "ANN_NPROBE", 16), len(self.centroids))
+        sims = self.centroids @ _normalize(query)[0]
+        probes = np.argpartition(-sims, nprobe - 1)[:nprobe]
+        return np.concatenate([self._lists[c] for c in probes]).tolist()
+
+    # --------- Persistence ---------
+    def save(self, path):
+        _save_files(path, [
+            ("ivf_centroids.npy", lambda tmp: _write_npy(tmp, self.centroids)),
+            ("ivf_assign.npy", lambda tmp: _write_npy(tmp, self.assign)),
+            ("ivf_ids.tsv", lambda tmp: _write_lines(tmp, self.ids)),
+            ("ivf_prints.npy", lambda tmp: _write_npy(tmp, self.prints)),
+            ("ivf_meta.tsv", lambda tmp: _write_lines(
+                tmp, [self.kind, str(self.trained_size), str(len(self.ids)), str(len(self.centroids))])),
+        ])
+
+    @classmethod
+    def load(cls, path):
+        meta = _read_lines(os.path.join(path, "ivf_meta.tsv"))
+        index = cls(
+            np.load(os.path.join(path, "ivf_centroids.npy")),
+            _read_lines(os.path.join(path, "ivf_ids.tsv")),
+            np.load(os.path.join(path, "ivf_assign.npy")),
+        )
+        index.trained_size = int(meta[1])
+        if len(index.assign) != len(index.ids) or (
+                len(meta) > 3 and (int(meta[2]) != len(index.ids) or int(meta[3]) != len(index.centroids))):
+            raise TornFiles(f"IVF files in {path} don't match")
+        index.prints = _load_fingerprints(os.path.join(path, "ivf_prints.npy"), len(index.ids))
+        return index
+
+
+class HNSWIndex:
+    """HNSW graph index backed by hnswlib (used when the library is installed)."""
+
+    kind = "hnsw"
+
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.graph = None
+        self.labels = []   # label -> file id ("" once deleted)
+        self.label_of = {}
+        self.prints = None  # label -> fingerprint of its vector, None if unknown
+        self.trained_size = 0
+
+    def __len__(self):
+        return len(self.label_of)
+
+    @property
+    def nbytes(self):
+        """Approximate memory use: the graph plus the label <-> id mappings."""
+        graph = self.graph.index_file_size() if self.graph is not None else 0
+        return graph + strings_nbytes(self.labels) + 4 * len(self.labels) + 100 * len(self.label_of)
+
+    def indexed_prints(self):
+        """{file id: fingerprint of the vector it was indexed with}, or None if unknown."""
+        if self.prints is None:
+            return None
+        return {fid: float(self.prints[label]) for fid, label in self.label_of.items()}
+
+    def build(self, ids, vectors, m=16, ef_construction=200):
+        self.prints = fingerprints(vectors)
+        vectors = _normalize(vectors)
+        self.dim = vectors.shape[1]
+        self.graph = hnswlib.Index(space="ip", dim=self.dim)
+        self.graph.init_index(max_elements=max(len(ids), 1), ef_construction=ef_construction, M=m)
+        self.labels = list(ids)
+        self.label_of = {fid: i for i, fid in enumerate(self.labels)}
+        if len(ids):
+            self.graph.add_items(vectors, np.arange(len(ids)))
+        self.trained_size = len(ids)
+        return self
+
+    def update(self, add_ids, add_vectors, delete_ids):
+        for fid in list(delete_ids) + list(add_ids):
+            label = self.label_of.pop(fid, None)
+            if label is not None:
+                self.graph.mark_deleted(label)
+                self.labels[label] = ""
+        if len(add_ids):
+            start = len(self.labels)
+            needed = start + len(add_ids)
+            if needed > self.graph.get_max_elements():
+                self.graph.resize_index(max(needed, self.graph.get_max_elements() * 2))
+            self.graph.add_items(_normalize(add_vectors), np.arange(start, needed))
+            self.prints = np.concatenate([self.prints, fingerprints(add_vectors)])
+            for i, fid in enumerate(add_ids):
+                self.labels.append(fid)
+                self.label_of[fid] = start + i
+
+    def candidates(self, query, k, nprobe=None):
+        if self.graph is None or not self.label_of:
+            return []
+        k = min(k, len(self.label_of))
+        self.graph.set_ef(max(k, 64))
+        labels, _ = self.graph.knn_query(_normalize(query), k=k)
+        return [self.labels[label] for label in labels[0]]
+
+    def save(self, path):
+        _save_files(path, [
+            ("hnsw.bin", self.graph.save_index),
+            ("hnsw_ids.tsv", lambda tmp: _write_lines(tmp, self.labels)),
+            ("hnsw_prints.npy", lambda tmp: _write_npy(tmp, self.prints)),
+            ("hnsw_meta.tsv", lambda tmp: _write_lines(
+                tmp, [self.kind, str(self.trained_size), str(self.dim), str(len(self.labels))])),
+        ])
+
+    @classmethod
+    def load(cls, path):
+        meta = _read_lines(os.path.join(path, "hnsw_meta.tsv"))
+        index = cls(int(meta[2]))
+        index.trained_size = int(meta[1])
+        index.labels = _read_lines(os.path.join(path, "hnsw_ids.tsv"))
+        if len(meta) > 3 and int(meta[3]) != len(index.labels):
+            raise TornFiles(f"HNSW files in {path} don't match")
+        index.label_of = {fid: i for i, fid in enumerate(index.labels) if fid}
+        index.graph = hnswlib.Index(space="ip", dim=index.dim)
+        index.graph.load_index(os.path.join(path, "hnsw.bin"), max_elements=max(len(index.labels), 1))
+        if index.graph.get_current_count() != len(index.labels):
+            raise TornFiles(f"HNSW files in {path} don't match")
+        index.prints = _load_fingerprints(os.path.join(path, "hnsw_prints.npy"), len(index.labels))
+        return index
+
+
+def backend_class(name=None):
+    """ANN_BACKEND is "ivf", "hnsw" or "auto" (HNSW when hnswlib is installed)."""
+    name = name or getattr(settings, "ANN_BACKEND", "auto")
+    if name == "hnsw" or (name == "auto" and hnswlib is not None):
+        if hnswlib is None:
+            raise ImportError("ANN_BACKEND is 'hnsw' but hnswlib is not installed")
+        return HNSWIndex
+    return IVFIndex
+
+
+def ann_dir(user_dir):
+    return os.path.join(user_dir, ANN_DIRNAME)
+
+
+def load_ann(user_dir):
+    path = ann_dir(user_dir)
+    cls = backend_class()
+    marker = "hnsw_meta.tsv" if cls is HNSWIndex else "ivf_meta.tsv"
+    if not os.path.exists(os.path.join(path, marker)):
+        return None
+    return cls.load(path)
+
+
+def recover_ann(user_dir):
+    """Finish a save a crash interrupted and drop its temporary files. Hold the user's sync lock."""
+    path = ann_dir(user_dir)
+    if os.path.isdir(path):
+        if recover(os.path.join(path, JOURNAL_FILE)):
+            logger.info("Finished an interrupted save of %s", path)
+        remove_temps(path)
+
+
+def update_ann(user_dir, store):
+    """
+    Bring the user's ANN index in line with the embedding store. Small
+    libraries have no index; large ones are updated incrementally (new
+    ids added, gone ones removed, and ids whose vector changed since it was
+    indexed, e.g. an image edited in place, removed and added again) and
+    retrained from scratch once they have doubled since the last training.
+    """
+    path = ann_dir(user_dir)
+    if len(store) < getattr(settings, "ANN_MIN_IMAGES", 50000):
+        shutil.rmtree(path, ignore_errors=True)
+        return None
+    ids, _, vectors = store.matrix()
+    ann = load_ann(user_dir)
+    indexed = ann.indexed_prints() if ann is not None else None
+    if indexed is None or len(store) > 2 * max(ann.trained_size, 1):
+        ann = backend_class()().build(ids, vectors)
+        logger.info("Built %s index over %d embeddings", ann.kind, len(ids))
+    else:
+        old = np.fromiter((indexed.get(fid, np.nan) for fid in ids), dtype=np.float32, count=len(ids))
+        # New ids have no fingerprint (nan), so they are never close
+        add_rows = np.flatnonzero(~np.isclose(old, fingerprints(vectors), rtol=1e-5, atol=1e-5))
+        changed = int(np.count_nonzero(~np.isnan(old[add_rows])))
+        removed = set(indexed).difference(ids)
+        ann.update([ids[i] for i in add_rows], np.asarray(vectors)[add_rows], removed)
+        logger.info("Updated %s index: +%d -%d (%d changed)", ann.kind, len(add_rows) - changed, len(removed),
+                    changed)
+    ann.save(path)
+    return ann
+
+
+# --------- Per-process cache ---------
+def get_ann(user_dir):
+    """The user's ANN index, reloaded only when it has been rebuilt on disk."""
+    path = ann_dir(user_dir)
+    for attempt in range(3):
+        try:
+            stamp = max(os.stat(os.path.join(path, f)).st_mtime_ns for f in os.listdir(path))
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            return REGISTRY.get(("ann", path), stamp, lambda: load_ann(user_dir))
+        except (TornFiles, OSError, RuntimeError) as e:
+            # Caught a save mid-swap: look again once it is done
+            logger.info("ANN index in %s is being replaced (%s), retrying", path, e)
+            time.sleep(0.05 * (attempt + 1))
+    return None
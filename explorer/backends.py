@@ -0,0 +1,214 @@
+import copy
+import os
+import numpy as np
+import torch
+from django.conf import settings
+
+from .storage import temp_path
+
+try:
+    import onnxruntime
+except ImportError:  # optional backend
+    onnxruntime = None
+
+# Minimum per-item cosine similarity to the reference model for a backend's
+# vectors to be mixed with stored ones (see `manage.py bench_backends`)
+PARITY_MIN_COSINE = 0.999
+
+
+class _ImageTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        return self.model.encode_image(images)
+
+
+class _TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+
+def _example_inputs(model, device):
+    import clip
+    size = model.visual.input_resolution
+    images = torch.zeros((2, 3, size, size), device=device)
+    tokens = clip.tokenize(["a photo", "a photo of a dog"]).to(device)
+    return images, tokens
+
+
+# --------- Backends ---------
+class EagerBackend:
+    """
+    The model as clip.load returns it: float32 eager PyTorch on CPU.
+
+    Every backend takes preprocessed image batches / clip.tokenize output
+    and returns float32 CPU tensors. compatible means its vectors match the
+    reference model (cosine >= PARITY_MIN_COSINE) and can be mixed with
+    stored ones; an incompatible backend gets its own embedding version.
+    """
+
+    name = "eager"
+    compatible = True
+
+    def __init__(self, model, device, inplace=False):
+        self.model = model
+        self.device = device
+
+    def encode_image(self, images):
+        with torch.no_grad():
+            return self.model.encode_image(images.to(self.device)).float().cpu()
+
+    def encode_text(self, tokens):
+        with torch.no_grad():
+            return self.model.encode_text(tokens.to(self.device)).float().cpu()
+
+
+class Int8Backend(EagerBackend):
+    """Dynamic int8 quantization of every nn.Linear (CPU only)."""
+
+    name = "int8"
+    compatible = False
+
+    def __init__(self, model, device, inplace=False):
+        if device != "cpu":
+            raise ValueError("The int8 backend only runs on CPU")
+        if not inplace:
+            model = copy.deepcopy(model)
+        model = torch.ao.quantization.quantize_dynamic(model.float(), {torch.nn.Linear}, dtype=torch.qint8,
+                                                       inplace=True)
+        super().__init__(model.eval(), device)
+
+
+class TorchScriptBackend(EagerBackend):
+    """Both towers traced with TorchScript, frozen and optimized for inference."""
+
+    name = "torchscript"
+    compatible = True
+
+    def __init__(self, model, device, inplace=False):
+        super().__init__(model, device)
+        images, tokens = _example_inputs(model, device)
+        with torch.no_grad():
+            self.image_tower = torch.jit.optimize_for_inference(
+                torch.jit.trace(_ImageTower(model).eval(), images, check_trace=False))
+            self.text_tower = torch.jit.optimize_for_inference(
+                torch.jit.trace(_TextTower(model).eval(), tokens, check_trace=False))
+
+    def encode_image(self, images):
+        with torch.no_grad():
+            return self.image_tower(images.to(self.device)).float().cpu()
+
+    def encode_text(self, tokens):
+        with torch.no_grad():
+            return self.text_tower(tokens.to(self.device)).float().cpu()
+
+
+class CompileBackend(TorchScriptBackend):
+    """torch.compile (inductor) of both towers; the first call of each new shape compiles."""
+
+    name = "compile"
+    compatible = True
+
+    def __init__(self, model, device, inplace=False):
+        EagerBackend.__init__(self, model, device)
+        self.image_tower = torch.compile(_ImageTower(model).eval(), dynamic=True)
+        self.text_tower = torch.compile(_TextTower(model).eval(), dynamic=True)
+
+
+class OnnxBackend:
+    """
+    Both towers exported to ONNX and run with ONNX Runtime. Exports are
+    cached in CLIP_ONNX_DIR per model name, so only the first start pays.
+    """
+
+    name = "onnx"
+    compatible = True
+
+    def __init__(self, model, device, inplace=False, model_name="model"):
+        if onnxruntime is None:
+            raise ImportError("CLIP_BACKEND is 'onnx' but onnxruntime is not installed")
+        self.device = device
+        export_dir = getattr(settings, "CLIP_ONNX_DIR", "/tmp/clip_onnx")
+        os.makedirs(export_dir, exist_ok=True)
+        prefix = os.path.join(export_dir, model_name.replace("/", "-"))
+        images, tokens = _example_inputs(model, device)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"] if device == "cuda" else ["CPUExecutionProvider"]
+        self.image_session = self._session(_ImageTower(model), images, "images", prefix + "-image.onnx",
+                                           options, providers)
+        self.text_session = self._session(_TextTower(model), tokens, "tokens", prefix + "-text.onnx",
+                                          options, providers)
+
+    @staticmethod
+    def _session(tower, example, input_name, path, options, providers):
+        if not os.path.exists(path):
+            # Per-process and per-thread, so workers warming up together don't write into one file
+            tmp = temp_path(path)
+            try:
+                # A copy: eval().float() would otherwise switch the model the other backends share to fp32
+                with torch.no_grad():
+                    torch.onnx.export(copy.deepcopy(tower).eval().float(), (example,), tmp,
+                                      input_names=[input_name], output_names=["embeddings"], opset_version=17,
+                                      dynamo=False, dynamic_axes={input_name: {0: "batch"}, "embeddings": {0: "batch"}})
+                os.replace(tmp, path)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        return onnxruntime.InferenceSession(path, options, providers=providers)
+
+    def encode_image(self, images):
+        out = self.image_session.run(None, {"images": images.float().cpu().numpy()})[0]
+        return torch.from_numpy(np.asarray(out, dtype=np.float32))
+
+    def encode_text(self, tokens):
+        out = self.text_session.run(None, {"tokens": tokens.cpu().numpy()})[0]
+        return torch.from_numpy(np.asarray(out, dtype=np.float32))
+
+
+BACKENDS = {cls.name: cls for cls in (EagerBackend, Int8Backend, TorchScriptBackend, CompileBackend, OnnxBackend)}
+
+
+def backend_class(name=None):
+    """CLIP_BACKEND is one of BACKENDS ("eager" by default)."""
+    name = name or getattr(settings, "CLIP_BACKEND", "eager")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown CLIP_BACKEND {name!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]
+
+
+def make_backend(name, model, device, model_name="model", inplace=False):
+    cls = backend_class(name)
+    if cls is OnnxBackend:
+        return cls(model, device, inplace=inplace, model_name=model_name)
+    return cls(model, device, inplace=inplace)
+
+
+# --------- Parity ---------
+def _cosines(a, b):
+    a = a.numpy().astype(np.float64)
+    b = b.numpy().astype(np.float64)
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def parity(backend, reference, images, tokens):
+    """
+    Per-item cosine similarity between a backend's embeddings and the
+    reference backend's for the same image batch and tokenized prompts.
+    """
+    image_cos = _cosines(backend.encode_image(images), reference.encode_image(images))
+    text_cos = _cosines(backend.encode_text(tokens), reference.encode_text(tokens))
+    return {
+        "image_min": float(image_cos.min()), "image_mean": float(image_cos.mean()),
+        "text_min": float(text_cos.min()), "text_mean": float(text_cos.mean()),
+        "ok": bool(min(image_cos.min(), text_cos.min()) >= PARITY_MIN_COSINE),
+    }
@@ -0,0 +1,228 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+
+from .embedding_store import EMBED_DIM
+from .models import EMBEDDING_DTYPE, ImageLibrary, OneDriveImage
+
+# Fields rewritten when an already catalogued image is synced again
+UPSERT_FIELDS = ["name", "parent_id", "full_path", "content_hash", "etag", "modified_at", "embedding", "model_version"]
+
+
+def _batch_size():
+    return getattr(settings, "CATALOG_BATCH_SIZE", 500)
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+# --------- Version counter ---------
+def library_version(user_id):
+    """Current version of a user's catalog (0 before the first write)."""
+    version = ImageLibrary.objects.filter(user_id=user_id).values_list("version", flat=True).first()
+    return version or 0
+
+
+def bump_version(user_id):
+    updated = ImageLibrary.objects.filter(user_id=user_id).update(version=F("version") + 1)
+    if not updated:
+        ImageLibrary.objects.get_or_create(user_id=user_id, defaults={"version": 1})
+
+
+# --------- Writes ---------
+def image_row(user_id, item, vector, model_version, content_hash=""):
+    """
+    An unsaved OneDriveImage for a Graph driveItem dict (as returned by
+    sync.item_fields) and its embedding.
+    """
+    row = OneDriveImage(
+        user_id=user_id,
+        file_id=item["id"],
+        name=item["name"],
+        parent_id=item.get("parent_id"),
+        full_path=item.get("path"),
+        content_hash=content_hash or "",
+        etag=item.get("etag") or "",
+        modified_at=parse_datetime(item["modified"]) if item.get("modified") else None,
+        model_version=model_version,
+    )
+    row.vector = vector
+    return row
+
+
+def upsert_images(user_id, rows):
+    """
+    Insert or update OneDriveImage rows (matched on user_id + file_id) with
+    bulk_create / bulk_update in CATALOG_BATCH_SIZE batches, in one
+    transaction, and bump the user's version.
+    """
+    if not rows:
+        return 0
+    batch_size = _batch_size()
+    by_file = {row.file_id: row for row in rows}
+    existing = {}
+    for ids in _chunks(list(by_file), batch_size):
+        existing.update(OneDriveImage.objects.filter(user_id=user_id, file_id__in=ids)
+                        .values_list("file_id", "pk"))
+    created, updated = [], []
+    for file_id, row in by_file.items():
+        if file_id in existing:
+            row.pk = existing[file_id]
+            updated.append(row)
+        else:
+            created.append(row)
+    with transaction.atomic():
+        OneDriveImage.objects.bulk_create(created, batch_size=batch_size)
+        OneDriveImage.objects.bulk_update(updated, UPSERT_FIELDS, batch_size=batch_size)
+        bump_version(user_id)
+    return len(by_file)
+
+
+def rename_images(user_id, moves):
+    """Apply {file_id: (new_name, new_full_path)} renames and moves (a None path is left as is)."""
+    if not moves:
+        return
+    with transaction.atomic():
+        for ids in _chunks(list(moves), _batch_size()):
+            rows = list(OneDriveImage.objects.filter(user_id=user_id, file_id__in=ids)
+                        .only("pk", "file_id", "full_path"))
+            for row in rows:
+                row.name, full_path = moves[row.file_id]
+                if full_path is not None:
+                    row.full_path = full_path
+            OneDriveImage.objects.bulk_update(rows, ["name", "full_path"], batch_size=_batch_size())
+        bump_version(user_id)
+
+
+def delete_images(user_id, file_ids):
+    if not file_ids:
+        return 0
+    deleted = 0
+    with transaction.atomic():
+        for ids in _chunks(list(file_ids), _batch_size()):
+            deleted += OneDriveImage.objects.filter(user_id=user_id, file_id__in=ids).delete()[0]
+        if deleted:
+            bump_version(user_id)
+    return deleted
+
+
+def catalogued_count(user_id):
+    return OneDriveImage.objects.filter(user_id=user_id).count()
+
+
+def import_store(user_id, store, model_version):
+    """Catalog the rows of a user's on-disk store (libraries synced before the catalog existed)."""
+    ids, names, vectors = store.matrix()
+    rows = [image_row(user_id, {"id": fid, "name": name}, vec, model_version)
+            for fid, name, vec in zip(ids, names, vectors)]
+    for batch in _chunks(rows, _batch_size()):
+        upsert_images(user_id, batch)
+    return len(rows)
+
+
+# --------- Reads ---------
+def image_name(user_id, file_id):
+    return OneDriveImage.objects.filter(user_id=user_id, file_id=file_id).values_list("name", flat=True).first()
+
+
+def image_file(user_id, file_id):
+    """(name, content_hash) of a catalogued image, or None."""
+    return OneDriveImage.objects.filter(user_id=user_id, file_id=file_id).values_list("name", "content_hash").first()
+
+
+def hashes_of(user_id, file_ids):
+    """{file_id: content_hash} for the given images that have a hash."""
+    found = {}
+    for ids in _chunks(list(file_ids), _batch_size()):
+        found.update(OneDriveImage.objects.filter(user_id=user_id, file_id__in=ids)
+                     .exclude(content_hash="").values_list("file_id", "content_hash"))
+    return found
+
+
+def stored_files(user_id, file_ids):
+    """{file_id: (content_hash, full_path)} for the given catalogued images."""
+    found = {}
+    for ids in _chunks(list(file_ids), _batch_size()):
+        found.update((fid, (content_hash, full_path)) for fid, content_hash, full_path in
+                     OneDriveImage.objects.filter(user_id=user_id, file_id__in=ids)
+                     .values_list("file_id", "content_hash", "full_path"))
+    return found
+
+
+def hashes_in_use(user_id, hashes):
+    """The subset of hashes still referenced by some catalogued image."""
+    used = set()
+    for keys in _chunks(list(hashes), _batch_size()):
+        used.update(OneDriveImage.objects.filter(user_id=user_id, content_hash__in=keys)
+                    .values_list("content_hash", flat=True))
+    return used
+
+
+def vectors_by_hash(user_id, hashes, model_version):
+    """
+    {content_hash: (file_id, vector)} for hashes some image already has a
+    model_version embedding for, i.e. content that needn't be encoded again.
+    """
+    found = {}
+    for keys in _chunks(list(set(hashes)), _batch_size()):
+        qs = (OneDriveImage.objects.filter(user_id=user_id, content_hash__in=keys, model_version=model_version,
+                                           embedding__isnull=False)
+              .values_list("content_hash", "file_id", "embedding"))
+        for content_hash, file_id, blob in qs:
+            found.setdefault(content_hash, (file_id, np.frombuffer(bytes(blob), dtype=EMBEDDING_DTYPE)))
+    return found
+
+
+def image_locations(user_id):
+    """(file_id, name, parent_id, full_path) of every catalogued image."""
+    return list(OneDriveImage.objects.filter(user_id=user_id)
+                .values_list("file_id", "name", "parent_id", "full_path").iterator(chunk_size=2000))
+
+
+def text_fields(user_id):
+    """(ids, names, folder paths) of every catalogued image, for the filename index."""
+    ids, names, folders = [], [], []
+    for file_id, name, full_path in (OneDriveImage.objects.filter(user_id=user_id).order_by("pk")
+                                     .values_list("file_id", "name", "full_path").iterator(chunk_size=2000)):
+        ids.append(file_id)
+        names.append(name)
+        folders.append((full_path or "").rpartition("/")[0])
+    return ids, names, folders
+
+
+def unhashed_images(user_id):
+    """(file_id, name) of images catalogued before files were kept by content hash."""
+    return list(OneDriveImage.objects.filter(user_id=user_id, content_hash="").values_list("file_id", "name"))
+
+
+def set_hashes(user_id, hashes):
+    """Record {file_id: content_hash} for already catalogued images."""
+    for ids in _chunks(list(hashes), _batch_size()):
+        rows = list(OneDriveImage.objects.filter(user_id=user_id, file_id__in=ids).only("pk", "file_id"))
+        for row in rows:
+            row.content_hash = hashes[row.file_id]
+        OneDriveImage.objects.bulk_update(rows, ["content_hash"], batch_size=_batch_size())
+
+
+def load_vectors(user_id, model_version=None):
+    """
+    (ids, names, vectors) of a user's catalogued images, in insertion
+    order, optionally only those embedded with model_version.
+    """
+    qs = OneDriveImage.objects.filter(user_id=user_id, embedding__isnull=False)
+    if model_version is not None:
+        qs = qs.filter(model_version=model_version)
+    ids, names, blobs = [], [], []
+    for file_id, name, blob in qs.order_by("pk").values_list("file_id", "name", "embedding").iterator(
+            chunk_size=2000):
+        ids.append(file_id)
+        names.append(name)
+        blobs.append(bytes(blob))
+    if not blobs:
+        return ids, names, np.zeros((0, EMBED_DIM), dtype=EMBEDDING_DTYPE)
+    vectors = np.frombuffer(b"".join(blobs), dtype=EMBEDDING_DTYPE).reshape(len(blobs), -1)
+    return ids, names, vectors
@@ -1,28 +1,304 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
 import torch
-import clip
-from PIL import Image
 import requests
 from io import BytesIO
+from django.conf import settings
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load("ViT-B/32", device=device)
-total_params = sum(p.numel() for p in model.parameters())
-print(f"Number of parameters in CLIP model: {total_params:,}")
+from .backends import backend_class, make_backend
+from .decode import decode_size, open_image
+from .metrics import (
+    EMBEDDING_CACHE_ENCODE_SECONDS, EMBEDDING_CACHE_ENCODED, EMBEDDING_CACHE_ENTRIES, EMBEDDING_CACHE_LOOKUPS, observe,
+)
+from .storage import atomic_write
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_NAME = "ViT-B/32"
+
+
+# --------- Model loading ---------
+class ModelManager:
+    """
+    Loads a CLIP variant on first use instead of at import, so management
+    commands and migrations that never embed anything don't pay for it.
+
+    One loaded model is shared by every thread in the process: inference
+    runs under torch.no_grad() and never mutates the weights. Loading is
+    guarded by a lock so concurrent first requests load it only once.
+
+    Embeddings are computed through the CLIP_BACKEND inference backend
+    (see backends.py); embedding_version names the vector space they live in.
+    """
+
+    def __init__(self, name=None, device=None, backend=None):
+        self.name = name or getattr(settings, "CLIP_MODEL_NAME", DEFAULT_MODEL_NAME)
+        self.device = device or getattr(settings, "CLIP_DEVICE", None) or (
+            "cuda" if torch.cuda.is_available() else "cpu")
+        self.backend_name = backend_class(backend).name
+        self.load_seconds = None
+        self._model = None
+        self._preprocess = None
+        self._backend = None
+        self._lock = threading.RLock()
+
+    @property
+    def embedding_version(self):
+        """
+        Vectors from the reference model and compatible backends share the
+        model name; others (int8) are versioned apart so they are never
+        compared with vectors from the reference model.
+        """
+        if backend_class(self.backend_name).compatible:
+            return self.name
+        return f"{self.name}+{self.backend_name}"
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """Return (model, preprocess), loading them on the first call."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import clip
+                    start = time.perf_counter()
+                    model, preprocess = clip.load(self.name, device=self.device)
+                    model.eval()
+                    self.load_seconds = time.perf_counter() - start
+                    total_params = sum(p.numel() for p in model.parameters())
+                    logger.info("Loaded CLIP %s on %s in %.2fs (%s parameters)", self.name, self.device,
+                                self.load_seconds, f"{total_params:,}")
+                    self._preprocess = preprocess
+                    self._model = model
+        return self._model, self._preprocess
+
+    @property
+    def backend(self):
+        """The inference backend, built (traced, quantized, exported) on first use."""
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    model, _ = self.load()
+                    start = time.perf_counter()
+                    # Nothing else runs the eager model, so int8 may quantize it in place
+                    backend = make_backend(self.backend_name, model, self.device, self.name, inplace=True)
+                    if self.backend_name != "eager":
+                        logger.info("Built %s backend in %.2fs", self.backend_name, time.perf_counter() - start)
+                    self._backend = backend
+        return self._backend
+
+    @property
+    def model(self):
+        return self.load()[0]
+
+    @property
+    def preprocess(self):
+        return self.load()[1]
+
+    @property
+    def embed_dim(self):
+        return self.model.text_projection.shape[1]
+
+    def warmup(self):
+        """
+        Load the model and push one prompt and one blank image through it,
+        so lazy allocator / CUDA setup happens before the first real query.
+        Returns the timings in seconds; "load" includes building the backend.
+        """
+        import clip
+        start = time.perf_counter()
+        backend = self.backend
+        loaded = time.perf_counter()
+        size = self.model.visual.input_resolution
+        backend.encode_text(clip.tokenize(["a photo"]))
+        backend.encode_image(torch.zeros((1, 3, size, size)))
+        done = time.perf_counter()
+        logger.info("Warmed up CLIP %s in %.2fs", self.name, done - start)
+        return {"load": loaded - start, "warmup": done - loaded}
+
+
+manager = ModelManager()
+
+
+# --------- Query embedding cache ---------
+class EmbeddingCache:
+    """
+    Process-wide LRU of query embeddings keyed on (model, normalized query)
+    or (model, "image:" + content hash), optionally backed by a directory
+    of .npy files shared between processes. Lookups, encode time and size
+    are exported on /metrics under the cache's name.
+    """
+
+    def __init__(self, name, max_entries=1024, disk_dir=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+        self.encoded = 0
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1("\0".join(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, digest[:2], digest + ".npy")
+
+    def get(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if vector is not None:
+            EMBEDDING_CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+            return vector
+        if self.disk_dir:
+            try:
+                vector = np.load(self._disk_path(key))
+            except (OSError, ValueError):
+                vector = None
+            if vector is not None:
+                self.put(key, vector, persist=False)
+                with self._lock:
+                    self.disk_hits += 1
+                EMBEDDING_CACHE_LOOKUPS.inc(cache=self.name, result="disk_hit")
+                return vector
+        with self._lock:
+            self.misses += 1
+        EMBEDDING_CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+        return None
+
+    def put(self, key, vector, persist=True):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            entries = len(self._entries)
+        EMBEDDING_CACHE_ENTRIES.set(entries, cache=self.name)
+        if persist and self.disk_dir:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # A cache entry needn't survive a crash, only never be read half written
+            with atomic_write(path, "wb", durable=False) as f:
+                np.save(f, vector)
+
+    def record_encode(self, count, seconds):
+        with self._lock:
+            self.encoded += count
+            self.encode_seconds += seconds
+        EMBEDDING_CACHE_ENCODED.inc(count, cache=self.name)
+        EMBEDDING_CACHE_ENCODE_SECONDS.observe(seconds, cache=self.name)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "encoded": self.encoded,
+                "avg_encode_ms": 1000 * self.encode_seconds / self.encoded if self.encoded else 0.0,
+            }
+
+
+text_cache = EmbeddingCache(
+    "text",
+    max_entries=getattr(settings, "TEXT_EMBEDDING_CACHE_SIZE", 1024),
+    disk_dir=getattr(settings, "TEXT_EMBEDDING_CACHE_DIR", None),
+)
+# Uploaded query images; shares the on-disk directory (keys can't collide)
+image_cache = EmbeddingCache(
+    "image",
+    max_entries=getattr(settings, "IMAGE_EMBEDDING_CACHE_SIZE", 256),
+    disk_dir=getattr(settings, "TEXT_EMBEDDING_CACHE_DIR", None),
+)
+
+
+def normalize_query(text):
+    # CLIP's tokenizer lowercases and collapses whitespace, so these all embed identically
+    return " ".join(str(text).lower().split())
+
+
+def encode_texts(texts):
+    """
+    Encode a list of prompts, returning a (len(texts), 512) CPU tensor.
+    Cached prompts are reused; all misses go through the text tower in one
+    forward pass.
+    """
+    keys = [(manager.embedding_version, normalize_query(t)) for t in texts]
+    vectors = [text_cache.get(key) for key in keys]
+    missing = list(dict.fromkeys(key for key, vec in zip(keys, vectors) if vec is None))
+    if missing:
+        import clip
+        backend = manager.backend
+        logger.debug("encode_texts: %d prompts on %s (%s)", len(missing), manager.device, backend.name)
+        start = time.perf_counter()
+        tokens = clip.tokenize([query for _, query in missing])
+        encoded = backend.encode_text(tokens).numpy()
+        elapsed = time.perf_counter() - start
+        text_cache.record_encode(len(missing), elapsed)
+        observe("encode_text", elapsed, len(missing))
+        fresh = dict(zip(missing, encoded))
+        for key, vec in fresh.items():
+            text_cache.put(key, vec)
+        vectors = [fresh[key] if vec is None else vec for key, vec in zip(keys, vectors)]
+    if not vectors:
+        return torch.empty((0, manager.embed_dim))
+    return torch.from_numpy(np.stack(vectors))
 
 
 def encode_text(text):
-    print("encode_text is running on device:", device)
-    if device == "cuda":
-        print("CUDA device name:", torch.cuda.get_device_name(0))
-    with torch.no_grad():
-        return model.encode_text(clip.tokenize([text]).to(device)).cpu()
+    return encode_texts([text])
+
+
+def image_cache_key(content_hash):
+    return (manager.embedding_version, f"image:{content_hash}")
+
+
+def cached_image_embedding(content_hash):
+    """The embedding of a query image encoded earlier, or None."""
+    return image_cache.get(image_cache_key(content_hash))
+
+
+def encode_image_bytes(data, content_hash):
+    """
+    Embed an uploaded query image (encoded file bytes), once per content
+    hash: repeats come from image_cache. Returns a (512,) numpy vector.
+    """
+    key = image_cache_key(content_hash)
+    vector = image_cache.get(key)
+    if vector is None:
+        start = time.perf_counter()
+        with open_image(BytesIO(data), decode_size()) as img:
+            tensor = manager.preprocess(img).unsqueeze(0)
+        vector = manager.backend.encode_image(tensor).numpy()[0]
+        elapsed = time.perf_counter() - start
+        image_cache.record_encode(1, elapsed)
+        observe("encode_query_image", elapsed)
+        image_cache.put(key, vector)
+    return vector
+
 
 def encode_image_from_url(url, token=None):
-    print("encode_image_from_url is running on device:", device)
-    if device == "cuda":
-        print("CUDA device name:", torch.cuda.get_device_name(0))
+    preprocess = manager.preprocess
+    device = manager.device
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("encode_image_from_url on %s%s", device,
+                     f" ({torch.cuda.get_device_name(0)})" if device == "cuda" else "")
     headers = {"Authorization": f"Bearer {token}"} if token else {}
     response = requests.get(url, headers=headers)
-    image = preprocess(Image.open(BytesIO(response.content))).unsqueeze(0).to(device)
-    with torch.no_grad():
-        return model.encode_image(image).cpu()
+    with open_image(BytesIO(response.content), decode_size()) as img:
+        image = preprocess(img).unsqueeze(0)
+    return manager.backend.encode_image(image)
@@ -0,0 +1,126 @@
+import base64
+import binascii
+import os
+import numpy as np
+
+OBJECTS_DIRNAME = "objects"
+INCOMING_DIRNAME = "incoming"
+
+QUICKXOR_WIDTH = 160
+QUICKXOR_SHIFT = 11
+_MASK = (1 << QUICKXOR_WIDTH) - 1
+
+
+# --------- Content hashes ---------
+class QuickXorHash:
+    """
+    OneDrive's quickXorHash, the one hash Graph reports for every drive
+    type, so locally computed keys match the ones in driveItem.file.hashes.
+
+    Byte i is XORed into a 160-bit circular register at bit (11 * i) % 160.
+    That position repeats every 160 bytes, so each chunk is folded into 160
+    per-position XOR accumulators with numpy and only those 160 bytes are
+    shifted into place at the end.
+    """
+
+    def __init__(self):
+        self._acc = np.zeros(QUICKXOR_WIDTH, dtype=np.uint8)
+        self.length = 0
+
+    def update(self, data):
+        arr = np.frombuffer(data, dtype=np.uint8)
+        if not len(arr):
+            return
+        start = self.length % QUICKXOR_WIDTH
+        total = start + len(arr)
+        padded = np.zeros(-(-total // QUICKXOR_WIDTH) * QUICKXOR_WIDTH, dtype=np.uint8)
+        padded[start:total] = arr
+        self._acc ^= np.bitwise_xor.reduce(padded.reshape(-1, QUICKXOR_WIDTH), axis=0)
+        self.length += len(arr)
+
+    def digest(self):
+        value = 0
+        for j in np.flatnonzero(self._acc):
+            v = int(self._acc[j]) << (int(j) * QUICKXOR_SHIFT % QUICKXOR_WIDTH)
+            value ^= (v & _MASK) | (v >> QUICKXOR_WIDTH)
+        out = bytearray(value.to_bytes(QUICKXOR_WIDTH // 8, "little"))
+        for i, b in enumerate(self.length.to_bytes(8, "little")):
+            out[QUICKXOR_WIDTH // 8 - 8 + i] ^= b
+        return bytes(out)
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+
+def file_hash(path):
+    """quickXorHash of a local file, as lowercase hex (the content key)."""
+    h = QuickXorHash()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(4 * 1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def graph_hash(item):
+    """Content key from a driveItem's file.hashes.quickXorHash (base64), or None."""
+    encoded = ((item.get("file") or {}).get("hashes") or {}).get("quickXorHash")
+    if not encoded:
+        return None
+    try:
+        return base64.b64decode(encoded).hex()
+    except (binascii.Error, ValueError):
+        return None
+
+
+# --------- Content-addressed files ---------
+def object_path(user_dir, key):
+    """Where the file with content key `key` lives: objects/<2 chars>/<key>."""
+    return os.path.join(user_dir, OBJECTS_DIRNAME, key[:2], key)
+
+
+def incoming_path(user_dir, file_id):
+    """Download target for a file whose hash isn't known until it's local."""
+    return os.path.join(user_dir, INCOMING_DIRNAME, file_id)
+
+
+def store_object(user_dir, key, path):
+    """Move a downloaded file into the object store (dropping it if the content is already there)."""
+    dest = object_path(user_dir, key)
+    if os.path.abspath(path) == os.path.abspath(dest):
+        return dest
+    if os.path.exists(dest):
+        os.remove(path)
+    else:
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(path, dest)
+    return dest
+
+
+class DedupStats:
+    """What content addressing saved during one sync."""
+
+    def __init__(self):
+        self.items = 0             # new items that needed a vector
+        self.reused = 0            # ... that got one from identical content instead
+        self.skipped_downloads = 0
+        self.bytes_saved = 0
+        self.encode_seconds = 0.0  # encode time per image measured this sync (or earlier)
+        self.encoded = 0
+
+    @property
+    def seconds_saved(self):
+        if not self.encoded:
+            return None
+        return self.reused * self.encode_seconds / self.encoded
+
+    def as_dict(self):
+        return {
+            "items": self.items, "reused": self.reused, "skipped_downloads": self.skipped_downloads,
+            "bytes_saved": self.bytes_saved, "seconds_saved": self.seconds_saved,
+        }
+
+    def __str__(self):
+        saved = "n/a" if self.seconds_saved is None else f"~{self.seconds_saved:.1f}s"
+        return (f"Dedup: {self.reused}/{self.items} new items matched existing content, "
+                f"{self.skipped_downloads} downloads skipped ({self.bytes_saved / (1024 * 1024):.1f} MB), "
+                f"{saved} of decoding and encoding saved")
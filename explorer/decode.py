@@ -0,0 +1,103 @@
+import math
+import numpy as np
+from PIL import Image
+from django.conf import settings
+
+from .thumbnails import thumbnail_sizes
+
+# Transparent pixels are shown on white, so they are embedded on white too
+ALPHA_BACKGROUND = (255, 255, 255)
+
+EXIF_ORIENTATION = 0x0112
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+
+def decode_size(input_size=None):
+    """
+    (short edge, long edge) a decoded image has to keep: the short edge
+    CLIP's preprocess resizes to, and the longest thumbnail edge, each
+    times EMBED_DECODE_GAP so the final resample still has pixels to average.
+    None (decode at full size) when EMBED_FAST_DECODE is off.
+    """
+    if not getattr(settings, "EMBED_FAST_DECODE", True):
+        return None
+    if input_size is None:
+        from .clip_model import manager
+        input_size = manager.model.visual.input_resolution
+    gap = getattr(settings, "EMBED_DECODE_GAP", 2.0)
+    return math.ceil(input_size * gap), math.ceil(max(thumbnail_sizes()) * gap)
+
+
+def _target(size, min_size):
+    """The smallest (w, h) with the image's aspect that keeps min_size, or None if that isn't smaller."""
+    w, h = size
+    short, long = min_size
+    scale = max(short / min(w, h), long / max(w, h))
+    if scale >= 1:
+        return None
+    return math.ceil(w * scale), math.ceil(h * scale)
+
+
+def to_rgb(img):
+    """
+    img as 8-bit RGB: alpha (RGBA, LA, palettes with a transparent colour)
+    composited onto ALPHA_BACKGROUND instead of dropped, CMYK converted,
+    16-bit greyscale scaled down instead of clipped to white.
+    """
+    if img.mode == "RGB":
+        return img
+    if img.mode == "P" and "transparency" in img.info or img.mode == "PA":
+        img = img.convert("RGBA")
+    if img.mode in ("RGBA", "LA", "RGBa", "La"):
+        rgba = img.convert("RGBA")
+        out = Image.new("RGB", img.size, ALPHA_BACKGROUND)
+        out.paste(rgba, mask=rgba.getchannel("A"))
+        return out
+    if img.mode.startswith("I"):
+        pixels = np.asarray(img)
+        if img.mode.startswith("I;16") or pixels.max(initial=0) > 255:
+            pixels = pixels.astype(np.uint32) >> 8
+        return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "L").convert("RGB")
+    return img.convert("RGB")
+
+
+def open_image(fp, min_size=None):
+    """
+    Open and decode an image (a path or file object) as an upright RGB image.
+
+    With min_size=(short edge, long edge) only as many pixels as that needs
+    are decoded: JPEGs through draft(), which makes libjpeg scale the DCT
+    down by 2, 4 or 8 while decoding, and anything still twice too large is
+    box-reduced by a whole factor. A 48MP photo then never exists at full
+    size in memory. Without min_size the image is decoded at full size.
+    Either way the EXIF orientation is applied and the mode normalized
+    (to_rgb).
+    """
+    src = Image.open(fp)
+    try:
+        orientation = src.getexif().get(EXIF_ORIENTATION)
+        target = _target(src.size, min_size) if min_size else None
+        if target:
+            src.draft("RGB", target)  # a no-op for formats other than JPEG
+        src.load()
+        img = to_rgb(src)
+        if target:
+            factor = min(img.width // target[0], img.height // target[1])
+            if factor > 1:
+                img = img.reduce(factor)
+        if orientation in ORIENTATION_TRANSPOSE:
+            img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+    except BaseException:
+        src.close()
+        raise
+    if img is not src:
+        src.close()
+    return img
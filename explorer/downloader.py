@@ -0,0 +1,199 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from django.conf import settings
+
+from .graph import GRAPH_API, auth_headers, graph_session
+from .metrics import DOWNLOAD_BYTES, observe
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_STATUSES = (429, 503)
+CHUNK_SIZE = 1024 * 1024
+
+
+class DownloadStats:
+    """Per-sync download counters."""
+
+    def __init__(self):
+        self.files = 0
+        self.failed = 0
+        self.bytes = 0
+        self.retries = 0
+        self.throttled = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        return {
+            "files": self.files, "failed": self.failed, "bytes": self.bytes,
+            "retries": self.retries, "throttled": self.throttled, "seconds": round(self.seconds, 3),
+        }
+
+    def __str__(self):
+        mb = self.bytes / (1024 * 1024)
+        rate = mb / self.seconds if self.seconds else 0.0
+        return (f"Downloaded {self.files} files ({mb:.1f} MB, {rate:.1f} MB/s), {self.failed} failed, "
+                f"{self.retries} retries, {self.throttled} throttled")
+
+
+class Throttle:
+    """
+    Shared concurrency limit for one sync. A 429/503 pauses every worker
+    until Retry-After has passed and halves the number of requests allowed
+    in flight; each success lets one more back in, up to the worker count.
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self.resume_at = 0.0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while True:
+                wait = self.resume_at - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                elif self.active >= self.limit:
+                    self._cond.wait()
+                else:
+                    break
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def success(self):
+        with self._cond:
+            if self.limit < self.max_concurrency:
+                self.limit += 1
+                self._cond.notify_all()
+
+    def throttled(self, delay):
+        with self._cond:
+            self.limit = max(1, self.limit // 2)
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+
+def _backoff(attempt):
+    """Exponential backoff with jitter, capped at a minute."""
+    return min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def _retry_after(resp, attempt):
+    try:
+        return max(0.0, float(resp.headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return _backoff(attempt)
+
+
+class OneDriveDownloader:
+    """
+    Concurrent OneDrive file downloader over the pooled Graph session.
+
+    Bodies are streamed to "<dest>.part" and renamed into place once
+    complete. refresh_token is called (once, under a lock) on a 401 and
+    should return a new access token or None.
+    """
+
+    def __init__(self, token, refresh_token=None, workers=None, max_retries=None, base_url=None):
+        self.token = token
+        self.base_url = base_url or GRAPH_API
+        self.refresh_token = refresh_token
+        self.workers = workers or getattr(settings, "DOWNLOAD_WORKERS", 8)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, "DOWNLOAD_MAX_RETRIES", 5)
+        self.throttle = Throttle(self.workers)
+        self.stats = DownloadStats()
+        self._refresh_lock = threading.Lock()
+
+    def _refresh(self, failed_token):
+        with self._refresh_lock:
+            if self.token != failed_token:
+                return True  # another worker already refreshed
+            if self.refresh_token is None:
+                return False
+            token = self.refresh_token()
+            if not token:
+                return False
+            self.token = token
+            return True
+
+    def download(self, file_id, dest_path):
+        """Download one file to dest_path. Returns True on success."""
+        url = f"{self.base_url}/me/drive/items/{file_id}/content"
+        session = graph_session()
+        for attempt in range(self.max_retries + 1):
+            token = self.token
+            try:
+                with self.throttle:
+                    start = time.perf_counter()
+                    with session.get(url, headers=auth_headers(token), stream=True, timeout=(10, 60)) as resp:
+                        if resp.status_code == 200:
+                            size = self._write(resp, dest_path)
+                            observe("download", time.perf_counter() - start)
+                            DOWNLOAD_BYTES.inc(size)
+                            self.throttle.success()
+                            self.stats.add(files=1, bytes=size)
+                            return True
+                        status = resp.status_code
+                        delay = _retry_after(resp, attempt) if status in THROTTLE_STATUSES else 0
+            except requests.RequestException as e:
+                logger.warning("Error downloading %s: %s", file_id, e)
+                status, delay = None, _backoff(attempt)
+
+            if status in THROTTLE_STATUSES:
+                self.stats.add(throttled=1)
+                self.throttle.throttled(delay)
+            elif status == 401:
+                logger.info("Access token expired, attempting refresh")
+                if not self._refresh(token):
+                    logger.warning("Failed to refresh token. User must login again.")
+                    break
+            elif status is None:
+                time.sleep(delay)
+            else:
+                logger.warning("Failed to fetch image %s, status: %s", file_id, status)
+                break
+            self.stats.add(retries=1)
+        self.stats.add(failed=1)
+        return False
+
+    def _write(self, resp, dest_path):
+        tmp_path = dest_path + ".part"
+        size = 0
+        with open(tmp_path, "wb") as f:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, dest_path)
+        return size
+
+    def download_many(self, items):
+        """
+        Download (file_id, dest_path) pairs with bounded parallelism.
+        Yields (file_id, dest_path, ok) as each download finishes.
+        """
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(self.workers, thread_name_prefix="onedrive-download") as pool:
+                futures = {pool.submit(self.download, fid, path): (fid, path) for fid, path in items}
+                for future in as_completed(futures):
+                    fid, path = futures[future]
+                    yield fid, path, future.result()
+        finally:
+            self.stats.add(seconds=time.perf_counter() - start)
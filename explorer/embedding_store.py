@@ -0,0 +1,366 @@
+import logging
+import os
+import pickle
+import numpy as np
+from django.conf import settings
+
+from .storage import recover, remove_temps, replace_together, sync_file, temp_path, write_text
+
+logger = logging.getLogger(__name__)
+
+EMBED_DIM = 512
+STORE_DIRNAME = "store"
+
+# Files inside <user_dir>/store/
+VECTORS_FILE = "vectors.npy"   # contiguous N x dim matrix, opened with mmap
+INDEX_FILE = "index.tsv"       # one "file_id<TAB>name" line per row of vectors.npy
+LOG_VECTORS_FILE = "log.bin"   # raw rows appended since the last compaction
+LOG_FILE = "log.tsv"           # "+<TAB>id<TAB>name" (one row of log.bin) or "-<TAB>id"
+MODEL_FILE = "model.txt"       # embedding version the vectors were computed with
+JOURNAL_FILE = "compact.journal"  # present only while a compaction swaps its files in
+
+# Legacy pickle caches written by older versions of sync
+LEGACY_EMBEDDINGS = "clip_embeddings.pkl"
+LEGACY_MAPPING = "file_id_to_name.pkl"
+
+
+def user_cache_dir(user_id):
+    """Directory holding the downloaded files and caches for one OneDrive user."""
+    root = getattr(settings, "ONEDRIVE_CACHE_DIR", "/tmp/onedrive_cache")
+    return os.path.join(root, str(user_id))
+
+
+def store_signature(path):
+    """(mtime, size) of every store file; changes whenever the store is written."""
+    sig = []
+    for name in (VECTORS_FILE, INDEX_FILE, LOG_VECTORS_FILE, LOG_FILE):
+        try:
+            st = os.stat(os.path.join(path, name))
+            sig.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append(None)
+    return tuple(sig)
+
+
+def _clean(text):
+    # Tabs and newlines are the index separators; OneDrive names never need them
+    return str(text).replace("\t", " ").replace("\n", " ").replace("\r", " ")
+
+
+class EmbeddingStore:
+    """
+    On-disk embedding store for one user.
+
+    The bulk of the vectors live in a single contiguous matrix that is opened
+    with np.memmap, so loading is O(1) and the pages are shared between worker
+    processes through the OS page cache. New rows and deletions go to an
+    append-only log which is folded back into the matrix by compact().
+    """
+
+    def __init__(self, path, dim=EMBED_DIM, dtype="float16"):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # --------- Loading ---------
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _signature(self):
+        return store_signature(self.path)
+
+    def _load(self):
+        self._sig = self._signature()
+        ids, names = [], []
+        base = None
+        vectors_path = self._file(VECTORS_FILE)
+        if os.path.exists(vectors_path) and os.path.exists(self._file(INDEX_FILE)):
+            with open(self._file(INDEX_FILE), "r", encoding="utf-8") as f:
+                lines = f.read().split("\n")
+            for line in lines:
+                if line:
+                    fid, _, name = line.partition("\t")
+                    ids.append(fid)
+                    names.append(name)
+            if ids:
+                base = np.load(vectors_path, mmap_mode="r")
+                self.dim = base.shape[1]
+                self.dtype = base.dtype
+                # Guard against a torn compaction where the two files disagree
+                n = min(len(ids), base.shape[0])
+                del ids[n:], names[n:]
+                base = base[:n]
+
+        n_base = len(ids)
+        deleted = set()
+        log_ops = []
+        if os.path.exists(self._file(LOG_FILE)):
+            with open(self._file(LOG_FILE), "r", encoding="utf-8") as f:
+                log_ops = [line.split("\t") for line in f.read().split("\n") if line]
+
+        # Only rows that made it to log.bin count; a torn write is dropped
+        row_bytes = self.dim * self.dtype.itemsize
+        log_rows_on_disk = 0
+        if os.path.exists(self._file(LOG_VECTORS_FILE)):
+            log_rows_on_disk = os.path.getsize(self._file(LOG_VECTORS_FILE)) // row_bytes
+
+        position = {fid: row for row, fid in enumerate(ids)}
+        n_log = orphans = 0
+        for op in log_ops:
+            if op[0] == "+" and len(op) >= 3:
+                if n_log >= log_rows_on_disk:
+                    orphans += 1  # its row never reached log.bin; later deletes still apply
+                    continue
+                old = position.get(op[1])
+                if old is not None:
+                    deleted.add(old)
+                position[op[1]] = len(ids)
+                ids.append(op[1])
+                names.append(op[2])
+                n_log += 1
+            elif op[0] == "-" and len(op) >= 2:
+                old = position.pop(op[1], None)
+                if old is not None:
+                    deleted.add(old)
+
+        log = None
+        if n_log:
+            log = np.memmap(self._file(LOG_VECTORS_FILE), dtype=self.dtype, mode="r",
+                            shape=(n_log, self.dim))
+
+        self._base = base
+        self._log = log
+        self._n_base = n_base
+        self._ids = ids
+        self._names = names
+        self._deleted = deleted
+        self._position = position
+        self._n_log = n_log
+        self._n_log_ops = len(log_ops)
+        self._orphans = orphans
+
+    def recover(self):
+        """
+        Finish a compaction a crash interrupted and drop abandoned temporary
+        files. Only call while holding the user's sync lock.
+        """
+        if recover(self._file(JOURNAL_FILE)):
+            logger.info("Finished an interrupted compaction of %s", self.path)
+        remove_temps(self.path)
+        self._load()
+
+    def refresh(self):
+        """Reload if another process has written to the store since we opened it."""
+        if self._signature() != self._sig:
+            self._load()
+        return self
+
+    # --------- Read API ---------
+    def __len__(self):
+        return len(self._position)
+
+    def __contains__(self, file_id):
+        return file_id in self._position
+
+    def _row(self, row):
+        if row < self._n_base:
+            return self._base[row]
+        return self._log[row - self._n_base]
+
+    def get(self, file_id):
+        """Return the stored vector for file_id as a (dim,) array, or None."""
+        row = self._position.get(file_id)
+        if row is None:
+            return None
+        return np.asarray(self._row(row))
+
+    def name_of(self, file_id):
+        row = self._position.get(file_id)
+        return None if row is None else self._names[row]
+
+    def id_to_name(self):
+        return {fid: self._names[row] for fid, row in self._position.items()}
+
+    def _live_rows(self):
+        return np.fromiter(sorted(self._position.values()), dtype=np.int64, count=len(self._position))
+
+    def matrix(self):
+        """
+        Return (ids, names, vectors) for all live rows.
+
+        When the log is empty and nothing has been deleted this is the memmap
+        itself, with no copy.
+        """
+        if self._log is None and not self._deleted:
+            if self._base is None:
+                return [], [], np.zeros((0, self.dim), dtype=self.dtype)
+            return self._ids, self._names, self._base
+        rows = self._live_rows()
+        parts = [p for p in (self._base, self._log) if p is not None]
+        stacked = np.concatenate(parts) if len(parts) > 1 else np.asarray(parts[0])
+        ids = [self._ids[r] for r in rows]
+        names = [self._names[r] for r in rows]
+        return ids, names, stacked[rows]
+
+    @property
+    def version(self):
+        """Changes whenever any of the store files change on disk."""
+        return self._sig
+
+    @property
+    def pending_log_ops(self):
+        return self._n_log_ops
+
+    @property
+    def model_version(self):
+        """Embedding version of the stored vectors; None for stores written before it was recorded."""
+        try:
+            with open(self._file(MODEL_FILE), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    # --------- Write API ---------
+    def set_model_version(self, version):
+        write_text(self._file(MODEL_FILE), version)
+
+    def add(self, file_id, name, vector):
+        self.add_many([(file_id, name, vector)])
+
+    def add_many(self, entries, durable=False):
+        """Append (file_id, name, vector) rows to the log; durable fsyncs them (a checkpoint)."""
+        if not entries:
+            return
+        rows = np.stack([np.asarray(v, dtype=self.dtype).reshape(-1) for _, _, v in entries])
+        if rows.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d embeddings, got {rows.shape[1]}")
+        log_vectors = self._file(LOG_VECTORS_FILE)
+        row_bytes = self.dim * self.dtype.itemsize
+        # Drop rows left behind by a write that never reached log.tsv
+        if os.path.exists(log_vectors) and os.path.getsize(log_vectors) != self._n_log * row_bytes:
+            os.truncate(log_vectors, self._n_log * row_bytes)
+        if self._orphans:
+            self._drop_orphans()
+        # Vectors first: a log line without its row is ignored on load
+        with open(log_vectors, "ab") as f:
+            f.write(rows.tobytes())
+            if durable:
+                sync_file(f)
+        with open(self._file(LOG_FILE), "a", encoding="utf-8") as f:
+            f.write("".join(f"+\t{_clean(fid)}\t{_clean(name)}\n" for fid, name, _ in entries))
+            if durable:
+                sync_file(f)
+
+        # Apply in memory instead of re-reading the whole index
+        for fid, name, _ in entries:
+            fid, name = _clean(fid), _clean(name)
+            old = self._position.get(fid)
+            if old is not None:
+                self._deleted.add(old)
+            self._position[fid] = len(self._ids)
+            self._ids.append(fid)
+            self._names.append(name)
+        self._n_log += len(entries)
+        self._n_log_ops += len(entries)
+        self._log = np.memmap(log_vectors, dtype=self.dtype, mode="r", shape=(self._n_log, self.dim))
+        self._sig = self._signature()
+
+    def _drop_orphans(self):
+        """
+        Rewrite log.tsv without the "+" lines whose rows were lost, before
+        new rows are appended after the surviving ones: left in place, they
+        would claim those new rows on the next load.
+        """
+        with open(self._file(LOG_FILE), "r", encoding="utf-8") as f:
+            lines = [line for line in f.read().split("\n") if line]
+        kept, added = [], 0
+        for line in lines:
+            if line.startswith("+\t") and line.count("\t") >= 2:  # the lines _load counts as rows
+                added += 1
+                if added > self._n_log:
+                    continue
+            kept.append(line)
+        write_text(self._file(LOG_FILE), "".join(f"{line}\n" for line in kept))
+        self._n_log_ops = len(kept)
+        self._orphans = 0
+
+    def delete(self, file_id):
+        self.delete_many([file_id])
+
+    def delete_many(self, file_ids):
+        file_ids = [fid for fid in file_ids if fid in self._position]
+        if not file_ids:
+            return
+        with open(self._file(LOG_FILE), "a", encoding="utf-8") as f:
+            f.write("".join(f"-\t{_clean(fid)}\n" for fid in file_ids))
+        for fid in file_ids:
+            self._deleted.add(self._position.pop(fid))
+        self._n_log_ops += len(file_ids)
+        self._sig = self._signature()
+
+    def compact(self):
+        """
+        Fold the append log into a fresh contiguous matrix and index. The
+        new files and the log removal are swapped in through a journal, so
+        a crash can't pair a new matrix with an old index (see recover).
+        """
+        ids, names, vectors = self.matrix()
+        tmp_vectors = temp_path(self._file(VECTORS_FILE))
+        tmp_index = temp_path(self._file(INDEX_FILE))
+        with open(tmp_vectors, "wb") as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=self.dtype))
+            sync_file(f)
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            f.write("".join(f"{fid}\t{name}\n" for fid, name in zip(ids, names)))
+            sync_file(f)
+        # Drop our own maps before replacing the files underneath them
+        self._base = self._log = None
+        replace_together(self._file(JOURNAL_FILE),
+                         [(tmp_vectors, self._file(VECTORS_FILE)), (tmp_index, self._file(INDEX_FILE))],
+                         [self._file(LOG_FILE), self._file(LOG_VECTORS_FILE)])
+        self._load()
+
+
+# --------- Opening and legacy import ---------
+def open_store(user_dir):
+    """
+    Open the embedding store for a user directory, importing the legacy
+    clip_embeddings.pkl / file_id_to_name.pkl pair the first time.
+    """
+    store_path = os.path.join(user_dir, STORE_DIRNAME)
+    is_new = not os.path.exists(os.path.join(store_path, INDEX_FILE))
+    store = EmbeddingStore(store_path)
+    if is_new and os.path.exists(os.path.join(user_dir, LEGACY_EMBEDDINGS)):
+        import_legacy_pickles(user_dir, store)
+    return store
+
+
+def import_embeddings(store, embeddings, names=None):
+    """
+    Import a {file_id: ndarray} dict into the store and compact it.
+    Names fall back to the file_id when no mapping is given.
+    """
+    names = names or {}
+    entries = [(fid, names.get(fid, fid), vec) for fid, vec in embeddings.items()
+               if fid not in store]
+    store.add_many(entries)
+    store.compact()
+    return len(entries)
+
+
+def import_legacy_pickles(user_dir, store=None):
+    """One-time import of an old per-user pickle cache into the store."""
+    if store is None:
+        store = EmbeddingStore(os.path.join(user_dir, STORE_DIRNAME))
+    with open(os.path.join(user_dir, LEGACY_EMBEDDINGS), "rb") as f:
+        embeddings = pickle.load(f)
+    names = {}
+    mapping_path = os.path.join(user_dir, LEGACY_MAPPING)
+    if os.path.exists(mapping_path):
+        with open(mapping_path, "rb") as f:
+            names = pickle.load(f)
+    count = import_embeddings(store, embeddings, names)
+    logger.info("Imported %d legacy embeddings into %s", count, store.path)
+    return count
@@ -0,0 +1,139 @@
+import mimetypes
+import os
+import re
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+
+CHUNK_SIZE = 256 * 1024
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Headers passed through when streaming a file from Graph
+GRAPH_PASSTHROUGH = ("Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified")
+
+
+def _cache_control():
+    # Images are per user, so only the browser may keep them
+    return f"private, max-age={getattr(settings, 'IMAGE_CACHE_MAX_AGE', 86400)}"
+
+
+def _parse_range(header, size):
+    """
+    (start, end) inclusive for a single "bytes=a-b" range, None to serve the
+    whole file (absent or multi-range header), or "invalid" if unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:  # suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return "invalid"
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return "invalid"
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, path, content_type=None):
+    """
+    Stream a local file with ETag / Last-Modified validators (so repeat
+    requests get a 304), private Cache-Control and single-range support.
+    """
+    st = os.stat(path)
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    last_modified = int(st.st_mtime)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        not_modified["Cache-Control"] = _cache_control()
+        return not_modified
+
+    content_type = content_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    byte_range = _parse_range(request.headers.get("Range"), st.st_size)
+    # If-Range: only honour the range while the client's copy is still current
+    if_range = request.headers.get("If-Range")
+    if byte_range is not None and if_range and etag not in parse_etags(if_range) and if_range != http_date(last_modified):
+        byte_range = None
+
+    if byte_range == "invalid":
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{st.st_size}"
+    elif byte_range is not None:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(path, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+        response["Content-Length"] = str(end - start + 1)
+    else:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = _cache_control()
+    return response
+
+
+def serve_bytes(request, data, content_type, etag):
+    """A small in-memory body (thumbnails) with the same validators as serve_file."""
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is None:
+        response = HttpResponse(data, content_type=content_type)
+        response["ETag"] = etag
+    else:
+        response = not_modified
+    response["Cache-Control"] = _cache_control()
+    return response
+
+
+def stream_graph_content(resp):
+    """Relay a streamed requests response from Graph without buffering it."""
+
+    def body():
+        try:
+            yield from resp.iter_content(CHUNK_SIZE)
+        finally:
+            resp.close()
+
+    return _relay(body(), resp.status_code, resp.headers)
+
+
+def astream_graph_content(resp):
+    """stream_graph_content for a streamed httpx response, relayed by the ASGI handler as it arrives."""
+
+    async def body():
+        try:
+            async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                yield chunk
+        finally:
+            await resp.aclose()
+
+    return _relay(body(), resp.status_code, resp.headers)
+
+
+def _relay(body, status, headers):
+    response = StreamingHttpResponse(body, status=status, content_type=headers.get("Content-Type", "image/jpeg"))
+    for header in GRAPH_PASSTHROUGH:
+        # The body is relayed decoded, so a compressed length would be wrong
+        if header == "Content-Length" and "Content-Encoding" in headers:
+            continue
+        if header in headers:
+            response[header] = headers[header]
+    response["Cache-Control"] = _cache_control()
+    return response
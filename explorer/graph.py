@@ -0,0 +1,107 @@
+import asyncio
+import contextvars
+import threading
+import time
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .metrics import GRAPH_REQUESTS, GRAPH_SECONDS, graph_operation
+
+try:
+    import httpx
+except ImportError:  # only the async (ASGI) views need it
+    httpx = None
+
+# Base URL of the Graph API; point GRAPH_API_BASE at a local stand-in server for testing
+GRAPH_API = getattr(settings, "GRAPH_API_BASE", "https://graph.microsoft.com/v1.0").rstrip("/")
+
+_session = None
+_session_lock = threading.Lock()
+# A one-item list per request, so worker threads and tasks copying the
+# context all add to the same count
+_counter = contextvars.ContextVar("graph_request_count", default=None)
+
+
+def _record(url, status, seconds):
+    count = _counter.get()
+    if count is not None:
+        count[0] += 1
+    operation = graph_operation(url)
+    GRAPH_REQUESTS.inc(operation=operation, status=status)
+    GRAPH_SECONDS.observe(seconds, operation=operation)
+
+
+def _count_response(resp, *args, **kwargs):
+    _record(resp.url, resp.status_code, resp.elapsed.total_seconds())
+
+
+def reset_graph_request_count():
+    _counter.set([0])
+
+
+def graph_request_count():
+    """Graph requests made for the current request since the last reset."""
+    count = _counter.get()
+    return count[0] if count is not None else 0
+
+
+def graph_session():
+    """
+    Process-wide requests.Session so Graph calls reuse pooled keep-alive
+    connections instead of a new TCP/TLS handshake per request.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = max(10, 2 * getattr(settings, "DOWNLOAD_WORKERS", 8))
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.hooks["response"].append(_count_response)
+                _session = session
+    return _session
+
+
+# --------- Async client ---------
+_async_clients = weakref.WeakKeyDictionary()
+
+
+async def _mark_request(request):
+    request.extensions["graph_started"] = time.perf_counter()
+
+
+async def _count_async_response(response):
+    started = response.request.extensions.get("graph_started")
+    _record(str(response.request.url), response.status_code,
+            time.perf_counter() - started if started is not None else 0.0)
+
+
+def async_graph_client():
+    """
+    The async counterpart of graph_session: an httpx.AsyncClient shared by
+    every request on the running event loop, with a keep-alive connection
+    pool of GRAPH_ASYNC_MAX_CONNECTIONS. A client is tied to the loop it
+    was created on, so there is one per loop (one per process under ASGI).
+    """
+    if httpx is None:
+        raise ImproperlyConfigured("The async views need httpx (pip install httpx)")
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        size = getattr(settings, "GRAPH_ASYNC_MAX_CONNECTIONS", 100)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            event_hooks={"request": [_mark_request], "response": [_count_async_response]},
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def auth_headers(token):
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,231 @@
+import logging
+import time
+from importlib import import_module
+import msal
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .graph import GRAPH_API, auth_headers, graph_request_count, graph_session, reset_graph_request_count
+
+logger = logging.getLogger(__name__)
+
+# Session keys
+ACCESS_TOKEN = "access_token"
+EXPIRES_AT = "token_expires_at"
+ACCOUNT_ID = "account_id"
+USER_ID = "user_id"
+TOKEN_CACHE = "token_cache"
+
+
+class GraphUser:
+    """The signed-in OneDrive user, as set on request.graph_user."""
+
+    def __init__(self, user_id, access_token, expires_at=None):
+        self.user_id = user_id
+        self.access_token = access_token
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return f"<GraphUser {self.user_id}>"
+
+
+# --------- MSAL ---------
+def _load_cache(session):
+    cache = msal.SerializableTokenCache()
+    if session.get(TOKEN_CACHE):
+        cache.deserialize(session[TOKEN_CACHE])
+    return cache
+
+
+def _save_cache(session, cache):
+    if cache.has_state_changed:
+        session[TOKEN_CACHE] = cache.serialize()
+
+
+def msal_app(cache=None):
+    return msal.ConfidentialClientApplication(
+        settings.MICROSOFT_CLIENT_ID,
+        authority=settings.MICROSOFT_AUTHORITY,
+        client_credential=settings.MICROSOFT_CLIENT_SECRET,
+        token_cache=cache,
+    )
+
+
+def _store_token(session, result):
+    session[ACCESS_TOKEN] = result["access_token"]
+    session[EXPIRES_AT] = time.time() + int(result.get("expires_in", 3600))
+
+
+def fetch_user_id(token):
+    """The Graph /me id, which names the user's cache directory."""
+    resp = graph_session().get(f"{GRAPH_API}/me", headers=auth_headers(token))
+    if resp.status_code == 200:
+        return resp.json().get("id")
+    return None
+
+
+def complete_login(request, code):
+    """
+    Redeem the authorization code and record everything later requests
+    need in the session: token, expiry, MSAL account and the Graph user id
+    (the only /me call of the login). Returns the MSAL result.
+    """
+    session = request.session
+    cache = msal.SerializableTokenCache()
+    app = msal_app(cache)
+    result = app.acquire_token_by_authorization_code(
+        code,
+        scopes=settings.MICROSOFT_SCOPE,
+        redirect_uri=settings.MICROSOFT_REDIRECT_URI
+    )
+    if "access_token" not in result:
+        return result
+    _store_token(session, result)
+    oid = result.get("id_token_claims", {}).get("oid")
+    accounts = app.get_accounts()
+    account = next((a for a in accounts if a.get("local_account_id") == oid), accounts[0] if accounts else None)
+    session[ACCOUNT_ID] = account["home_account_id"] if account else None
+    session[USER_ID] = fetch_user_id(result["access_token"]) or "default"
+    _save_cache(session, cache)
+    return result
+
+
+def refresh_token(session):
+    """
+    Get a new access token from the refresh token in the session's MSAL
+    cache, for the account that signed in. Returns the token or None.
+    """
+    if not session.get(ACCOUNT_ID):
+        return None
+    cache = _load_cache(session)
+    app = msal_app(cache)
+    account = next((a for a in app.get_accounts() if a.get("home_account_id") == session[ACCOUNT_ID]), None)
+    if account is None:
+        return None
+    result = app.acquire_token_silent(settings.MICROSOFT_SCOPE, account=account, force_refresh=True)
+    if not result or "access_token" not in result:
+        return None
+    _store_token(session, result)
+    _save_cache(session, cache)
+    return result["access_token"]
+
+
+def _fresh_token(session):
+    """
+    The session's access token, refreshed first when within
+    TOKEN_REFRESH_MARGIN seconds of expiry; None if it has expired and
+    can't be refreshed.
+    """
+    token = session.get(ACCESS_TOKEN)
+    expires_at = session.get(EXPIRES_AT)
+    if token and expires_at is not None and expires_at - time.time() < getattr(settings, "TOKEN_REFRESH_MARGIN", 300):
+        token = refresh_token(session)
+        if token is None and expires_at > time.time():
+            token = session[ACCESS_TOKEN]  # still valid for now; retry next time
+    return token
+
+
+def current_user(request):
+    """
+    GraphUser for the session, or None when not signed in. A token within
+    TOKEN_REFRESH_MARGIN seconds of expiry is refreshed first; an expired
+    one that can't be refreshed ends the sign-in.
+    """
+    session = request.session
+    if not session.get(ACCESS_TOKEN):
+        return None
+    token = _fresh_token(session)
+    if token is None:
+        session.flush()
+        return None
+    user_id = session.get(USER_ID)
+    if not user_id:
+        # Sessions from before the user id was kept at login
+        user_id = fetch_user_id(token)
+        if user_id is None:
+            return None
+        session[USER_ID] = user_id
+    return GraphUser(user_id, token, session.get(EXPIRES_AT))
+
+
+# --------- Background jobs ---------
+def job_session_key(request):
+    """The session key a queued job refreshes its token from (saving a new session to get one)."""
+    if request.session.session_key is None:
+        request.session.save()
+    return request.session.session_key
+
+
+def _load_session(session_key):
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    return session if session.get(ACCESS_TOKEN) else None  # signed out or expired
+
+
+def _save_session(session):
+    try:
+        session.save()
+    except Exception as e:  # deleted meanwhile (signed out): the token is still good for this job
+        logger.warning("Couldn't save the refreshed token to the session: %s", e)
+
+
+def session_token(session_key):
+    """
+    A current access token for a job from the user's session (refreshed
+    through its MSAL cache when near expiry), or None if they signed out.
+    """
+    session = _load_session(session_key)
+    if session is None:
+        return None
+    token = _fresh_token(session)
+    if token is not None and session.modified:
+        _save_session(session)
+    return token
+
+
+def session_refresher(session_key):
+    """A refresh_token callable for OneDriveDownloader that renews the session's token."""
+    def refresh():
+        session = _load_session(session_key)
+        if session is None:
+            return None
+        token = refresh_token(session)
+        if token is not None:
+            _save_session(session)
+        return token
+    return refresh
+
+
+# --------- Middleware ---------
+class GraphIdentityMiddleware:
+    """
+    Sets request.graph_user (see current_user) and reports the number of
+    outbound Graph requests made while handling the request in an
+    X-Graph-Requests response header.
+
+    Works in both stacks: under ASGI current_user (session reads, MSAL
+    refreshes) runs in a worker thread rather than on the event loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        reset_graph_request_count()
+        request.graph_user = current_user(request)
+        response = self.get_response(request)
+        response["X-Graph-Requests"] = str(graph_request_count())
+        return response
+
+    async def _acall(self, request):
+        reset_graph_request_count()
+        request.graph_user = await sync_to_async(current_user)(request)
+        response = await self.get_response(request)
+        response["X-Graph-Requests"] = str(graph_request_count())
+        return response
@@ -0,0 +1,204 @@
+import logging
+import sys
+import threading
+from collections import Counter, OrderedDict
+from django.conf import settings
+from django.db import DatabaseError
+
+from .metrics import INDEX_BYTES, INDEX_ENTRIES, INDEX_EVICTIONS, INDEX_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def strings_nbytes(strings, sample=1000):
+    """Approximate bytes of a list of strings (pointers plus str objects), sized from a sample."""
+    n = len(strings)
+    if not n:
+        return 0
+    picked = strings[::max(n // sample, 1)]
+    return int(n * (8 + sum(sys.getsizeof(s) for s in picked) / len(picked)))
+
+
+class IndexRegistry:
+    """
+    Process-wide cache of per-user indexes (search matrices, filename, ANN
+    and thumbnail indexes) under one memory budget. Entries are keyed
+    (kind, user, ...) and tagged with the version they were built at; a lookup at
+    another version rebuilds the entry. When the entries' nbytes add up
+    to more than the budget, the least recently used go first, whichever
+    user they belong to. An index larger than the whole budget is still
+    kept (alone) so its user can search.
+    """
+
+    def __init__(self, budget=None):
+        self._budget = budget
+        self._entries = OrderedDict()  # key -> (version, value, nbytes)
+        self._lock = threading.Lock()
+        self._loading = {}             # key -> [lock held by the thread building it, threads using it]
+        self._kinds = set()            # every kind seen, so emptied ones report 0
+        self.resident = 0
+        self.hits = self.misses = self.reloads = self.evictions = 0
+
+    @property
+    def budget(self):
+        if self._budget is not None:
+            return self._budget
+        return int(getattr(settings, "SEARCH_INDEX_MEMORY_MB", 1024) * 2 ** 20)
+
+    def _lookup(self, key, version, count):
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit and hit[0] == version:
+                self._entries.move_to_end(key)
+                result = "hit"
+            else:
+                result = "reload" if hit else "miss"
+            if count:
+                if result == "hit":
+                    self.hits += 1
+                elif result == "reload":
+                    self.reloads += 1
+                else:
+                    self.misses += 1
+        if count:
+            INDEX_LOOKUPS.inc(kind=key[0], result=result)
+        return hit[1] if result == "hit" else _MISSING
+
+    def get(self, key, version, load):
+        """The entry for key at version, calling load() to build it when missing or stale."""
+        value = self._lookup(key, version, count=True)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            loading = self._loading.setdefault(key, [threading.Lock(), 0])
+            loading[1] += 1
+        # One thread builds a given index; the others wait for it instead of building it too
+        try:
+            with loading[0]:
+                value = self._lookup(key, version, count=False)
+                if value is _MISSING:
+                    value = load()
+                    self.put(key, version, value)
+        finally:
+            # The last thread out drops the lock, so keys loaded once don't keep one forever
+            with self._lock:
+                loading[1] -= 1
+                if not loading[1]:
+                    del self._loading[key]
+        return value
+
+    def put(self, key, version, value):
+        nbytes = int(getattr(value, "nbytes", 0) or 0)
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self.resident -= old[2]
+            self._entries[key] = (version, value, nbytes)
+            self.resident += nbytes
+            while self.resident > self.budget and len(self._entries) > 1:
+                old_key, (_, _, old_bytes) = self._entries.popitem(last=False)
+                self.resident -= old_bytes
+                self.evictions += 1
+                evicted.append((old_key, old_bytes))
+        for old_key, old_bytes in evicted:
+            INDEX_EVICTIONS.inc(kind=old_key[0])
+            logger.info("Evicted %s index of %s (%.1f MB)", old_key[0], old_key[1], old_bytes / 2 ** 20)
+        self._publish()
+
+    def discard(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self.resident -= old[2]
+        self._publish()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.resident = 0
+        self._publish()
+
+    def stats(self):
+        """Counters, plus entries and resident bytes per index kind."""
+        with self._lock:
+            kinds = {}
+            for key, (_, _, nbytes) in self._entries.items():
+                kind = kinds.setdefault(key[0], {"entries": 0, "bytes": 0})
+                kind["entries"] += 1
+                kind["bytes"] += nbytes
+            return {"hits": self.hits, "misses": self.misses, "reloads": self.reloads,
+                    "evictions": self.evictions, "resident_bytes": self.resident,
+                    "budget_bytes": self.budget, "kinds": kinds}
+
+    def _publish(self):
+        kinds = self.stats()["kinds"]
+        self._kinds.update(kinds)
+        for kind in self._kinds:
+            INDEX_BYTES.set(kinds.get(kind, {}).get("bytes", 0), kind=kind)
+            INDEX_ENTRIES.set(kinds.get(kind, {}).get("entries", 0), kind=kind)
+
+
+REGISTRY = IndexRegistry()
+
+
+# --------- Startup preload ---------
+def active_users(limit):
+    """
+    Users with the most live sessions, busiest first, topped up with the
+    most recently synced libraries (all of them without database sessions).
+    """
+    from django.contrib.sessions.models import Session
+    from django.utils import timezone
+    from .identity import USER_ID
+    from .models import ImageLibrary
+
+    counts = Counter()
+    if settings.SESSION_ENGINE in ("django.contrib.sessions.backends.db",
+                                   "django.contrib.sessions.backends.cached_db"):
+        for session in Session.objects.filter(expire_date__gt=timezone.now()).iterator():
+            user_id = session.get_decoded().get(USER_ID)
+            if user_id:
+                counts[user_id] += 1
+    users = [user_id for user_id, _ in counts.most_common(limit)]
+    for user_id in ImageLibrary.objects.order_by("-updated_at").values_list("user_id", flat=True)[:limit]:
+        if len(users) >= limit:
+            break
+        if user_id not in users:
+            users.append(user_id)
+    return users
+
+
+def preload(limit=None):
+    """
+    Load the search and filename (and ANN) indexes of the most active users,
+    stopping once the budget is full. Returns the users preloaded.
+    """
+    from .ann import get_ann
+    from .clip_model import manager
+    from .embedding_store import user_cache_dir
+    from .search import get_library_index
+    from .text_index import get_text_index
+
+    limit = getattr(settings, "SEARCH_INDEX_PRELOAD_USERS", 8) if limit is None else limit
+    try:
+        users = active_users(limit)
+    except DatabaseError as e:  # not migrated yet
+        logger.warning("Skipping the index preload: %s", e)
+        return []
+    loaded = []
+    for user_id in users:
+        evictions = REGISTRY.evictions
+        index = get_library_index(user_id, manager.embedding_version)
+        user_dir = user_cache_dir(user_id)
+        get_text_index(user_id, user_dir, index.version)
+        if len(index) >= getattr(settings, "ANN_MIN_IMAGES", 50000):
+            get_ann(user_dir)
+        if REGISTRY.evictions > evictions:
+            # Full: preloading more users would only push out the busier ones
+            break
+        loaded.append(user_id)
+    logger.info("Preloaded the indexes of %d users (%.1f MB)", len(loaded), REGISTRY.resident / 2 ** 20)
+    return loaded
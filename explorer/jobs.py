@@ -0,0 +1,186 @@
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .content import DedupStats
+from .identity import session_refresher, session_token
+from .models import SyncJob
+
+logger = logging.getLogger(__name__)
+
+
+# --------- Enqueueing (called from views) ---------
+def enqueue(user_id, token, kind=SyncJob.KIND_SYNC, payload=None, session_key=""):
+    """
+    Queue a sync job for a user and return it. A queued full sync already
+    covers any later upload or delete (it runs from the delta link), so
+    while one is waiting no new job is added and its token is refreshed.
+    session_key names the session whose MSAL cache the worker refreshes
+    the token from.
+    """
+    payload = payload or {}
+    with transaction.atomic():
+        queued = SyncJob.objects.select_for_update().filter(user_id=user_id, status=SyncJob.QUEUED)
+        existing = queued.filter(kind=SyncJob.KIND_SYNC).first()
+        if existing is None and kind != SyncJob.KIND_SYNC:
+            existing = next((job for job in queued.filter(kind=kind) if job.payload == payload), None)
+        if existing is not None:
+            existing.access_token = token
+            existing.session_key = session_key or existing.session_key
+            existing.save(update_fields=["access_token", "session_key"])
+            return existing
+        return SyncJob.objects.create(user_id=user_id, kind=kind, payload=payload, access_token=token,
+                                      session_key=session_key)
+
+
+def enqueue_sync(user_id, token, session_key=""):
+    return enqueue(user_id, token, session_key=session_key)
+
+
+def enqueue_upload(user_id, token, item, session_key=""):
+    return enqueue(user_id, token, SyncJob.KIND_UPLOAD, {"item": item}, session_key)
+
+
+def enqueue_delete(user_id, token, file_id, session_key=""):
+    return enqueue(user_id, token, SyncJob.KIND_DELETE, {"file_id": file_id}, session_key)
+
+
+def user_jobs(user_id, limit=5):
+    """Most recent jobs for the progress endpoint, newest first."""
+    return list(SyncJob.objects.filter(user_id=user_id).order_by("-created_at")[:limit])
+
+
+# --------- Worker side ---------
+class JobProgress:
+    """Progress callback for sync functions, writing to the job row at most once a second."""
+
+    def __init__(self, job, interval=1.0):
+        self.job = job
+        self.interval = interval
+        self._last = 0.0
+
+    def __call__(self, stage, done=0, total=0):
+        now = time.monotonic()
+        if stage == self.job.stage and done != total and now - self._last < self.interval:
+            return
+        self._last = now
+        self.job.stage, self.job.done, self.job.total = stage, done, total
+        SyncJob.objects.filter(pk=self.job.pk).update(
+            stage=stage, done=done, total=total, heartbeat_at=timezone.now())
+
+
+class Heartbeat:
+    """
+    Touches the job's heartbeat_at every SYNC_JOB_HEARTBEAT_SECONDS from a
+    thread of its own for as long as the job runs, so listing, indexing
+    and waiting for the user's sync lock (which report no progress) don't
+    look like a dead worker to requeue_stale.
+    """
+
+    def __init__(self, job, interval=None):
+        self.job = job
+        self.interval = interval or getattr(settings, "SYNC_JOB_HEARTBEAT_SECONDS", 30)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{job.pk}", daemon=True)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    SyncJob.objects.filter(pk=self.job.pk).update(heartbeat_at=timezone.now())
+                except Exception as e:  # a busy database; the next beat tries again
+                    logger.warning("Heartbeat for job %s failed: %s", self.job.pk, e)
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def requeue_stale():
+    """Put back jobs whose worker stopped sending heartbeats (crashed or killed)."""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, "SYNC_JOB_STALE_SECONDS", 1200))
+    stale = SyncJob.objects.filter(status=SyncJob.RUNNING, heartbeat_at__lt=cutoff)
+    max_attempts = getattr(settings, "SYNC_JOB_MAX_ATTEMPTS", 3)
+    stale.filter(attempts__gte=max_attempts).update(
+        status=SyncJob.FAILED, message="Worker stopped responding", finished_at=timezone.now())
+    stale.filter(attempts__lt=max_attempts).update(status=SyncJob.QUEUED)
+
+
+def claim_next():
+    """
+    Atomically claim the oldest queued job whose user has nothing running,
+    so one user's jobs never run concurrently. Returns None if idle.
+    """
+    busy = SyncJob.objects.filter(status=SyncJob.RUNNING).values_list("user_id", flat=True)
+    candidates = SyncJob.objects.filter(status=SyncJob.QUEUED).exclude(user_id__in=busy).order_by("created_at")
+    for job in candidates[:20]:
+        now = timezone.now()
+        claimed = SyncJob.objects.filter(pk=job.pk, status=SyncJob.QUEUED).update(
+            status=SyncJob.RUNNING, started_at=now, heartbeat_at=now, attempts=F("attempts") + 1)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def job_tokens(job):
+    """
+    (access token, refresh callable) for a job. With the user's session the
+    token comes from it, renewed if the job sat in the queue past its
+    lifetime, and the downloader can renew it again on a 401 mid-sync.
+    """
+    if not job.session_key:
+        return job.access_token, None
+    token = session_token(job.session_key) or job.access_token
+    return token, session_refresher(job.session_key)
+
+
+def run_job(job):
+    from .sync import sync_user, sync_uploaded_item, sync_deleted_item
+
+    progress = JobProgress(job)
+    dedup = DedupStats()
+    start = time.time()
+    logger.info("[worker %d] Running %s", os.getpid(), job)
+    try:
+        with Heartbeat(job):
+            token, refresh = job_tokens(job)
+            if job.kind == SyncJob.KIND_UPLOAD:
+                sync_uploaded_item(job.user_id, job.payload["item"], token, refresh, progress=progress, dedup=dedup)
+            elif job.kind == SyncJob.KIND_DELETE:
+                sync_deleted_item(job.user_id, job.payload["file_id"])
+            else:
+                sync_user(job.user_id, token, refresh, progress=progress, dedup=dedup)
+        # The dedup report stays on the job (admin, sync status)
+        status, message = SyncJob.DONE, str(dedup) if dedup.items else ""
+    except Exception as e:
+        logger.exception("[worker %d] %s failed", os.getpid(), job)
+        status, message = SyncJob.FAILED, str(e)
+    SyncJob.objects.filter(pk=job.pk).update(
+        status=status, message=message, finished_at=timezone.now(), access_token="", session_key="")
+    logger.info("[worker %d] %s for %s %s in %.1fs", os.getpid(), job.kind, job.user_id, status, time.time() - start)
+
+
+def work(poll_interval=2.0, once=False):
+    """Worker loop: claim and run jobs until stopped (or until idle with once=True)."""
+    while True:
+        requeue_stale()
+        job = claim_next()
+        if job is not None:
+            run_job(job)
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
@@ -0,0 +1,74 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from explorer.ann import HNSWIndex, IVFIndex, hnswlib
+from explorer.embedding_store import open_store, user_cache_dir
+from explorer.search import SearchIndex, top_k
+
+
+def synthetic(n, dim, clusters, rng):
+    """Clustered unit vectors, closer to real CLIP embeddings than pure noise."""
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, n)
+    return centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+class Command(BaseCommand):
+    help = "Recall@k and query latency of the ANN backends against exact search."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=200000)
+        parser.add_argument("--user", help="Benchmark a real user's embedding store instead")
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument("-k", type=int, default=20)
+        parser.add_argument("--nprobe", default="4,8,16,32,64")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        k = options["k"]
+        if options["user"]:
+            ids, names, vectors = open_store(user_cache_dir(options["user"])).matrix()
+        else:
+            n = options["size"]
+            vectors = synthetic(n, 512, max(n // 500, 8), rng)
+            ids = [f"item{i}" for i in range(n)]
+            names = ids
+        index = SearchIndex(ids, names, vectors)
+        # Queries are perturbed library vectors so they have true neighbours
+        picks = rng.choice(len(index), options["queries"], replace=False)
+        queries = index.matrix[picks] + 0.3 * rng.standard_normal((len(picks), index.matrix.shape[1])).astype(np.float32)
+
+        exact, times = [], []
+        for q in queries:
+            start = time.perf_counter()
+            exact.append(set(top_k(index.score(q), k).tolist()))
+            times.append(time.perf_counter() - start)
+        self.stdout.write(f"{len(index)} vectors, {len(queries)} queries, recall@{k}")
+        self.stdout.write(f"{'backend':<18} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'cands':>8} {'build s':>8}")
+        self._report("exact", 1.0, times, len(index), 0.0)
+
+        backends = [("ivf", IVFIndex)]
+        if hnswlib is not None:
+            backends.append(("hnsw", HNSWIndex))
+        for name, cls in backends:
+            start = time.perf_counter()
+            ann = cls().build(index.ids, index.matrix)
+            build_s = time.perf_counter() - start
+            settings_sweep = [int(p) for p in options["nprobe"].split(",")] if name == "ivf" else [None]
+            for nprobe in settings_sweep:
+                recalls, times, sizes = [], [], []
+                for q, truth in zip(queries, exact):
+                    start = time.perf_counter()
+                    rows = index.rows_for(ann.candidates(q, max(k, 2000), nprobe))
+                    found = top_k(index.score_rows(q, rows), k, rows)
+                    times.append(time.perf_counter() - start)
+                    recalls.append(len(truth & set(found.tolist())) / k)
+                    sizes.append(len(rows))
+                label = f"ivf nprobe={nprobe}" if name == "ivf" else name
+                self._report(label, float(np.mean(recalls)), times, int(np.mean(sizes)), build_s)
+
+    def _report(self, label, recall, times, candidates, build_s):
+        ms = np.asarray(times) * 1000
+        self.stdout.write(f"{label:<18} {recall:7.3f} {np.percentile(ms, 50):8.2f} "
+                          f"{np.percentile(ms, 95):8.2f} {candidates:8d} {build_s:8.1f}")
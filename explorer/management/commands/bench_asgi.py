@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import numpy as np
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.identity import ACCESS_TOKEN, USER_ID
+from explorer.mock_graph import path_to_id
+
+BENCH_USER_ID = "bench-asgi-user"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, proc, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def pick_targets(root):
+    """A folder with files in it (browse: children + parent lookup) and one file (proxy fallback)."""
+    for dirpath, _, filenames in os.walk(root):
+        if dirpath != root and filenames:
+            folder = os.path.relpath(dirpath, root)
+            return path_to_id(folder), path_to_id(os.path.join(folder, sorted(filenames)[0]))
+    raise CommandError(f"{root} needs a subfolder with at least one file")
+
+
+async def load(base_url, path, cookie, concurrency, duration):
+    """Keep `concurrency` requests in flight for `duration` seconds; returns (latencies, errors, seconds)."""
+    import httpx
+    latencies, errors = [], 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, cookies={"sessionid": cookie}, limits=limits,
+                                 timeout=60.0) as client:
+        start = time.perf_counter()
+        deadline = start + duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                t = time.perf_counter()
+                try:
+                    resp = await client.get(path)
+                    await resp.aread()
+                    ok = resp.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - t)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - start
+
+
+class Command(BaseCommand):
+    help = ("Load-test the Graph-bound views (folder browsing, proxy_image's Graph fallback) against the "
+            "mock Graph server, under gunicorn (WSGI, threaded views) and uvicorn (ASGI, async views).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("folder", help="Folder served as the mock OneDrive")
+        parser.add_argument("--latency", type=float, default=0.2, help="Seconds the mock adds to every Graph call")
+        parser.add_argument("--concurrency", type=int, default=64, help="Requests kept in flight")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds per server and view")
+        parser.add_argument("--workers", type=int, default=1, help="Server processes")
+        parser.add_argument("--threads", type=int, default=8, help="Threads per gunicorn worker")
+        parser.add_argument("--servers", default="wsgi,asgi")
+        parser.add_argument("--views", default="browse,proxy")
+        parser.add_argument("--output", "-o", default=None, help="Write the results as JSON here")
+
+    def server_command(self, kind, port, options):
+        if kind == "wsgi":
+            return [sys.executable, "-m", "gunicorn", "image_retrieval.wsgi:application",
+                    "--bind", f"127.0.0.1:{port}", "--workers", str(options["workers"]),
+                    "--worker-class", "gthread", "--threads", str(options["threads"]), "--log-level", "warning"]
+        return [sys.executable, "-m", "uvicorn", "image_retrieval.asgi:application",
+                "--host", "127.0.0.1", "--port", str(port), "--workers", str(options["workers"]),
+                "--log-level", "warning", "--no-access-log"]
+
+    def handle(self, *args, **options):
+        for module in ("httpx", "gunicorn", "uvicorn"):
+            try:
+                __import__(module)
+            except ImportError:
+                raise CommandError(f"bench_asgi needs {module} (pip install httpx gunicorn uvicorn)")
+        folder_id, file_id = pick_targets(os.path.abspath(options["folder"]))
+        paths = {"browse": f"/?folder={folder_id}", "proxy": f"/proxy-image/{file_id}/"}
+        views = [v for v in options["views"].split(",") if v]
+        for view in views:
+            if view not in paths:
+                raise CommandError(f"Unknown view {view!r} (browse, proxy)")
+
+        # The mock runs in its own process so it doesn't share a GIL with the load generator
+        graph_port = free_port()
+        graph = subprocess.Popen([sys.executable, "manage.py", "mock_graph", os.path.abspath(options["folder"]),
+                                  "--port", str(graph_port), "--latency", str(options["latency"])],
+                                 cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL)
+        if not wait_for_port(graph_port, graph):
+            graph.terminate()
+            raise CommandError("The mock Graph server didn't start")
+        graph_url = f"http://127.0.0.1:{graph_port}/v1.0"
+        # The bench user has no catalog, so proxy_image always falls back to Graph
+        session = SessionStore()
+        session[ACCESS_TOKEN] = "bench-token"
+        session[USER_ID] = BENCH_USER_ID
+        session.create()
+        env = dict(os.environ, GRAPH_API_BASE=graph_url, CLIP_WARMUP="0", PROFILE_REQUESTS="0",
+                   DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "image_retrieval.settings"))
+        self.stdout.write(f"Mock Graph at {graph_url} (+{options['latency'] * 1000:.0f}ms per call), "
+                          f"{options['concurrency']} in flight, {options['workers']} worker(s), "
+                          f"{options['threads']} threads per WSGI worker")
+        self.stdout.write(f"{'server':<6} {'view':<7} {'requests':>9} {'req/s':>8} {'p50 ms':>8} "
+                          f"{'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        results = []
+        try:
+            for kind in [s for s in options["servers"].split(",") if s]:
+                port = free_port()
+                server_env = dict(env, ASYNC_VIEWS="1" if kind == "asgi" else "0")
+                proc = subprocess.Popen(self.server_command(kind, port, options), cwd=settings.BASE_DIR,
+                                        env=server_env)
+                try:
+                    if not wait_for_port(port, proc):
+                        raise CommandError(f"The {kind} server didn't start")
+                    base_url = f"http://127.0.0.1:{port}"
+                    for view in views:
+                        # Warm connection pools and imports before timing
+                        asyncio.run(load(base_url, paths[view], session.session_key, options["concurrency"], 1.0))
+                        latencies, errors, seconds = asyncio.run(load(
+                            base_url, paths[view], session.session_key, options["concurrency"], options["duration"]))
+                        ms = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+                        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+                        row = {"server": kind, "view": view, "requests": len(latencies),
+                               "rps": len(latencies) / seconds, "p50_ms": float(p50), "p95_ms": float(p95),
+                               "p99_ms": float(p99), "errors": errors}
+                        results.append(row)
+                        self.stdout.write(f"{kind:<6} {view:<7} {row['requests']:>9} {row['rps']:8.1f} {p50:8.1f} "
+                                          f"{p95:8.1f} {p99:8.1f} {errors:>7}")
+                finally:
+                    proc.terminate()
+                    proc.wait(timeout=30)
+        finally:
+            session.delete()
+            graph.terminate()
+            graph.wait(timeout=30)
+
+        for view in views:
+            by_kind = {r["server"]: r for r in results if r["view"] == view}
+            if "wsgi" in by_kind and "asgi" in by_kind and by_kind["wsgi"]["rps"]:
+                self.stdout.write(f"{view}: ASGI {by_kind['asgi']['rps'] / by_kind['wsgi']['rps']:.1f}x "
+                                  f"the WSGI throughput")
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump({"options": {k: options[k] for k in ("latency", "concurrency", "duration", "workers",
+                                                               "threads")}, "results": results}, f, indent=2)
@@ -0,0 +1,83 @@
+import os
+import time
+import torch
+from PIL import Image
+from django.core.management.base import BaseCommand
+
+from explorer.backends import BACKENDS, PARITY_MIN_COSINE, make_backend, parity
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+PROMPTS = [
+    "a photo of a dog", "a red car parked on the street", "people at the beach",
+    "a birthday cake with candles", "a screenshot of a spreadsheet", "mountains covered in snow",
+    "a cat sleeping on a sofa", "a plate of food",
+]
+
+
+class Command(BaseCommand):
+    help = "Cosine parity against the eager model and throughput for each CLIP inference backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument("folder", nargs="?", default=os.path.join("explorer", "static", "explorer", "concept"))
+        parser.add_argument("--count", type=int, default=32, help="Images in the fixed set (folder is cycled)")
+        parser.add_argument("--batch-size", type=int, default=16)
+        parser.add_argument("--repeats", type=int, default=3)
+        parser.add_argument("--backends", default=",".join(BACKENDS))
+
+    def handle(self, *args, **options):
+        from explorer.clip_model import manager
+
+        files = sorted(os.path.join(options["folder"], f) for f in os.listdir(options["folder"])
+                       if f.lower().endswith(IMAGE_EXTS))
+        if not files:
+            self.stderr.write("No images found")
+            return
+        model, preprocess = manager.load()
+        # Fixed image set: the folder cycled, each pass rotated so rows differ
+        images = []
+        for i in range(options["count"]):
+            with Image.open(files[i % len(files)]) as img:
+                img = img.convert("RGB").rotate(90 * (i // len(files) % 4), expand=True)
+                images.append(preprocess(img))
+        images = torch.stack(images)
+        import clip
+        tokens = clip.tokenize(PROMPTS)
+        batches = torch.split(images, options["batch_size"])
+        self.stdout.write(f"{len(images)} images, {len(PROMPTS)} prompts, model={manager.name}, "
+                          f"device={manager.device}, torch_threads={torch.get_num_threads()}")
+
+        reference = make_backend("eager", model, manager.device)
+        for name in options["backends"].split(","):
+            try:
+                start = time.perf_counter()
+                backend = make_backend(name, model, manager.device, manager.name)
+                # First call of each shape compiles / allocates
+                backend.encode_image(batches[0])
+                backend.encode_text(tokens)
+                backend.encode_text(tokens[:1])
+                build = time.perf_counter() - start
+            except Exception as e:
+                self.stdout.write(f"{name:<12} unavailable: {e}")
+                continue
+            drift = parity(backend, reference, images, tokens)
+
+            start = time.perf_counter()
+            for _ in range(options["repeats"]):
+                for batch in batches:
+                    backend.encode_image(batch)
+            image_rate = options["repeats"] * len(images) / (time.perf_counter() - start)
+            start = time.perf_counter()
+            for _ in range(options["repeats"]):
+                for prompt in tokens:
+                    backend.encode_text(prompt.unsqueeze(0))
+            text_ms = 1000 * (time.perf_counter() - start) / (options["repeats"] * len(tokens))
+
+            status = "parity ok" if drift["ok"] else f"parity below {PARITY_MIN_COSINE}"
+            if not backend.compatible:
+                status += ", versioned separately"
+            elif not drift["ok"]:
+                status += ", but declared compatible!"
+            self.stdout.write(
+                f"{name:<12} build {build:6.2f}s | {image_rate:6.1f} images/s | {text_ms:6.1f} ms/query | "
+                f"cosine image min {drift['image_min']:.5f} mean {drift['image_mean']:.5f}, "
+                f"text min {drift['text_min']:.5f} mean {drift['text_mean']:.5f} | {status}")
@@ -0,0 +1,186 @@
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from functools import partial
+import numpy as np
+from PIL import Image
+from django.core.management.base import BaseCommand, CommandError
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff")
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10  # bytes on macOS, KiB elsewhere
+
+
+def make_photo(path, megapixels, rng, mode="RGB", orientation=None):
+    """A photo-like test image: smooth colour regions plus sensor-like noise, at 4:3."""
+    w = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    h = w * 3 // 4
+    small = rng.integers(0, 256, (9, 12, 3), dtype=np.uint8)
+    base = Image.fromarray(small, "RGB").resize((w, h), Image.BICUBIC)
+    img = Image.blend(base, Image.effect_noise((w, h), 40).convert("RGB"), 0.2)
+    del base
+    if path.endswith(".png"):
+        if mode == "RGBA":
+            alpha = Image.linear_gradient("L").resize((w, h))
+            img.putalpha(alpha)
+        elif mode == "P":
+            img = img.quantize(64)
+            img.info["transparency"] = 0
+        img.save(path)
+        return
+    if mode != "RGB":
+        img = img.convert(mode)
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    img.save(path, "JPEG", quality=90, exif=exif.tobytes())
+
+
+def generate(folder, count, megapixels):
+    """
+    count test photos cycling through the megapixel sizes. Most are plain
+    RGB JPEGs; the others cover what open_image has to fix up: EXIF-rotated,
+    CMYK and greyscale JPEGs, and PNGs with alpha or a transparent palette
+    colour (at most 8MP, PNG at 48MP takes too long to write).
+    """
+    rng = np.random.default_rng(0)
+    variants = [("jpg", "RGB", None), ("jpg", "RGB", 6), ("png", "RGBA", None), ("jpg", "CMYK", None),
+                ("jpg", "RGB", None), ("png", "P", None), ("jpg", "L", None), ("jpg", "RGB", 8)]
+    paths = []
+    for i in range(count):
+        ext, mode, orientation = variants[i % len(variants)]
+        mp = megapixels[i % len(megapixels)]
+        if ext == "png":
+            mp = min(mp, 8)
+        path = os.path.join(folder, f"photo{i:03d}-{mp:g}mp-{mode.lower()}{orientation or ''}.{ext}")
+        make_photo(path, mp, rng, mode, orientation)
+        paths.append(path)
+    return paths
+
+
+def legacy_open(path):
+    """How sync opened images before open_image: full size, orientation and mode left to preprocess."""
+    img = Image.open(path)
+    img.load()
+    return img
+
+
+def run_mode(job):
+    """
+    Embed every path with one decode path, in a fresh process so its peak
+    RSS is its own. Returns (embeddings, seconds, per-image decode seconds,
+    RSS after loading the model, peak RSS) with RSS in MB.
+    """
+    import django
+    django.setup()
+    from django.conf import settings
+    from explorer.clip_model import manager
+    from explorer.decode import decode_size, open_image
+    from explorer.pipeline import EmbeddingPipeline
+
+    mode, gap, paths, workers, batch_size = job
+    manager.warmup()
+    baseline = peak_rss_mb()
+    if mode == "legacy":
+        opener = legacy_open
+    elif mode == "full":
+        opener = partial(open_image, min_size=None)
+    else:
+        settings.EMBED_FAST_DECODE, settings.EMBED_DECODE_GAP = True, gap
+        opener = partial(open_image, min_size=decode_size())
+    pipeline = EmbeddingPipeline(manager.backend, manager.preprocess, manager.device, batch_size=batch_size,
+                                 workers=workers, keep_samples=True, opener=opener)
+    embeddings = np.zeros((len(paths), manager.embed_dim), dtype=np.float32)
+    start = time.perf_counter()
+    for i, embedding, error in pipeline.run(enumerate(paths)):
+        if error is not None:
+            raise CommandError(f"{mode}: {paths[i]}: {error}")
+        embeddings[i] = embedding
+    seconds = time.perf_counter() - start
+    return embeddings, seconds, pipeline.decode.samples, baseline, peak_rss_mb()
+
+
+def cosines(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+class Command(BaseCommand):
+    help = ("Images/sec, decode time and peak RSS of embedding large photos with the old decode (full "
+            "size, as opened), open_image at full size and open_image at reduced size (EMBED_DECODE_GAP "
+            "values), each in its own process, and the embeddings' cosine similarity to the full-size ones.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("folder", nargs="?", help="Photos to use (default: generate test photos)")
+        parser.add_argument("--count", type=int, default=32, help="Photos to generate")
+        parser.add_argument("--megapixels", default="12,24,48", help="Sizes of the generated photos")
+        parser.add_argument("--gaps", default="1,2", help="EMBED_DECODE_GAP values to try")
+        parser.add_argument("--skip-legacy", action="store_true")
+        parser.add_argument("--workers", type=int, default=None)
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        scratch = None
+        if options["folder"]:
+            paths = sorted(os.path.join(options["folder"], f) for f in os.listdir(options["folder"])
+                           if f.lower().endswith(IMAGE_EXTS))
+            if not paths:
+                raise CommandError(f"No images in {options['folder']}")
+        else:
+            scratch = tempfile.mkdtemp(prefix="bench_decode_")
+            start = time.perf_counter()
+            paths = generate(scratch, options["count"], [float(m) for m in options["megapixels"].split(",")])
+            self.stdout.write(f"Generated {len(paths)} photos in {scratch} ({time.perf_counter() - start:.0f}s)")
+        try:
+            self._run(paths, options)
+        finally:
+            if scratch:
+                shutil.rmtree(scratch, ignore_errors=True)
+
+    def _run(self, paths, options):
+        megapixels = []
+        for path in paths:
+            with Image.open(path) as img:
+                megapixels.append(img.width * img.height / 1e6)
+        self.stdout.write(f"{len(paths)} photos, {np.mean(megapixels):.1f} MP average, "
+                          f"{sum(os.path.getsize(p) for p in paths) / 2 ** 20:.0f} MB of files")
+
+        modes = ([] if options["skip_legacy"] else [("legacy", None)]) + [("full", None)]
+        modes += [("fast", float(g)) for g in options["gaps"].split(",") if g]
+        # spawn: a forked child would inherit this process's peak RSS (and its torch threads)
+        context = multiprocessing.get_context("spawn")
+        results = {}
+        for mode, gap in modes:
+            with context.Pool(1) as pool:
+                job = (mode, gap, paths, options["workers"], options["batch_size"])
+                results[(mode, gap)] = pool.apply(run_mode, (job,))
+
+        full = results[("full", None)][0]
+        self.stdout.write(f"{'decode':<12} {'images/s':>9} {'decode p50 ms':>14} {'decode p95 ms':>14} "
+                          f"{'peak RSS MB':>12} {'+model MB':>10} {'cos mean':>9} {'cos min':>8}")
+        for (mode, gap), (embeddings, seconds, samples, baseline, peak) in results.items():
+            label = f"fast gap={gap:g}" if gap else mode
+            p50, p95 = np.percentile(np.asarray(samples) * 1000, [50, 95])
+            cos = cosines(embeddings, full)
+            self.stdout.write(f"{label:<12} {len(paths) / seconds:9.2f} {p50:14.1f} {p95:14.1f} {peak:12.0f} "
+                              f"{peak - baseline:10.0f} {cos.mean():9.4f} {cos.min():8.4f}")
+        if ("legacy", None) in results:
+            changed = cosines(results[("legacy", None)][0], full) < 0.999
+            self.stdout.write(f"{changed.sum()} photos embed differently now that orientation and mode are "
+                              f"handled: " + ", ".join(os.path.basename(p) for p, c in zip(paths, changed) if c))
+        self.stdout.write("cos = cosine similarity to the full-size open_image embedding of the same photo; "
+                          "+model MB = peak RSS above the RSS after loading the model")
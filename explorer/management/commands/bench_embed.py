@@ -0,0 +1,52 @@
+import os
+import time
+from PIL import Image
+from django.core.management.base import BaseCommand
+
+from explorer.pipeline import EmbeddingPipeline
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+class Command(BaseCommand):
+    help = "Images/sec of the sync embedding pipeline vs the old one-image-at-a-time loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument("folder", nargs="?", default=os.path.join("explorer", "static", "explorer", "concept"))
+        parser.add_argument("--count", type=int, default=256, help="Images per run (folder is cycled)")
+        parser.add_argument("--batch-sizes", default="1,8,32,64")
+        parser.add_argument("--workers", default="1,2,4,8")
+        parser.add_argument("--skip-legacy", action="store_true")
+
+    def handle(self, *args, **options):
+        from explorer.clip_model import manager
+
+        model, preprocess = manager.backend, manager.preprocess
+        device = manager.device
+
+        files = sorted(os.path.join(options["folder"], f) for f in os.listdir(options["folder"])
+                       if f.lower().endswith(IMAGE_EXTS))
+        if not files:
+            self.stderr.write("No images found")
+            return
+        paths = [files[i % len(files)] for i in range(options["count"])]
+        self.stdout.write(f"{len(paths)} images from {len(files)} files, device={device}, "
+                          f"backend={manager.backend_name}, cpus={os.cpu_count()}")
+
+        if not options["skip_legacy"]:
+            start = time.perf_counter()
+            for path in paths:
+                img = preprocess(Image.open(path)).unsqueeze(0)
+                model.encode_image(img).numpy()
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"legacy serial loop: {len(paths) / elapsed:.1f} images/s")
+
+        for workers in [int(w) for w in options["workers"].split(",")]:
+            for batch_size in [int(b) for b in options["batch_sizes"].split(",")]:
+                pipeline = EmbeddingPipeline(model, preprocess, device, batch_size=batch_size, workers=workers)
+                start = time.perf_counter()
+                for _ in pipeline.run(enumerate(paths)):
+                    pass
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"workers={workers:<2} batch={batch_size:<3} {len(paths) / elapsed:7.1f} images/s | "
+                                  f"{pipeline.decode} | {pipeline.encode}")
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.embedding_store import open_store, user_cache_dir
+from explorer.management.commands.bench_ann import synthetic
+from explorer.quantize import CODECS
+from explorer.search import SearchIndex, top_k
+
+
+class Command(BaseCommand):
+    help = ("Memory per million images, recall@k against float32 and query latency of the "
+            "SEARCH_QUANTIZATION modes, with and without exact re-ranking.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=200000)
+        parser.add_argument("--user", help="Benchmark a real user's embedding store instead")
+        parser.add_argument("--queries", type=int, default=100)
+        parser.add_argument("-k", type=int, default=20)
+        parser.add_argument("--modes", default="int8,binary")
+        parser.add_argument("--rerank", default="0,200,2000,10000",
+                            help="Comma-separated re-rank depths (0 = approximate scores only)")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        k = options["k"]
+        modes = [m for m in options["modes"].split(",") if m]
+        for mode in modes:
+            if mode not in CODECS:
+                raise CommandError(f"Unknown mode {mode!r} ({', '.join(CODECS)})")
+        if options["user"]:
+            ids, names, vectors = open_store(user_cache_dir(options["user"])).matrix()
+        else:
+            n = options["size"]
+            vectors = synthetic(n, 512, max(n // 500, 8), rng).astype(np.float16)
+            ids = [f"item{i}" for i in range(n)]
+            names = ids
+        start = time.perf_counter()
+        exact_index = SearchIndex(ids, names, vectors)
+        build_s = time.perf_counter() - start
+        # Queries are perturbed library vectors so they have true neighbours
+        picks = rng.choice(len(exact_index), min(options["queries"], len(exact_index)), replace=False)
+        queries = exact_index.matrix[picks] + 0.3 * rng.standard_normal(
+            (len(picks), exact_index.matrix.shape[1])).astype(np.float32)
+
+        truth, times = [], []
+        for q in queries:
+            start = time.perf_counter()
+            truth.append(set(top_k(exact_index.score(q), k).tolist()))
+            times.append(time.perf_counter() - start)
+        per_million = 1e6 / len(exact_index) / 2 ** 20
+        self.stdout.write(f"{len(exact_index)} vectors, {len(queries)} queries, recall@{k} against float32; "
+                          f"re-ranked rows come from a float16 memmap ({2 * vectors.shape[1]} bytes per image "
+                          f"on disk)")
+        self.stdout.write(f"{'mode':<8} {'rerank':>7} {'MB':>8} {'MB/1M':>8} {'recall':>7} {'p50 ms':>8} "
+                          f"{'p95 ms':>8} {'build s':>8}")
+        self._report("float32", "-", exact_index.vector_nbytes, per_million, 1.0, times, build_s)
+        del exact_index
+
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode in modes:
+                start = time.perf_counter()
+                index = SearchIndex(ids, names, vectors, quantization=mode,
+                                    rerank_path=os.path.join(tmp, f"{mode}.npy"))
+                build_s = time.perf_counter() - start
+                for depth in [int(d) for d in options["rerank"].split(",")]:
+                    index.rerank = depth
+                    recalls, times = [], []
+                    for q, expected in zip(queries, truth):
+                        start = time.perf_counter()
+                        found = top_k(index.score(q), k)
+                        times.append(time.perf_counter() - start)
+                        recalls.append(len(expected & set(found.tolist())) / k)
+                    self._report(mode, str(depth), index.vector_nbytes, per_million, float(np.mean(recalls)),
+                                 times, build_s)
+                del index
+
+    def _report(self, mode, rerank, nbytes, per_million, recall, times, build_s):
+        ms = np.asarray(times) * 1000
+        self.stdout.write(f"{mode:<8} {rerank:>7} {nbytes / 2 ** 20:8.1f} {nbytes * per_million:8.1f} "
+                          f"{recall:7.3f} {np.percentile(ms, 50):8.2f} {np.percentile(ms, 95):8.2f} "
+                          f"{build_s:8.1f}")
@@ -0,0 +1,99 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+
+from explorer.search import SearchIndex, rank
+from explorer.text_index import TextIndex
+
+
+def legacy_search(embedding_cache, names, text_features, query):
+    """The per-item Python loop home() used before the vectorized engine."""
+    query_lower = query.lower()
+    filename_matches, semantic_matches, matched_ids = [], [], set()
+    for fid, name in names.items():
+        if query_lower in name.lower():
+            filename_matches.append((name, reverse('proxy_image', args=[fid]), 1.0, None))
+            matched_ids.add(fid)
+    text_norm = text_features / np.linalg.norm(text_features)
+    for fid, name in names.items():
+        if fid in matched_ids:
+            continue
+        image_vector = embedding_cache[fid]
+        image_norm = image_vector / np.linalg.norm(image_vector)
+        score = np.dot(text_norm, image_norm.T).item()
+        semantic_matches.append((name, reverse('proxy_image', args=[fid]), score, None))
+    semantic_matches.sort(key=lambda x: -x[2])
+    filename_matches.sort(key=lambda x: x[0].lower())
+    return filename_matches + semantic_matches
+
+
+def make_row(index, row, score):
+    return (index.names[row], reverse('proxy_image', args=[index.ids[row]]), score, None)
+
+
+class Command(BaseCommand):
+    help = ("Benchmark first-page search latency: legacy per-item loop vs vectorized top-k fused with "
+            "the filename index, and a linear filename scan vs the inverted index.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                            help="Comma-separated library sizes")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--legacy-max", type=int, default=100000,
+                            help="Skip the legacy loop above this size")
+        parser.add_argument("--dim", type=int, default=512)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        query = "sunset"
+        self.stdout.write(f"{'images':>9} {'legacy ms':>11} {'vectorized ms':>14} {'index build ms':>15} "
+                          f"{'speedup':>8} {'name scan ms':>13} {'name index ms':>14} {'name build ms':>14}")
+        for n in [int(s) for s in options["sizes"].split(",")]:
+            vectors = rng.standard_normal((n, options["dim"])).astype(np.float16)
+            ids = [f"item{i:07d}" for i in range(n)]
+            # One image in 500 matches the query by name
+            names = [f"sunset_{i:07d}.jpg" if i % 500 == 0 else f"IMG_{i:07d}.jpg" for i in range(n)]
+            folders = [f"Pictures/{2000 + i % 25}" for i in range(n)]
+            text_features = rng.standard_normal((1, options["dim"])).astype(np.float32)
+
+            start = time.perf_counter()
+            index = SearchIndex(ids, names, vectors)
+            build_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            text_index = TextIndex.build(ids, names, folders)
+            text_build_ms = (time.perf_counter() - start) * 1000
+
+            times = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                results = rank(index, text_features, query, None, make_row, text_index=text_index)
+                results[0:20]
+                times.append((time.perf_counter() - start) * 1000)
+            vec_ms = float(np.median(times))
+
+            scan, lookup = [], []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                [name for name in names if query in name.lower()]
+                scan.append((time.perf_counter() - start) * 1000)
+                start = time.perf_counter()
+                text_index.search(query)
+                lookup.append((time.perf_counter() - start) * 1000)
+
+            legacy_ms = None
+            if n <= options["legacy_max"]:
+                cache = {fid: vectors[i:i + 1] for i, fid in enumerate(ids)}
+                mapping = dict(zip(ids, names))
+                repeat = max(1, min(options["repeat"], 1000000 // n))
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    legacy_search(cache, mapping, text_features, query)[0:20]
+                    times.append((time.perf_counter() - start) * 1000)
+                legacy_ms = float(np.median(times))
+
+            legacy_col = f"{legacy_ms:11.1f}" if legacy_ms is not None else f"{'-':>11}"
+            speedup = f"{legacy_ms / vec_ms:7.0f}x" if legacy_ms is not None else f"{'-':>8}"
+            self.stdout.write(f"{n:>9} {legacy_col} {vec_ms:14.2f} {build_ms:15.1f} {speedup} "
+                              f"{float(np.median(scan)):13.2f} {float(np.median(lookup)):14.2f} {text_build_ms:14.1f}")
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import time
+import uuid
+from django.core.management.base import BaseCommand
+
+IMPORT_SNIPPET = (
+    "import time, django; start = time.perf_counter(); django.setup(); "
+    "import explorer.views; print(time.perf_counter() - start)"
+)
+
+
+class Command(BaseCommand):
+    help = "Process startup cost and first-query latency of the CLIP model manager."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--warmup", action="store_true", help="Call manager.warmup() before the first query")
+        parser.add_argument("--queries", type=int, default=5, help="Queries timed after the first one")
+
+    def handle(self, *args, **options):
+        # What every manage.py command / worker pays: settings plus the view modules
+        result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], capture_output=True, text=True,
+                                env=dict(os.environ), cwd=os.getcwd())
+        if result.returncode == 0:
+            self.stdout.write(f"import explorer.views (fresh process): {float(result.stdout.split()[-1]):.2f}s")
+        else:
+            self.stderr.write(result.stderr.strip().splitlines()[-1])
+
+        from explorer.clip_model import encode_text, manager
+
+        if options["warmup"]:
+            timings = manager.warmup()
+            self.stdout.write(f"warmup: load {timings['load']:.2f}s, first forward passes {timings['warmup']:.2f}s")
+
+        # Unique prompts so neither cache layer answers
+        prompts = [f"a photo of {uuid.uuid4().hex}" for _ in range(options["queries"] + 1)]
+        start = time.perf_counter()
+        encode_text(prompts[0])
+        first = time.perf_counter() - start
+        latencies = []
+        for prompt in prompts[1:]:
+            start = time.perf_counter()
+            encode_text(prompt)
+            latencies.append(time.perf_counter() - start)
+        self.stdout.write(f"model {manager.name} on {manager.device}, load {manager.load_seconds:.2f}s")
+        self.stdout.write(f"first query: {first * 1000:.0f} ms")
+        if latencies:
+            self.stdout.write(f"next {len(latencies)} queries: {1000 * sum(latencies) / len(latencies):.0f} ms avg")
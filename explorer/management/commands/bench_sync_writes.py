@@ -0,0 +1,114 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from contextlib import nullcontext
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from explorer.embedding_store import open_store
+from explorer.storage import user_lock
+
+
+def vector_for(file_id, dim=512):
+    """A vector derived from the id, so the store can be checked afterwards."""
+    seed = sum(ord(c) * 31 ** i for i, c in enumerate(file_id)) % 2 ** 32
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float16)
+
+
+def run_sync(job):
+    """
+    One simulated sync in its own process: open the store, append items in
+    checkpoints (as add_items does), compact. Returns (seconds, lock wait,
+    whether it failed).
+    """
+    user_dir, worker, items, checkpoint, encode_ms, locked = job
+    start = time.perf_counter()
+    waited, failed = 0.0, False
+    with user_lock(user_dir) if locked else nullcontext():
+        waited = time.perf_counter() - start
+        try:
+            store = open_store(user_dir)
+            if locked:
+                store.recover()
+            ids = [f"w{worker}-{i}" for i in range(items)]
+            for at in range(0, items, checkpoint):
+                batch = ids[at:at + checkpoint]
+                time.sleep(encode_ms * len(batch) / 1000)  # stands in for download + encode
+                store.add_many([(fid, f"{fid}.jpg", vector_for(fid)) for fid in batch], durable=True)
+            store.compact()
+        except Exception:  # only expected without the lock
+            failed = True
+    return time.perf_counter() - start, waited, failed
+
+
+def check(user_dir, expected):
+    """(missing, wrong) ids in the user's store after the syncs."""
+    try:
+        store = open_store(user_dir)
+    except Exception:
+        return len(expected), 0
+    missing = wrong = 0
+    for fid in expected:
+        vec = store.get(fid)
+        if vec is None:
+            missing += 1
+        elif not np.array_equal(vec, vector_for(fid)):
+            wrong += 1
+    return missing, wrong
+
+
+class Command(BaseCommand):
+    help = ("Throughput of concurrent syncs through the storage layer (per-user locks, fsynced "
+            "checkpoints, journaled compaction), each sync in its own process, and a check that "
+            "every stored vector survived.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", default="1,2,4,8", help="Concurrent syncs to try")
+        parser.add_argument("--items", type=int, default=2000, help="Images per sync")
+        parser.add_argument("--checkpoints", default="32,256,2048", help="Images per checkpoint to try")
+        parser.add_argument("--encode-ms", type=float, default=0.0,
+                            help="Simulated download + encode time per image")
+        parser.add_argument("--no-lock", action="store_true",
+                            help="Also run same-user syncs without the lock, to see what it prevents")
+        parser.add_argument("--dir", default=None, help="Scratch directory (default: a temporary one)")
+
+    def handle(self, *args, **options):
+        root = options["dir"] or tempfile.mkdtemp(prefix="bench_sync_")
+        context = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+        self.stdout.write(f"{options['items']} images per sync, {options['encode_ms']:.1f} ms simulated work "
+                          f"per image, scratch in {root}")
+        self.stdout.write(f"{'users':<9} {'procs':>5} {'ckpt':>6} {'images/s':>9} {'sync p50 s':>11} "
+                          f"{'sync max s':>11} {'lock wait s':>12} {'failed':>7} {'missing':>8} {'wrong':>6}")
+        modes = [("distinct", True), ("same", True)]
+        if options["no_lock"]:
+            modes.append(("same", False))
+        try:
+            for checkpoint in [int(c) for c in options["checkpoints"].split(",")]:
+                for procs in [int(p) for p in options["processes"].split(",")]:
+                    for users, locked in modes:
+                        self._run(context, root, users, locked, procs, checkpoint, options)
+        finally:
+            if not options["dir"]:
+                shutil.rmtree(root, ignore_errors=True)
+
+    def _run(self, context, root, users, locked, procs, checkpoint, options):
+        shutil.rmtree(root, ignore_errors=True)
+        dirs = [os.path.join(root, f"user{w}" if users == "distinct" else "user") for w in range(procs)]
+        jobs = [(d, w, options["items"], checkpoint, options["encode_ms"], locked) for w, d in enumerate(dirs)]
+        start = time.perf_counter()
+        with context.Pool(procs) as pool:
+            results = pool.map(run_sync, jobs)
+        seconds = time.perf_counter() - start
+        missing = wrong = 0
+        for d in set(dirs):
+            expected = [f"w{w}-{i}" for w, jd in enumerate(dirs) if jd == d for i in range(options["items"])]
+            m, w = check(d, expected)
+            missing += m
+            wrong += w
+        times = [t for t, _, _ in results]
+        label = users if locked else f"{users}*"  # * = without the lock
+        self.stdout.write(f"{label:<9} {procs:>5} {checkpoint:>6} {procs * options['items'] / seconds:9.0f} "
+                          f"{np.median(times):11.2f} {max(times):11.2f} {sum(w for _, w, _ in results):12.2f} "
+                          f"{sum(f for _, _, f in results):>7} {missing:>8} {wrong:>6}")
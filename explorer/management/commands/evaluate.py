@@ -0,0 +1,318 @@
+import json
+import os
+import platform
+import time
+from datetime import datetime, timezone
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.content import file_hash
+from explorer.pipeline import EmbeddingPipeline
+from explorer.search import SearchIndex, rank
+from explorer.text_index import TextIndex
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+# --------- Inputs ---------
+def find_images(folder):
+    """Relative paths ("sub/dir/x.jpg") of the images under folder, sorted."""
+    found = []
+    for root, _, files in os.walk(folder):
+        for f in files:
+            if f.lower().endswith(IMAGE_EXTS):
+                found.append(os.path.relpath(os.path.join(root, f), folder).replace(os.sep, "/"))
+    return sorted(found)
+
+
+def load_queries(path):
+    """
+    Labeled queries as [(query, [relevant image, ...])]. Either JSON,
+    [{"query": "a dog on a beach", "relevant": ["dogs/beach.jpg"]}, ...],
+    or TSV lines "query<TAB>image|image" ("#" lines are comments).
+    Images are given by path relative to the folder, or by bare filename.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.lower().endswith(".json"):
+        return [(q["query"], list(q["relevant"])) for q in json.loads(text)]
+    queries = []
+    for line in text.splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        query, _, relevant = line.partition("\t")
+        queries.append((query.strip(), [r.strip() for r in relevant.split("|") if r.strip()]))
+    return queries
+
+
+def relevance(queries, ids):
+    """Row indices of each query's relevant images, plus any labels that match no image."""
+    row_of = {fid: row for row, fid in enumerate(ids)}
+    by_name = {}
+    for row, fid in enumerate(ids):
+        by_name.setdefault(fid.rpartition("/")[2], []).append(row)
+    relevant, unknown = [], []
+    for _, labels in queries:
+        rows = set()
+        for label in labels:
+            if label in row_of:
+                rows.add(row_of[label])
+            elif label in by_name:
+                rows.update(by_name[label])
+            else:
+                unknown.append(label)
+        relevant.append(rows)
+    return relevant, unknown
+
+
+# --------- Metrics ---------
+def retrieval_metrics(ranked, relevant, ks):
+    """
+    Hits@k, MRR and nDCG@k over all queries at once. ranked is a
+    (queries, depth) array of row indices (-1 pads short rankings),
+    relevant a list of row sets. Queries without relevant images are
+    left out. Returns (summary dict, per-query dict of arrays).
+    """
+    keep = np.asarray([bool(r) for r in relevant])
+    ranked = ranked[keep]
+    relevant = [r for r in relevant if r]
+    depth = ranked.shape[1]
+    hit = np.zeros(ranked.shape, dtype=bool)
+    for q, rows in enumerate(relevant):
+        hit[q] = np.isin(ranked[q], list(rows))
+    n_relevant = np.asarray([len(r) for r in relevant])
+    first = np.where(hit.any(axis=1), hit.argmax(axis=1) + 1, 0)
+    reciprocal = np.where(first > 0, 1.0 / np.maximum(first, 1), 0.0)
+    discounts = 1.0 / np.log2(np.arange(2, depth + 2))
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])
+    summary = {"queries": int(len(relevant)), "mrr": float(reciprocal.mean()) if len(relevant) else 0.0}
+    per_query = {"first_rank": first, "reciprocal_rank": reciprocal}
+    for k in ks:
+        k_hit = hit[:, :k]
+        hits = k_hit.any(axis=1)
+        ndcg = (k_hit * discounts[:k]).sum(axis=1) / ideal[np.minimum(n_relevant, k)]
+        summary[f"hits@{k}"] = float(hits.mean()) if len(relevant) else 0.0
+        summary[f"recall@{k}"] = float((k_hit.sum(axis=1) / n_relevant).mean()) if len(relevant) else 0.0
+        summary[f"ndcg@{k}"] = float(ndcg.mean()) if len(relevant) else 0.0
+        per_query[f"ndcg@{k}"] = ndcg
+    return summary, per_query
+
+
+def latency(samples):
+    """Percentiles of a list of durations in seconds, reported in ms."""
+    if not samples:
+        return None
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"n": int(len(ms)), "mean_ms": float(ms.mean()), "p50_ms": float(p50),
+            "p95_ms": float(p95), "p99_ms": float(p99), "max_ms": float(ms.max())}
+
+
+# --------- Embedding cache ---------
+def load_cached_vectors(path, version):
+    """{content hash: vector} saved by an earlier run with the same embedding version."""
+    if not path or not os.path.exists(path):
+        return {}
+    with np.load(path, allow_pickle=False) as data:
+        if str(data["version"]) != version:
+            return {}
+        return dict(zip(data["hashes"].tolist(), data["vectors"]))
+
+
+def save_cached_vectors(path, version, vectors):
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, version=np.asarray(version), hashes=np.asarray(list(vectors)),
+             vectors=np.stack(list(vectors.values())).astype(np.float32))
+    os.replace(tmp, path)
+
+
+class Command(BaseCommand):
+    help = ("Evaluate retrieval quality (Hits@k, recall@k, MRR, nDCG@k) on a local image folder and a "
+            "labeled query file, and benchmark embed / index build / search latency. Writes JSON "
+            "that --compare can diff against a later run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("folder", nargs="?", default=os.path.join("explorer", "static", "explorer", "concept"))
+        parser.add_argument("--queries", help="Labeled query file (.json or .tsv); default <folder>/queries.json")
+        parser.add_argument("--k", default="1,5,10", help="Comma-separated cutoffs")
+        parser.add_argument("--modes", default="clip,rrf,blend",
+                            help="Rankings to score: clip (similarity only), rrf / blend (fused with filenames)")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed repetitions of index build and search")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--workers", type=int, default=None)
+        parser.add_argument("--embedding-cache", default=None,
+                            help="npz of image vectors by content hash, reused between runs (skips re-encoding)")
+        parser.add_argument("--output", "-o", default=None, help="Write the results as JSON here")
+        parser.add_argument("--compare", default=None, help="Earlier --output JSON to diff against")
+        parser.add_argument("--per-query", action="store_true", help="Include per-query ranks in the JSON")
+
+    def handle(self, *args, **options):
+        import clip
+        from explorer.clip_model import manager
+
+        folder = options["folder"]
+        ks = sorted({int(k) for k in options["k"].split(",")})
+        modes = [m.strip() for m in options["modes"].split(",") if m.strip()]
+        for mode in modes:
+            if mode not in ("clip", "rrf", "blend"):
+                raise CommandError(f"Unknown mode {mode!r}")
+        query_path = options["queries"] or os.path.join(folder, "queries.json")
+        if not os.path.exists(query_path):
+            raise CommandError(f"No query file at {query_path} (pass --queries)")
+        queries = load_queries(query_path)
+        ids = find_images(folder)
+        if not ids or not queries:
+            raise CommandError("Need at least one image and one query")
+        relevant, unknown = relevance(queries, ids)
+        if unknown:
+            self.stderr.write(f"{len(unknown)} labels match no image, e.g. {unknown[:3]}")
+        names = [fid.rpartition("/")[2] for fid in ids]
+        folders = [fid.rpartition("/")[0] for fid in ids]
+        version = manager.embedding_version
+        self.stdout.write(f"{len(ids)} images, {len(queries)} queries, model={version}, "
+                          f"backend={manager.backend_name}, device={manager.device}")
+
+        # --------- Embed images ---------
+        paths = [os.path.join(folder, fid) for fid in ids]
+        hashes = [file_hash(p) for p in paths]
+        cached = load_cached_vectors(options["embedding_cache"], version)
+        vectors = {h: cached[h] for h in hashes if h in cached}
+        # Identical files are encoded once
+        todo = list({h: p for h, p in zip(hashes, paths) if h not in vectors}.items())
+        pipeline = EmbeddingPipeline(manager.backend, manager.preprocess, manager.device,
+                                     batch_size=options["batch_size"], workers=options["workers"], keep_samples=True)
+        start = time.perf_counter()
+        failed = 0
+        for key, vector, error in pipeline.run(todo):
+            if error is not None:
+                failed += 1
+                self.stderr.write(f"Could not embed {dict(todo)[key]}: {error}")
+            else:
+                vectors[key] = vector
+        embed_seconds = time.perf_counter() - start
+        if todo and options["embedding_cache"]:
+            save_cached_vectors(options["embedding_cache"], version, vectors)
+        keep = [i for i, h in enumerate(hashes) if h in vectors]
+        if len(keep) < len(ids):
+            # Ranks refer to rows, so rebuild the labels over the images that embedded
+            ids, names, folders, hashes = ([seq[i] for i in keep] for seq in (ids, names, folders, hashes))
+            relevant, _ = relevance(queries, ids)
+        matrix = np.stack([vectors[h] for h in hashes])
+        self.stdout.write(f"embedded {len(todo) - failed} images in {embed_seconds:.2f}s "
+                          f"({len(hashes) - len(todo)} from cache) | {pipeline.decode} | {pipeline.encode}")
+
+        # --------- Embed queries ---------
+        query_vectors, text_samples = [], []
+        for query, _ in queries:
+            start = time.perf_counter()
+            query_vectors.append(manager.backend.encode_text(clip.tokenize([query])).numpy()[0])
+            text_samples.append(time.perf_counter() - start)
+
+        # --------- Index build ---------
+        build_samples, text_build_samples = [], []
+        for _ in range(max(1, options["repeat"])):
+            start = time.perf_counter()
+            index = SearchIndex(ids, names, matrix)
+            build_samples.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            text_index = TextIndex.build(ids, names, folders)
+            text_build_samples.append(time.perf_counter() - start)
+
+        # --------- Search ---------
+        depth = max(ks)
+        results = {}
+        for mode in modes:
+            ranked = np.full((len(queries), depth), -1, dtype=np.int64)
+            samples = []
+            for _ in range(max(1, options["repeat"])):
+                for q, ((query, _), vector) in enumerate(zip(queries, query_vectors)):
+                    start = time.perf_counter()
+                    if mode == "clip":
+                        found = rank(index, vector)
+                    else:
+                        found = rank(index, vector, query, text_index=text_index, fusion=mode)
+                    rows, _ = found.ranked_rows(depth)
+                    samples.append(time.perf_counter() - start)
+                    ranked[q, :len(rows)] = rows
+            summary, per_query = retrieval_metrics(ranked, relevant, ks)
+            results[mode] = {"metrics": summary, "latency": latency(samples),
+                             "queries_per_s": len(samples) / sum(samples) if sum(samples) else None}
+            if options["per_query"]:
+                labeled = [q for q, r in zip(queries, relevant) if r]
+                results[mode]["per_query"] = [
+                    {"query": query, "first_rank": int(per_query["first_rank"][i]),
+                     "top": [ids[r] for r in ranked_row if r >= 0]}
+                    for i, ((query, _), ranked_row) in enumerate(zip(labeled, ranked[[bool(r) for r in relevant]]))]
+
+        report = {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "folder": folder,
+            "queries_file": query_path,
+            "images": len(ids),
+            "queries": len(queries),
+            "ks": ks,
+            "model": {"version": version, "backend": manager.backend_name, "device": manager.device},
+            "host": {"python": platform.python_version(), "cpus": os.cpu_count()},
+            "embed": {
+                "images_encoded": len(todo) - failed,
+                "images_from_cache": len(hashes) - len(todo),
+                "images_per_s": (len(todo) - failed) / embed_seconds if todo and embed_seconds else None,
+                "decode_latency": latency(pipeline.decode.samples),
+                "batch_latency": latency(pipeline.encode.samples),
+                "batch_size": pipeline.batch_size,
+                "query_latency": latency(text_samples),
+            },
+            "index_build": {"similarity": latency(build_samples), "filename": latency(text_build_samples)},
+            "search": results,
+        }
+        self.print_report(report)
+        if options["compare"]:
+            with open(options["compare"], "r", encoding="utf-8") as f:
+                self.print_comparison(json.load(f), report)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+    # --------- Output ---------
+    def print_report(self, report):
+        def row(label, stats):
+            if stats:
+                self.stdout.write(f"  {label:<22} p50 {stats['p50_ms']:9.2f}ms  p95 {stats['p95_ms']:9.2f}ms  "
+                                  f"p99 {stats['p99_ms']:9.2f}ms  (n={stats['n']})")
+
+        embed = report["embed"]
+        rate = f"{embed['images_per_s']:.1f} images/s" if embed["images_per_s"] else "all from cache"
+        self.stdout.write(f"Embed: {rate}")
+        row("image decode", embed["decode_latency"])
+        row(f"image batch (<= {embed['batch_size']})", embed["batch_latency"])
+        row("query text", embed["query_latency"])
+        self.stdout.write("Index build:")
+        row("similarity", report["index_build"]["similarity"])
+        row("filename", report["index_build"]["filename"])
+        cols = ["mrr"] + [f"{m}@{k}" for k in report["ks"] for m in ("hits", "ndcg")]
+        self.stdout.write("Search:")
+        self.stdout.write(f"  {'mode':<6}" + "".join(f"{c:>9}" for c in cols) + f"{'p50 ms':>9}{'p99 ms':>9}{'q/s':>9}")
+        for mode, result in report["search"].items():
+            m, lat = result["metrics"], result["latency"]
+            self.stdout.write(f"  {mode:<6}" + "".join(f"{m[c]:9.3f}" for c in cols)
+                              + f"{lat['p50_ms']:9.2f}{lat['p99_ms']:9.2f}{result['queries_per_s']:9.0f}")
+
+    def print_comparison(self, old, new):
+        """Metric and latency deltas against an earlier report (positive = this run is higher)."""
+        self.stdout.write(f"Compared with {old.get('created')} ({old.get('model', {}).get('version')}, "
+                          f"{old.get('images')} images, {old.get('queries')} queries):")
+        for mode, result in new["search"].items():
+            before = old.get("search", {}).get(mode)
+            if not before:
+                continue
+            parts = []
+            for name, value in result["metrics"].items():
+                if name != "queries" and name in before["metrics"]:
+                    parts.append(f"{name} {value - before['metrics'][name]:+.3f}")
+            if before.get("latency") and result["latency"]:
+                parts.append(f"p50 {result['latency']['p50_ms'] - before['latency']['p50_ms']:+.2f}ms")
+                parts.append(f"p99 {result['latency']['p99_ms'] - before['latency']['p99_ms']:+.2f}ms")
+            self.stdout.write(f"  {mode:<6} " + ", ".join(parts))
+        if old.get("embed", {}).get("images_per_s") and new["embed"]["images_per_s"]:
+            self.stdout.write(f"  embed  {new['embed']['images_per_s'] - old['embed']['images_per_s']:+.1f} images/s")
@@ -0,0 +1,49 @@
+import os
+import pickle
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from explorer.embedding_store import (
+    LEGACY_EMBEDDINGS, STORE_DIRNAME, EmbeddingStore, import_embeddings,
+    import_legacy_pickles, user_cache_dir,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Import pickled CLIP embeddings into the memory-mapped embedding store. "
+        "With no arguments every user dir under ONEDRIVE_CACHE_DIR that still has "
+        "a clip_embeddings.pkl is imported. With --user and a pickle path (e.g. the "
+        "root-level clip_cache.pkl) that dict is imported into one user's store."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pickle", nargs="?", help="Pickled {file_id: embedding} dict")
+        parser.add_argument("--user", help="OneDrive user id that owns the embeddings")
+        parser.add_argument("--names", help="Pickled {file_id: file_name} mapping")
+
+    def handle(self, *args, **options):
+        if options["pickle"]:
+            if not options["user"]:
+                raise CommandError("--user is required when importing a pickle file")
+            with open(options["pickle"], "rb") as f:
+                embeddings = pickle.load(f)
+            names = {}
+            if options["names"]:
+                with open(options["names"], "rb") as f:
+                    names = pickle.load(f)
+            user_dir = user_cache_dir(options["user"])
+            store = EmbeddingStore(os.path.join(user_dir, STORE_DIRNAME))
+            count = import_embeddings(store, embeddings, names)
+            self.stdout.write(f"Imported {count} embeddings into {store.path}")
+            return
+
+        root = settings.ONEDRIVE_CACHE_DIR
+        if not os.path.isdir(root):
+            self.stdout.write(f"No cache directory at {root}")
+            return
+        for user_id in sorted(os.listdir(root)):
+            user_dir = os.path.join(root, user_id)
+            if os.path.exists(os.path.join(user_dir, LEGACY_EMBEDDINGS)):
+                count = import_legacy_pickles(user_dir)
+                self.stdout.write(f"{user_id}: imported {count} embeddings")
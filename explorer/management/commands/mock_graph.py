@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from explorer.mock_graph import MockGraph
+
+
+class Command(BaseCommand):
+    help = "Serve a local folder as a stand-in Microsoft Graph OneDrive (point GRAPH_API_BASE at it)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("folder")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+        parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+        parser.add_argument("--retry-after", type=int, default=1)
+
+    def handle(self, *args, **options):
+        graph = MockGraph(options["folder"], port=options["port"], latency=options["latency"],
+                          throttle_rate=options["throttle_rate"], retry_after=options["retry_after"])
+        self.stdout.write(f"Mock Graph serving {graph.root} at {graph.base_url}")
+        try:
+            graph.server.serve_forever()
+        except KeyboardInterrupt:
+            graph.stop()
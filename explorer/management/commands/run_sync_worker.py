@@ -0,0 +1,39 @@
+import multiprocessing
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from explorer.clip_model import manager
+from explorer.jobs import work
+
+
+def _worker(poll_interval, once):
+    # Load the model before claiming jobs so the first job's heartbeat isn't delayed
+    manager.warmup()
+    work(poll_interval, once)
+
+
+class Command(BaseCommand):
+    help = "Run background OneDrive sync workers against the SyncJob table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--processes", type=int, default=1, help="Worker processes to start")
+        parser.add_argument("--poll", type=float, default=2.0, help="Seconds between polls when idle")
+        parser.add_argument("--once", action="store_true", help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        if options["processes"] <= 1:
+            _worker(options["poll"], options["once"])
+            return
+        # Children must open their own database connections
+        connections.close_all()
+        procs = [multiprocessing.Process(target=_worker, args=(options["poll"], options["once"]), daemon=False)
+                 for _ in range(options["processes"])]
+        for proc in procs:
+            proc.start()
+        self.stdout.write(f"Started {len(procs)} sync workers")
+        try:
+            for proc in procs:
+                proc.join()
+        except KeyboardInterrupt:
+            for proc in procs:
+                proc.terminate()
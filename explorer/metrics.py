@@ -0,0 +1,292 @@
+import bisect
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers a sub-millisecond top-k up to a slow Graph download
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# --------- Metric types ---------
+class Counter:
+    """A monotonically increasing count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels.get(n, "")) for n in self.labelnames), 0)
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(v)}" for key, v in values]
+
+
+class Gauge(Counter):
+    """A value per label combination that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """Observation counts in cumulative buckets, plus their sum, per label combination."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][slot] += 1
+            series[1] += value
+
+    def count(self, **labels):
+        series = self._series.get(tuple(str(labels.get(n, "")) for n in self.labelnames))
+        return sum(series[0]) if series else 0
+
+    def render(self):
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        lines = []
+        for key, (counts, total) in series:
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                running += n
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {running}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {running}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        self.metrics.setdefault(metric.name, metric)
+        return self.metrics[metric.name]
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        """Everything in the Prometheus text exposition format (0.0.4)."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Each process keeps its own numbers: scrape every web worker, and note
+# the sync worker (run_sync_worker) isn't visible from the web processes
+REGISTRY = Registry()
+
+SPAN_SECONDS = REGISTRY.histogram(
+    "explorer_span_seconds", "Time spent in instrumented code paths", ["span"])
+SPAN_ITEMS = REGISTRY.counter(
+    "explorer_span_items_total", "Items (images, prompts, files) processed by instrumented code paths", ["span"])
+GRAPH_REQUESTS = REGISTRY.counter(
+    "explorer_graph_requests_total", "Microsoft Graph requests by operation and status", ["operation", "status"])
+GRAPH_SECONDS = REGISTRY.histogram(
+    "explorer_graph_request_seconds", "Microsoft Graph time to response headers", ["operation"])
+DOWNLOAD_BYTES = REGISTRY.counter("explorer_download_bytes_total", "Bytes downloaded from OneDrive")
+HTTP_REQUESTS = REGISTRY.counter(
+    "explorer_http_requests_total", "Requests served by view, method and status", ["view", "method", "status"])
+HTTP_SECONDS = REGISTRY.histogram("explorer_http_request_seconds", "Request handling time by view", ["view"])
+INDEX_LOOKUPS = REGISTRY.counter(
+    "explorer_index_cache_lookups_total", "Index registry lookups by index kind and result (hit, miss, reload)",
+    ["kind", "result"])
+INDEX_EVICTIONS = REGISTRY.counter(
+    "explorer_index_cache_evictions_total", "Indexes evicted to stay within the memory budget", ["kind"])
+INDEX_BYTES = REGISTRY.gauge(
+    "explorer_index_cache_resident_bytes", "Approximate bytes of the indexes held in memory", ["kind"])
+INDEX_ENTRIES = REGISTRY.gauge("explorer_index_cache_entries", "Indexes held in memory", ["kind"])
+EMBEDDING_CACHE_LOOKUPS = REGISTRY.counter(
+    "explorer_embedding_cache_lookups_total", "Query embedding cache lookups by cache (text, image) and result "
+    "(hit, disk_hit, miss)", ["cache", "result"])
+EMBEDDING_CACHE_ENCODE_SECONDS = REGISTRY.histogram(
+    "explorer_embedding_cache_encode_seconds", "Time to encode the queries a cache missed, per call", ["cache"])
+EMBEDDING_CACHE_ENCODED = REGISTRY.counter(
+    "explorer_embedding_cache_encoded_total", "Queries encoded after a cache miss", ["cache"])
+EMBEDDING_CACHE_ENTRIES = REGISTRY.gauge(
+    "explorer_embedding_cache_entries", "Query embeddings held in memory", ["cache"])
+
+
+# --------- Spans ---------
+def observe(name, seconds, items=1):
+    """Record a duration measured elsewhere as a span."""
+    SPAN_SECONDS.observe(seconds, span=name)
+    if items:
+        SPAN_ITEMS.inc(items, span=name)
+
+
+@contextmanager
+def span(name, items=1):
+    """Time the block into explorer_span_seconds{span=name}, even if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, items)
+
+
+def graph_operation(url):
+    """Coarse name of a Graph endpoint, for labels (item ids would explode the series count)."""
+    path = url.split("?", 1)[0].rstrip("/")
+    for suffix in ("children", "content", "delta", "thumbnails"):
+        if path.endswith(f"/{suffix}"):
+            return suffix
+    if path.endswith("/me"):
+        return "me"
+    return "item"
+
+
+# --------- Request metrics and profiling ---------
+# Any other method is counted as "other", so clients can't add series at will
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "TRACE", "CONNECT"}
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return (match.url_name if match else None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Counts requests and times them per view (by URL name).
+
+    With PROFILE_REQUESTS on, a request with ?profile=1 runs under cProfile
+    and the stats are saved to PROFILE_DIR as <view>-<time>.prof (open
+    with snakeviz or pstats); ?profile=text returns the top functions as
+    text instead of the page. Every profiled response carries the worker's
+    pid in X-Profile-Pid, so a sampling profiler can be pointed at the
+    process serving it (py-spy record --pid <pid>). Under ASGI the profile
+    covers everything the event loop ran meanwhile, other requests included.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        mode = request.GET.get("profile") if getattr(settings, "PROFILE_REQUESTS", False) else None
+        start = time.perf_counter()
+        if mode:
+            profile = cProfile.Profile()
+            response = profile.runcall(self.get_response, request)
+            response = self._profiled(request, mode, profile, response)
+        else:
+            response = self.get_response(request)
+        return self._count(request, response, time.perf_counter() - start)
+
+    async def _acall(self, request):
+        mode = request.GET.get("profile") if getattr(settings, "PROFILE_REQUESTS", False) else None
+        start = time.perf_counter()
+        if mode:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profile.disable()
+            response = self._profiled(request, mode, profile, response)
+        else:
+            response = await self.get_response(request)
+        return self._count(request, response, time.perf_counter() - start)
+
+    def _count(self, request, response, elapsed):
+        view = _view_name(request)
+        method = request.method if request.method in HTTP_METHODS else "other"
+        HTTP_REQUESTS.inc(view=view, method=method, status=response.status_code)
+        HTTP_SECONDS.observe(elapsed, view=view)
+        return response
+
+    def _profiled(self, request, mode, profile, response):
+        view = _view_name(request)
+        if mode == "text":
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(40)
+            response = HttpResponse(out.getvalue(), content_type="text/plain; charset=utf-8")
+        else:
+            directory = getattr(settings, "PROFILE_DIR", "/tmp/explorer_profiles")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{view}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof")
+            profile.dump_stats(path)
+            response["X-Profile-File"] = path
+            logger.info("Profiled %s %s to %s", request.method, request.path, path)
+        response["X-Profile-Pid"] = str(os.getpid())
+        return response
+
+
+def metrics_response():
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0002_syncjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageLibrary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=200, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='onedriveimage',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='onedriveimage',
+            name='etag',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='onedriveimage',
+            name='model_version',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='onedriveimage',
+            name='modified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='onedriveimage',
+            name='user_id',
+            field=models.CharField(default='', max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='onedriveimage',
+            name='file_id',
+            field=models.CharField(max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='onedriveimage',
+            index=models.Index(fields=['user_id', 'model_version'], name='explorer_on_user_id_020d3c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='onedriveimage',
+            index=models.Index(fields=['user_id', 'content_hash'], name='explorer_on_user_id_0d9057_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='onedriveimage',
+            constraint=models.UniqueConstraint(fields=('user_id', 'file_id'), name='onedriveimage_user_file'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('explorer', '0003_onedriveimage_catalog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncjob',
+            name='session_key',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+    ]
@@ -0,0 +1,263 @@
+"""
+A small stand-in for the parts of Microsoft Graph this app uses, serving a
+local folder as the user's OneDrive. Used by the benchmark commands and for
+running sync without a real tenant (set GRAPH_API_BASE to its URL).
+"""
+import base64
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .content import QuickXorHash
+
+MOCK_USER_ID = "mock-user"
+
+
+def path_to_id(rel_path):
+    if rel_path in ("", "."):
+        return "root"
+    return base64.urlsafe_b64encode(rel_path.encode()).decode().rstrip("=")
+
+
+def id_to_path(item_id):
+    if item_id == "root":
+        return ""
+    return base64.urlsafe_b64decode(item_id + "=" * (-len(item_id) % 4)).decode()
+
+
+class MockGraphHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle plus
+    # the client's delayed ACK adds ~40ms to every keep-alive request
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def graph(self):
+        return self.server.graph
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _item(self, rel_path):
+        full = os.path.join(self.graph.root, rel_path)
+        parent = os.path.dirname(rel_path)
+        item = {
+            "id": path_to_id(rel_path),
+            "name": os.path.basename(rel_path) or "root",
+            "parentReference": {"id": path_to_id(parent), "path": "/drive/root:/" + parent.replace(os.sep, "/")}
+            if rel_path else {},
+        }
+        stat = os.stat(full)
+        item["eTag"] = f'"{{{path_to_id(rel_path)}}},{stat.st_mtime_ns}"'
+        item["lastModifiedDateTime"] = datetime.fromtimestamp(stat.st_mtime, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        if os.path.isdir(full):
+            item["folder"] = {"childCount": len(os.listdir(full))}
+        else:
+            item["file"] = {"hashes": {"quickXorHash": self.graph.quickxor(full, stat)}}
+            item["size"] = stat.st_size
+        return item
+
+    def do_GET(self):
+        graph = self.graph
+        if graph.latency:
+            time.sleep(graph.latency)
+        if not self._authorized():
+            return
+        if graph.throttle_rate and random.random() < graph.throttle_rate:
+            return self._send_json({"error": {"code": "TooManyRequests"}}, 429,
+                                   {"Retry-After": str(graph.retry_after)})
+
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if parts and parts[0] == "v1.0":
+            parts = parts[1:]
+        query = parse_qs(url.query)
+        try:
+            if parts == ["me"]:
+                return self._send_json({"id": MOCK_USER_ID, "displayName": "Mock User"})
+            if parts == ["me", "drive", "root", "delta"]:
+                return self._delta(query)
+            if parts[:3] == ["me", "drive", "items"] and len(parts) >= 4:
+                rel_path = id_to_path(parts[3])
+                full = os.path.join(graph.root, rel_path)
+                if not os.path.exists(full):
+                    return self._send_json({"error": {"code": "itemNotFound"}}, 404)
+                if len(parts) == 4:
+                    return self._send_json(self._item(rel_path))
+                if parts[4] == "children":
+                    return self._children(rel_path, query)
+                if parts[4] == "content":
+                    return self._content(full)
+        except (ValueError, UnicodeDecodeError):
+            pass
+        self._send_json({"error": {"code": "invalidRequest"}}, 400)
+
+    def _authorized(self):
+        graph = self.graph
+        graph.count(self.path)
+        if graph.token is not None and self.headers.get("Authorization", "") != f"Bearer {graph.token}":
+            self._send_json({"error": {"code": "InvalidAuthenticationToken"}}, 401)
+            return False
+        return True
+
+    def do_PUT(self):
+        # /me/drive/items/{parent_id}:/{name}:/content
+        if not self._authorized():
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = urlparse(self.path).path
+        try:
+            prefix, name, _ = path.split(":/")
+            parent = id_to_path(prefix.rstrip("/").split("/")[-1])
+        except (ValueError, UnicodeDecodeError):
+            return self._send_json({"error": {"code": "invalidRequest"}}, 400)
+        rel_path = os.path.join(parent, name)
+        with open(os.path.join(self.graph.root, rel_path), "wb") as f:
+            f.write(body)
+        self._send_json(self._item(rel_path), 201)
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        parts = [p for p in urlparse(self.path).path.split("/") if p]
+        try:
+            full = os.path.join(self.graph.root, id_to_path(parts[-1]))
+        except (ValueError, UnicodeDecodeError):
+            full = None
+        if not full or not os.path.isfile(full):
+            return self._send_json({"error": {"code": "itemNotFound"}}, 404)
+        os.remove(full)
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _children(self, rel_path, query):
+        names = sorted(os.listdir(os.path.join(self.graph.root, rel_path)))
+        top = int(query.get("$top", ["200"])[0])
+        skip = int(query.get("$skiptoken", ["0"])[0])
+        page = names[skip:skip + top]
+        payload = {"value": [self._item(os.path.join(rel_path, n)) for n in page]}
+        if skip + top < len(names):
+            base = f"http://{self.headers['Host']}{urlparse(self.path).path}"
+            payload["@odata.nextLink"] = f"{base}?$top={top}&$skiptoken={skip + top}"
+        self._send_json(payload)
+
+    def _delta(self, query):
+        graph = self.graph
+        snapshot = graph.snapshot()
+        token = query.get("token", [None])[0]
+        if token is None:
+            changed, deleted = sorted(snapshot), []
+        elif token not in graph.snapshots:
+            return self._send_json({"error": {"code": "resyncRequired"}}, 410)
+        else:
+            previous = graph.snapshots[token]
+            changed = sorted(p for p, sig in snapshot.items() if previous.get(p) != sig)
+            deleted = sorted(p for p in previous if p not in snapshot)
+        value = [self._item(p) for p in changed]
+        if token is None:
+            value.insert(0, dict(self._item(""), root={}))
+        for item in value:
+            # Like Graph, delta results don't carry parentReference.path
+            item.get("parentReference", {}).pop("path", None)
+        value += [{"id": path_to_id(p), "deleted": {"state": "deleted"}} for p in deleted]
+        new_token = graph.save_snapshot(snapshot)
+        base = f"http://{self.headers['Host']}{urlparse(self.path).path}"
+        self._send_json({"value": value, "@odata.deltaLink": f"{base}?token={new_token}"})
+
+    def _content(self, full):
+        size = os.path.getsize(full)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        with open(full, "rb") as f:
+            while True:
+                chunk = f.read(256 * 1024)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+
+
+class MockGraph:
+    """
+    Serve `root` as a OneDrive at http://host:port/v1.0. throttle_rate is the
+    fraction of requests answered with 429 + Retry-After; latency adds a
+    fixed delay to every request to imitate a WAN round trip.
+    """
+
+    def __init__(self, root, host="127.0.0.1", port=0, token=None, latency=0.0,
+                 throttle_rate=0.0, retry_after=1):
+        self.root = os.path.abspath(root)
+        self.token = token
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.snapshots = {}
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), MockGraphHandler)
+        self.server.daemon_threads = True
+        self.server.graph = self
+        self._thread = None
+
+    def snapshot(self):
+        """{relative path: (mtime, size)} for every file and folder under root."""
+        state = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in dirnames + filenames:
+                full = os.path.join(dirpath, name)
+                st = os.stat(full)
+                state[os.path.relpath(full, self.root)] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def quickxor(self, full, stat):
+        """Base64 quickXorHash of a file, as Graph reports it (cached by mtime and size)."""
+        key = (full, stat.st_mtime_ns, stat.st_size)
+        if key not in self._hashes:
+            h = QuickXorHash()
+            with open(full, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(chunk)
+            self._hashes[key] = base64.b64encode(h.digest()).decode()
+        return self._hashes[key]
+
+    def save_snapshot(self, snapshot):
+        with self._lock:
+            token = str(len(self.snapshots) + 1)
+            self.snapshots[token] = snapshot
+        return token
+
+    def count(self, path):
+        with self._lock:
+            self.requests += 1
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1.0"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-graph", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1 +1,120 @@
+import numpy as np
+from django.db import models
 
+# Embeddings are stored as raw float16 bytes, like the on-disk store
+EMBEDDING_DTYPE = np.float16
+
+
+class OneDriveImage(models.Model):
+    """One synced OneDrive image of one user, with its CLIP embedding."""
+
+    user_id = models.CharField(max_length=200, default="")
+    file_id = models.CharField(max_length=200)
+    name = models.CharField(max_length=255)
+    parent_id = models.CharField(max_length=200, blank=True, null=True)
+    full_path = models.TextField(blank=True, null=True)
+    thumbnail_url = models.TextField(blank=True, null=True)
+    image_url = models.TextField(blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True)   # quickXorHash hex, see content.py
+    etag = models.CharField(max_length=200, blank=True)          # Graph eTag when it was synced
+    modified_at = models.DateTimeField(null=True, blank=True)    # Graph lastModifiedDateTime
+    embedding = models.BinaryField(blank=True, null=True)
+    model_version = models.CharField(max_length=100, blank=True)  # ModelManager.embedding_version
+    last_scanned = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user_id", "file_id"], name="onedriveimage_user_file"),
+        ]
+        indexes = [
+            models.Index(fields=["user_id", "model_version"]),
+            models.Index(fields=["user_id", "content_hash"]),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.user_id})"
+
+    @property
+    def vector(self):
+        if self.embedding is None:
+            return None
+        return np.frombuffer(bytes(self.embedding), dtype=EMBEDDING_DTYPE)
+
+    @vector.setter
+    def vector(self, value):
+        self.embedding = np.asarray(value, dtype=EMBEDDING_DTYPE).reshape(-1).tobytes()
+
+
+class ImageLibrary(models.Model):
+    """
+    Per-user version counter, bumped on every change to that user's
+    OneDriveImage rows; in-memory search indexes reload when it moves.
+    """
+
+    user_id = models.CharField(max_length=200, unique=True)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} v{self.version}"
+
+
+class SyncJob(models.Model):
+    """A queued OneDrive sync for one user, run by `manage.py run_sync_worker`."""
+
+    KIND_SYNC = "sync"
+    KIND_UPLOAD = "upload"
+    KIND_DELETE = "delete"
+    KIND_CHOICES = [
+        (KIND_SYNC, "Full sync"),
+        (KIND_UPLOAD, "Uploaded item"),
+        (KIND_DELETE, "Deleted item"),
+    ]
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    user_id = models.CharField(max_length=200, db_index=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_SYNC)
+    payload = models.JSONField(default=dict, blank=True)
+    access_token = models.TextField(blank=True)
+    # The user's session, whose MSAL cache renews the token during long or late jobs
+    session_key = models.CharField(max_length=40, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    stage = models.CharField(max_length=50, blank=True)
+    done = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    message = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"{self.kind} for {self.user_id} ({self.status})"
+
+    def as_dict(self):
+        return {
+            "id": self.pk,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "message": self.message,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
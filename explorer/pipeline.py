@@ -0,0 +1,174 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import torch
+from django.conf import settings
+
+from .decode import decode_size, open_image
+from .metrics import observe, span
+
+_DONE = object()
+
+
+class StageStats:
+    """Item count and busy time for one pipeline stage (and each call's time, with keep_samples)."""
+
+    def __init__(self, name, keep_samples=False):
+        self.name = name
+        self.items = 0
+        self.seconds = 0.0
+        self.samples = [] if keep_samples else None
+        self._lock = threading.Lock()
+
+    def add(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.seconds += seconds
+            if self.samples is not None:
+                self.samples.append(seconds)
+
+    @property
+    def rate(self):
+        return self.items / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return f"{self.name}: {self.items} in {self.seconds:.2f}s ({self.rate:.1f}/s)"
+
+
+def configure_torch_threads(decode_workers):
+    """
+    Give the intra-op pool the cores the decode workers are not using.
+    Only applies on CPU; returns the thread count in effect.
+    """
+    threads = getattr(settings, "EMBED_TORCH_THREADS", None)
+    if not threads:
+        threads = max(1, (os.cpu_count() or 1) - decode_workers // 2)
+    if torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+    return threads
+
+
+class EmbeddingPipeline:
+    """
+    Streaming image embedding pipeline.
+
+    A thread pool opens and preprocesses images (PIL decode and the CLIP
+    transforms release the GIL for most of their work) and feeds a bounded
+    queue; the calling thread collects the tensors into batches for
+    model.encode_image. Results are yielded as (key, embedding, error) in
+    input order, with embedding a (512,) numpy array or None on error.
+
+    on_decode(key, img), if given, is called in the decode worker with the
+    opened image before preprocess, so other outputs (thumbnails) can be
+    made from the same decoded pixels. With keep_samples the decode and
+    encode stats also keep every image's / batch's time (for percentiles).
+
+    Images are opened with decode.open_image, at reduced size (only the
+    pixels CLIP and the thumbnails need) unless EMBED_FAST_DECODE is off;
+    opener(path) replaces that (bench_decode uses it for the old path).
+    """
+
+    def __init__(self, model, preprocess, device, batch_size=None, workers=None, queue_size=None,
+                 on_decode=None, keep_samples=False, opener=None):
+        self.model = model
+        self.preprocess = preprocess
+        self.device = device
+        self.batch_size = batch_size or getattr(settings, "EMBED_BATCH_SIZE", 32)
+        self.workers = workers or getattr(settings, "EMBED_DECODE_WORKERS", None) or min(8, os.cpu_count() or 1)
+        self.queue_size = queue_size or self.batch_size * 4
+        self.on_decode = on_decode
+        if opener is None:
+            opener = partial(open_image, min_size=decode_size())
+        self.opener = opener
+        self.decode = StageStats("decode+preprocess", keep_samples)
+        self.encode = StageStats("encode", keep_samples)
+        self.total = StageStats("pipeline")
+        if device == "cpu":
+            configure_torch_threads(self.workers)
+
+    def _load(self, key, path):
+        start = time.perf_counter()
+        try:
+            with span("decode"):
+                img = self.opener(path)
+            with img:
+                if self.on_decode is not None:
+                    with span("thumbnail"):
+                        self.on_decode(key, img)
+                with span("preprocess"):
+                    tensor = self.preprocess(img)
+            return key, tensor, None
+        except Exception as e:
+            return key, None, e
+        finally:
+            self.decode.add(1, time.perf_counter() - start)
+
+    def _encode(self, batch):
+        start = time.perf_counter()
+        keys = [key for key, _ in batch]
+        try:
+            images = torch.stack([tensor for _, tensor in batch]).to(self.device)
+            with torch.no_grad():
+                embeddings = self.model.encode_image(images).cpu().numpy()
+        except Exception as e:
+            return [(key, None, e) for key in keys]
+        finally:
+            self.encode.add(len(batch), time.perf_counter() - start)
+            observe("encode_image", time.perf_counter() - start, len(batch))
+        return [(key, embeddings[i], None) for i, key in enumerate(keys)]
+
+    def _flush(self, batch):
+        """Encode a batch of (key, tensor, error) and yield every entry's result in order."""
+        tensors = [(key, tensor) for key, tensor, error in batch if error is None]
+        encoded = iter(self._encode(tensors) if tensors else ())
+        for key, _, error in batch:
+            yield (key, None, error) if error is not None else next(encoded)
+
+    def run(self, items):
+        """Embed an iterable of (key, image_path) pairs."""
+        start = time.perf_counter()
+        pending = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+
+        def feed():
+            try:
+                with ThreadPoolExecutor(self.workers, thread_name_prefix="embed-decode") as pool:
+                    for key, path in items:
+                        if stop.is_set():
+                            break
+                        pending.put(pool.submit(self._load, key, path))
+            finally:
+                pending.put(_DONE)
+
+        feeder = threading.Thread(target=feed, name="embed-feed", daemon=True)
+        feeder.start()
+        # Failed decodes wait in the batch too, so results keep the input order
+        batch, tensors = [], 0
+        try:
+            while True:
+                future = pending.get()
+                if future is _DONE:
+                    break
+                key, tensor, error = future.result()
+                batch.append((key, tensor, error))
+                tensors += error is None
+                if tensors >= self.batch_size:
+                    yield from self._flush(batch)
+                    batch, tensors = [], 0
+            if batch:
+                yield from self._flush(batch)
+        finally:
+            # Unblock the feeder if the caller stopped consuming early
+            stop.set()
+            while feeder.is_alive():
+                try:
+                    pending.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.total.add(self.encode.items, time.perf_counter() - start)
+
+    def summary(self):
+        return f"{self.total} | {self.decode} | {self.encode} (batch={self.batch_size}, workers={self.workers}, torch_threads={torch.get_num_threads()})"
@@ -0,0 +1,117 @@
+import os
+import threading
+import numpy as np
+
+# Rows converted and scored per block: small enough for the float32 block
+# to stay in cache between the conversion and the matrix-vector product
+SCORE_CHUNK = 4096
+
+# Set bits in every byte value, for NumPy builds without np.bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def normalized_blocks(vectors, chunk=SCORE_CHUNK):
+    """(start, block) of L2-normalized float32 rows, one block at a time."""
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk], dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        yield start, block / norms
+
+
+def full_precision_rows(vectors, path=None):
+    """
+    Normalized float16 copy of vectors for re-ranking. With a path it is
+    written next to the user's other caches and memory-mapped back, so only
+    the pages a re-rank touches are read. Written under a temporary name
+    and renamed, so a process still mapping the old file keeps reading it.
+    """
+    shape = (len(vectors), vectors.shape[1])
+    if path is None:
+        rows = np.empty(shape, dtype=np.float16)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        rows = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float16, shape=shape)
+    for start, block in normalized_blocks(vectors):
+        rows[start:start + len(block)] = block
+    if path is None:
+        return rows
+    rows.flush()
+    del rows
+    mapped = np.load(tmp, mmap_mode="r")
+    os.replace(tmp, path)
+    return mapped
+
+
+def hamming(codes, query_code):
+    """Hamming distance between query_code and every row of packed bits."""
+    xor = np.bitwise_xor(codes, query_code)
+    if hasattr(np, "bitwise_count") and xor.shape[1] % 8 == 0:
+        return np.bitwise_count(xor.view(np.uint64)).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[xor].sum(axis=1, dtype=np.int32)
+
+
+class Int8Codes:
+    """
+    Scalar quantization: each dimension scaled by its largest magnitude to
+    [-127, 127], one byte per dimension (a quarter of float32).
+    """
+
+    name = "int8"
+
+    def __init__(self, rows):
+        dim = rows.shape[1]
+        peak = np.zeros(dim, dtype=np.float32)
+        for _, block in normalized_blocks(rows):
+            np.maximum(peak, np.abs(block).max(axis=0), out=peak)
+        peak[peak == 0] = 1.0
+        self.scale = peak / 127
+        self.codes = np.empty(rows.shape, dtype=np.int8)
+        for start, block in normalized_blocks(rows):
+            self.codes[start:start + len(block)] = np.rint(block / self.scale)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scale.nbytes
+
+    def scores(self, q):
+        """Approximate cosine similarity of the normalized query against every row."""
+        q = (q * self.scale).astype(np.float32)
+        out = np.empty(len(self.codes), dtype=np.float32)
+        block = np.empty((SCORE_CHUNK, self.codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORE_CHUNK):
+            codes = self.codes[start:start + SCORE_CHUNK]
+            block[:len(codes)] = codes
+            np.matmul(block[:len(codes)], q, out=out[start:start + len(codes)])
+        return out
+
+
+class BinaryCodes:
+    """
+    Sign bits packed 8 to a byte (dim / 8 bytes per row, 1/32 of float32),
+    compared by Hamming distance. The angle between two vectors is roughly
+    pi * hamming / dim, so cos of that stands in for the similarity.
+    """
+
+    name = "binary"
+
+    def __init__(self, rows):
+        self.dim = rows.shape[1]
+        self.codes = np.empty((len(rows), (self.dim + 7) // 8), dtype=np.uint8)
+        for start, block in normalized_blocks(rows):
+            self.codes[start:start + len(block)] = np.packbits(block > 0, axis=1)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def scores(self, q):
+        query_code = np.packbits(q > 0)
+        out = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORE_CHUNK):
+            out[start:start + SCORE_CHUNK] = hamming(self.codes[start:start + SCORE_CHUNK], query_code)
+        return np.cos(out * np.float32(np.pi / self.dim))
+
+
+CODECS = {"int8": Int8Codes, "binary": BinaryCodes}
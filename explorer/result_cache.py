@@ -0,0 +1,84 @@
+import hashlib
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+RESULT_CACHE_ALIAS = "search_results"
+
+
+def result_key(user_id, query, filter_type, version, kind="text"):
+    """
+    Cache key for one ranked search. version identifies the user's index
+    (embedding version and catalog version), so any change to their
+    embeddings makes old entries unreachable and they simply age out.
+    Text queries are case-insensitive; for other kinds ("item" file ids,
+    "image" content hashes) query is used as is.
+    """
+    if kind == "text":
+        query = query.strip().lower()
+    raw = "\0".join([str(user_id), kind, query, filter_type, repr(version)])
+    return "search:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class Ranking:
+    """
+    Compact cached result of one search: the first `depth` ranked row
+    indices and scores (int32 / float32), plus the total result count.
+    """
+
+    def __init__(self, rows, scores, total, text_matches):
+        # int32 rows are only meaningful against the index version in the key
+        self.rows = np.asarray(rows, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.total = total
+        self.text_matches = text_matches
+
+    @classmethod
+    def from_results(cls, results, depth=None):
+        depth = depth or getattr(settings, "RESULT_CACHE_DEPTH", 1000)
+        rows, scores = results.ranked_rows(min(depth, len(results)))
+        return cls(rows, scores, len(results), results.text_matches)
+
+    @property
+    def complete(self):
+        return len(self.rows) >= self.total
+
+
+def get_ranking(key):
+    return caches[RESULT_CACHE_ALIAS].get(key)
+
+
+def store_ranking(key, ranking):
+    caches[RESULT_CACHE_ALIAS].set(key, ranking)
+
+
+class CachedResults:
+    """
+    Paginator-compatible view over a cached Ranking. Only the rows of the
+    requested slice are hydrated into (name, url, score, thumb) tuples.
+    A slice past the cached depth calls rerank(depth) for a deeper Ranking.
+    """
+
+    def __init__(self, ranking, index, make_row, rerank=None):
+        self.ranking = ranking
+        self.index = index
+        self.make_row = make_row
+        self.rerank = rerank
+
+    def __len__(self):
+        return self.ranking.total
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError(key)
+            return self[key:key + 1][0]
+        start, stop, step = key.indices(len(self))
+        if stop > len(self.ranking.rows) and not self.ranking.complete and self.rerank is not None:
+            depth = max(stop, 2 * len(self.ranking.rows))
+            self.ranking = self.rerank(depth)
+        rows = self.ranking.rows[start:stop:step]
+        scores = self.ranking.scores[start:stop:step]
+        return [self.make_row(self.index, int(r), float(s)) for r, s in zip(rows, scores)]
@@ -0,0 +1,286 @@
+import os
+import re
+import time
+import numpy as np
+from django.conf import settings
+
+from .catalog import library_version, load_vectors
+from .embedding_store import user_cache_dir
+from .index_registry import REGISTRY, strings_nbytes
+from .quantize import CODECS, full_precision_rows
+
+
+# Per entry of SearchIndex's id -> row dict: its slot plus the int object
+ROW_DICT_BYTES = 100
+
+
+class SearchIndex:
+    """
+    A user's embeddings as one L2-normalized float32 matrix, so cosine
+    similarity against a query is a single matrix-vector product.
+
+    With quantization "int8" or "binary" the rows are held compressed
+    instead (see quantize.py): a query scores every row approximately, then
+    the best rerank candidates are re-scored exactly from a float16 copy,
+    memory-mapped from rerank_path when given (else kept in memory).
+    """
+
+    def __init__(self, ids, names, vectors, quantization="float32", rerank_path=None, rerank=None):
+        self.ids = list(ids)
+        self.names = list(names)
+        vectors = np.asarray(vectors)
+        if vectors.ndim != 2:
+            vectors = vectors.reshape(len(self.ids), -1)
+        self.quantization = quantization
+        self.rerank = rerank if rerank is not None else getattr(settings, "SEARCH_RERANK_CANDIDATES", 2000)
+        self.matrix = self.codes = self.full = None
+        if quantization == "float32":
+            matrix = vectors.astype(np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.matrix = matrix / norms
+        elif quantization in CODECS:
+            self.full = full_precision_rows(vectors, rerank_path)
+            self.codes = CODECS[quantization](self.full)
+        else:
+            raise ValueError(f"Unknown SEARCH_QUANTIZATION {quantization!r}")
+        self._row_of = None
+        self.version = None  # library version the rows were read at
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def vector_nbytes(self):
+        """Bytes of vectors held in memory (a memory-mapped re-rank copy isn't counted)."""
+        if self.matrix is not None:
+            return self.matrix.nbytes
+        resident = 0 if isinstance(self.full, np.memmap) else self.full.nbytes
+        return self.codes.nbytes + resident
+
+    @property
+    def nbytes(self):
+        """Approximate memory use: vectors, id and name strings and the id -> row dict (built on first use)."""
+        return (self.vector_nbytes + strings_nbytes(self.ids) + strings_nbytes(self.names)
+                + ROW_DICT_BYTES * len(self.ids))
+
+    def vector(self, row):
+        """The normalized float32 vector of one row."""
+        source = self.matrix if self.matrix is not None else self.full
+        return np.asarray(source[row], dtype=np.float32)
+
+    def _exact(self, q, rows):
+        if self.matrix is not None:
+            return self.matrix[rows] @ q
+        return np.asarray(self.full[rows], dtype=np.float32) @ q
+
+    def score(self, query_vector, rows=None):
+        """
+        Cosine similarity of the query against every row. When quantized,
+        only the top rerank rows (of rows, if given) are exact; every other
+        row keeps its approximate score, capped just below the lowest exact
+        one so the order stays exact-first.
+        """
+        q = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        q = q / (np.linalg.norm(q) or 1.0)
+        if self.matrix is not None:
+            return self.matrix @ q
+        scores = self.codes.scores(q)
+        shortlist = np.sort(top_k(scores, self.rerank, rows))
+        if not len(shortlist):
+            return scores
+        exact = self._exact(q, shortlist)
+        np.minimum(scores, np.nextafter(exact.min(), np.float32(-np.inf)), out=scores)
+        scores[shortlist] = exact
+        return scores
+
+    def _rows(self):
+        if self._row_of is None:
+            self._row_of = {fid: row for row, fid in enumerate(self.ids)}
+        return self._row_of
+
+    def rows_for(self, file_ids):
+        """Row indices for the given file ids, skipping ids not in the index."""
+        row_of = self._rows()
+        rows = [row_of[fid] for fid in file_ids if fid in row_of]
+        return np.unique(np.asarray(rows, dtype=np.int64))
+
+    def rows_of(self, file_ids):
+        """Row index of each file id, in order (-1 for ids not in the index)."""
+        row_of = self._rows()
+        return np.fromiter((row_of.get(fid, -1) for fid in file_ids), dtype=np.int64, count=len(file_ids))
+
+    def name_of(self, file_id):
+        row = self._rows().get(file_id)
+        return None if row is None else self.names[row]
+
+    def score_rows(self, query_vector, rows):
+        """Scores for a subset of rows; every other row gets -inf."""
+        q = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        q = q / (np.linalg.norm(q) or 1.0)
+        scores = np.full(len(self.ids), -np.inf, dtype=np.float32)
+        scores[rows] = self._exact(q, rows)
+        return scores
+
+    def filter_mask(self, predicate):
+        """Boolean mask of rows whose filename passes predicate (None = all)."""
+        if predicate is None:
+            return None
+        return np.fromiter((predicate(n) for n in self.names), dtype=bool, count=len(self.names))
+
+
+def top_k(scores, k, candidates=None):
+    """
+    Indices of the k highest scores in descending order. Uses argpartition so
+    only the k winners are sorted. candidates restricts the search to a subset
+    of row indices.
+    """
+    if candidates is not None:
+        sub = scores[candidates]
+        return candidates[top_k(sub, k)]
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(n)
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+class RankedResults:
+    """
+    Lazily ranked search results for Paginator: the candidate rows by
+    score. Slicing only ranks as far as the end of the slice and only
+    builds result rows for the slice itself.
+    """
+
+    def __init__(self, index, scores, candidates, make_row, text_matches=0):
+        self.index = index
+        self.scores = scores
+        self.candidates = candidates
+        self.make_row = make_row
+        self.text_matches = text_matches  # candidates that matched by filename or folder
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def ranked_rows(self, n):
+        """The first n row indices in ranked order, with their scores."""
+        rows = top_k(self.scores, n, self.candidates).astype(np.int64)
+        return rows, self.scores[rows]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            rows, scores = self.ranked_rows(stop)
+            return [self.make_row(self.index, int(r), float(s))
+                    for r, s in zip(rows[start:stop:step], scores[start:stop:step])]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(key)
+        return self[key:key + 1][0]
+
+
+def fuse(scores, candidates, text_rows, text_scores, method=None):
+    """
+    Fold filename matches (text_rows, best first, with their TextIndex
+    scores) into the semantic scores of candidates. SEARCH_FUSION picks:
+
+      "rrf"    reciprocal-rank fusion, 1/(k + semantic rank) + 1/(k + filename rank)
+      "blend"  (1 - w) * min-max scaled similarity + w * filename score
+
+    Returns a new score array; rows outside candidates stay -inf.
+    """
+    method = method or getattr(settings, "SEARCH_FUSION", "rrf")
+    fused = np.full(len(scores), -np.inf, dtype=np.float32)
+    semantic = scores[candidates]
+    if method == "rrf":
+        k = getattr(settings, "SEARCH_RRF_K", 60)
+        ranks = np.empty(len(candidates), dtype=np.float32)
+        ranks[np.argsort(-semantic, kind="stable")] = np.arange(1, len(candidates) + 1)
+        fused[candidates] = 1.0 / (k + ranks)
+        fused[text_rows] += 1.0 / (k + np.arange(1, len(text_rows) + 1, dtype=np.float32))
+    elif method == "blend":
+        weight = getattr(settings, "SEARCH_TEXT_WEIGHT", 0.3)
+        low, high = float(semantic.min()), float(semantic.max())
+        fused[candidates] = (1 - weight) * (semantic - low) / ((high - low) or 1.0)
+        fused[text_rows] += weight * text_scores
+    else:
+        raise ValueError(f"Unknown SEARCH_FUSION {method!r}")
+    return fused
+
+
+def rank(index, query_vector, query_text="", predicate=None, make_row=None, ann_rows=None,
+         text_index=None, fusion=None, timings=None, exclude_rows=None):
+    """
+    Rank a user's images for a text query: CLIP similarity, fused (see
+    fuse) with the filename and folder matches text_index finds for
+    query_text, in one list.
+
+    ann_rows, when given, limits semantic scoring to the candidate rows an
+    approximate index returned; filename matches are scored regardless.
+    exclude_rows are left out (the query image itself, for "more like this").
+    timings, if given, receives the milliseconds spent in each stage.
+    """
+    timings = timings if timings is not None else {}
+    start = time.perf_counter()
+    mask = index.filter_mask(predicate)
+    text_rows = np.empty(0, dtype=np.int64)
+    text_scores = np.empty(0, dtype=np.float32)
+    if text_index is not None and query_text:
+        ids, text_scores = text_index.search(query_text)
+        text_rows = index.rows_of(ids)
+        keep = text_rows >= 0
+        if mask is not None:
+            keep[keep] = mask[text_rows[keep]]
+        text_rows, text_scores = text_rows[keep], text_scores[keep]
+    timings["text"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    rows = np.arange(len(index)) if mask is None else np.flatnonzero(mask)
+    if ann_rows is None:
+        candidates = rows
+        scores = index.score(query_vector, None if mask is None else rows)
+    else:
+        candidates = np.union1d(np.intersect1d(rows, ann_rows, assume_unique=True), text_rows)
+        scores = index.score_rows(query_vector, candidates)
+    if exclude_rows is not None:
+        candidates = np.setdiff1d(candidates, exclude_rows)
+    timings["semantic"] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    if len(text_rows):
+        scores = fuse(scores, candidates, text_rows, text_scores, fusion)
+    timings["fusion"] = (time.perf_counter() - start) * 1000
+    return RankedResults(index, scores, candidates, make_row or _default_row, len(text_rows))
+
+
+def _default_row(index, row, score):
+    return (index.names[row], index.ids[row], score, None)
+
+
+# --------- Per-process index cache ---------
+def get_library_index(user_id, model_version=None):
+    """
+    SearchIndex over a user's catalogued images (OneDriveImage rows),
+    rebuilt only when their ImageLibrary version has moved. A warm hit
+    costs one indexed query for the version. SEARCH_QUANTIZATION picks how
+    the vectors are held (see SearchIndex).
+    """
+    version = library_version(user_id)
+
+    def load():
+        quantization = getattr(settings, "SEARCH_QUANTIZATION", "float32")
+        rerank_path = None
+        if quantization != "float32":
+            name = re.sub(r"[^\w.-]", "_", str(model_version or "all"))
+            rerank_path = os.path.join(user_cache_dir(user_id), f"rerank-{name}.npy")
+        index = SearchIndex(*load_vectors(user_id, model_version), quantization=quantization,
+                            rerank_path=rerank_path)
+        index.version = version
+        return index
+
+    return REGISTRY.get(("search", user_id, model_version), version, load)
@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only hold within one process
+    fcntl = None
+
+LOCK_FILE = ".sync.lock"
+
+
+# --------- Atomic writes ---------
+def temp_path(path):
+    """A temporary name next to path, unique per process and thread so writers never share one."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def remove_temps(directory):
+    """Delete temporary files left behind by writers that died (only while holding the user's lock)."""
+    for name in os.listdir(directory):
+        if name.startswith(".") and name.endswith(".tmp"):
+            os.remove(os.path.join(directory, name))
+
+
+def fsync_dir(path):
+    """Make renames in a directory durable (a no-op where directories can't be opened)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_write(path, mode="w", durable=True):
+    """
+    Open a temporary file next to path for writing; when the block exits
+    normally it is flushed, fsynced and renamed over path, so readers see
+    the old file or the whole new one, never a partial write. The
+    temporary file is removed if the block raises.
+    """
+    tmp = temp_path(path)
+    encoding = None if "b" in mode else "utf-8"
+    try:
+        with open(tmp, mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            if durable:
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if durable:
+        fsync_dir(os.path.dirname(path) or ".")
+
+
+def write_text(path, text):
+    with atomic_write(path) as f:
+        f.write(text)
+
+
+def write_json(path, value):
+    with atomic_write(path) as f:
+        json.dump(value, f)
+
+
+def read_json(path):
+    """The JSON in path, or None if it's missing or unreadable."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def sync_file(f):
+    """Flush an open file and fsync it (appends that a checkpoint must keep)."""
+    f.flush()
+    os.fsync(f.fileno())
+
+
+# --------- Multi-file replacement ---------
+def replace_together(journal, renames, removes=()):
+    """
+    Rename each (tmp, dest) pair into place and delete removes, as one unit.
+    The plan is written to journal first, so if the process dies halfway
+    recover(journal) finishes it instead of leaving files that disagree.
+    All paths are in the journal's directory, and the tmp files must be
+    complete and fsynced (sync_file) beforehand.
+    """
+    plan = {"renames": [[os.path.basename(tmp), os.path.basename(dest)] for tmp, dest in renames],
+            "removes": [os.path.basename(path) for path in removes]}
+    write_json(journal, plan)
+    _apply(journal, plan)
+
+
+def write_together(journal, writers):
+    """
+    Write a set of files as one unit: each (path, write(tmp path)) goes to
+    a temporary file, is fsynced, and then all are renamed into place with
+    replace_together, in order (put the file readers check first last).
+    """
+    renames = []
+    try:
+        for path, write in writers:
+            tmp = temp_path(path)
+            renames.append((tmp, path))
+            write(tmp)
+            with open(tmp, "rb+") as f:
+                sync_file(f)
+    except BaseException:
+        for tmp, _ in renames:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+    replace_together(journal, renames)
+
+
+class TornFiles(ValueError):
+    """Files a reader loaded together come from different writes (it caught a swap midway)."""
+
+
+def recover(journal):
+    """Finish a replace_together that was interrupted; True if there was one."""
+    plan = read_json(journal)  # written atomically: whole or missing
+    if plan is None:
+        return False
+    _apply(journal, plan)
+    return True
+
+
+def _apply(journal, plan):
+    directory = os.path.dirname(journal)
+    for tmp, dest in plan["renames"]:
+        if os.path.exists(os.path.join(directory, tmp)):  # else it was renamed before the crash
+            os.replace(os.path.join(directory, tmp), os.path.join(directory, dest))
+    for name in plan["removes"]:
+        if os.path.exists(os.path.join(directory, name)):
+            os.remove(os.path.join(directory, name))
+    fsync_dir(directory)
+    os.remove(journal)
+
+
+# --------- Per-user locking ---------
+_held = threading.local()
+
+
+class LockTimeout(Exception):
+    pass
+
+
+@contextmanager
+def user_lock(user_dir, timeout=None):
+    """
+    Exclusive lock on a user's cache for the length of a sync, across
+    threads and processes (flock on <user_dir>/.sync.lock). Reentrant
+    within a thread. Raises LockTimeout after SYNC_LOCK_TIMEOUT seconds.
+    """
+    path = os.path.abspath(os.path.join(user_dir, LOCK_FILE))
+    held = getattr(_held, "paths", None)
+    if held is None:
+        held = _held.paths = {}
+    if path in held:
+        held[path] += 1
+        try:
+            yield
+        finally:
+            held[path] -= 1
+        return
+
+    timeout = getattr(settings, "SYNC_LOCK_TIMEOUT", 600) if timeout is None else timeout
+    os.makedirs(user_dir, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        _acquire(fd, path, timeout)
+        held[path] = 1
+        try:
+            yield
+        finally:
+            del held[path]
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                _local_locks[path].release()
+    finally:
+        os.close(fd)
+
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+def _acquire(fd, path, timeout):
+    deadline = time.monotonic() + timeout
+    waited = False
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(path, threading.Lock())
+        if not lock.acquire(timeout=timeout):
+            raise LockTimeout(f"Another sync has held {path} for over {timeout}s")
+        return
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"Another sync has held {path} for over {timeout}s")
+            if not waited:
+                logger.info("Waiting for another sync of %s to finish", os.path.dirname(path))
+                waited = True
+            time.sleep(0.05)
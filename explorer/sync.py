@@ -0,0 +1,682 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .catalog import (
+    catalogued_count, delete_images, hashes_in_use, hashes_of, image_locations, image_row, import_store,
+    rename_images,
+    set_hashes, stored_files, unhashed_images, upsert_images, vectors_by_hash,
+)
+from .clip_model import manager
+from .embedding_store import open_store, user_cache_dir
+from .ann import recover_ann, update_ann
+from .pipeline import EmbeddingPipeline
+from .decode import decode_size, open_image
+from .graph import GRAPH_API, graph_session
+from .downloader import OneDriveDownloader
+from .thumbnails import make_thumbnails, open_thumbnails
+from .text_index import recover_text_index, update_text_index
+from .content import DedupStats, file_hash, graph_hash, incoming_path, object_path, store_object
+from .storage import read_json, user_lock, write_json, write_text
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+DELTA_LINK_FILE = "delta_link.txt"
+FOLDERS_FILE = "folders.tsv"     # "id<TAB>parent id<TAB>name" of every folder seen in delta
+PENDING_FILE = "sync_pending.json"  # the listing of a sync still in progress, for resuming it
+RETRY_FILE = "sync_retry.json"      # items a sync failed to download or embed, tried again by the next
+
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTS)
+
+
+def full_path(f):
+    """
+    "Pictures/2023/beach.jpg" for a driveItem whose parentReference.path is
+    "/drive/root:/Pictures/2023", or None when Graph didn't send a path.
+    """
+    parent = (f.get("parentReference") or {}).get("path")
+    if parent is None:
+        return None
+    folder = parent.partition(":")[2].strip("/")
+    return f"{folder}/{f.get('name', '')}" if folder else f.get("name", "")
+
+
+def item_fields(f):
+    """The parts of a Graph driveItem that sync and the catalog keep."""
+    return {
+        "id": f["id"],
+        "name": f.get("name", ""),
+        "etag": f.get("eTag"),
+        "modified": f.get("lastModifiedDateTime"),
+        "parent_id": (f.get("parentReference") or {}).get("id"),
+        "path": full_path(f),
+        "hash": graph_hash(f),
+        "size": f.get("size"),
+    }
+
+
+# --------- Listing changes from OneDrive ---------
+def recursive_onedrive_images(token, folder_id='root'):
+    """
+    Recursively find all images in all folders on OneDrive (no limit).
+    """
+    headers = {"Authorization": f"Bearer {token}"}
+    url = f"{GRAPH_API}/me/drive/items/{folder_id}/children?$top=200"
+    images = []
+
+    while url:
+        resp = graph_session().get(url, headers=headers)
+        if resp.status_code != 200:
+            logger.warning("Error fetching folder %s: %s", folder_id, resp.status_code)
+            return images
+        data = resp.json()
+        files = data.get("value", [])
+        for f in files:
+            name = f.get("name", "")
+            if 'folder' in f:
+                # Recursively get images in subfolders
+                images.extend(recursive_onedrive_images(token, folder_id=f['id']))
+            elif is_image(name):
+                images.append(item_fields(f))
+        url = data.get("@odata.nextLink", None)  # This will page until all files are fetched
+
+    return images
+
+
+class DeltaExpired(Exception):
+    """The saved delta link is no longer valid (410 Gone / resyncRequired)."""
+
+
+def fetch_delta(token, delta_link=None, folders=None):
+    """
+    Page through /drive/root/delta from delta_link (or from scratch).
+
+    Returns (images, deleted_ids, new_delta_link). images are the added or
+    changed image files; deleted_ids covers deleted items and files that are
+    no longer images (e.g. renamed to another extension). folders, if
+    given, is filled with {folder_id: (parent_id, name)} for the folders
+    reported (the root as (None, "")), since delta items carry no paths.
+    """
+    headers = {"Authorization": f"Bearer {token}"}
+    url = delta_link or f"{GRAPH_API}/me/drive/root/delta?$top=200"
+    images, deleted = [], []
+    while url:
+        resp = graph_session().get(url, headers=headers)
+        if resp.status_code == 410:
+            raise DeltaExpired()
+        resp.raise_for_status()
+        data = resp.json()
+        for f in data.get("value", []):
+            if "deleted" in f:
+                deleted.append(f["id"])
+            elif "folder" in f or "root" in f:
+                if folders is not None:
+                    parent = None if "root" in f else (f.get("parentReference") or {}).get("id")
+                    folders[f["id"]] = (parent, "" if "root" in f else f.get("name", ""))
+            elif is_image(f.get("name", "")):
+                images.append(item_fields(f))
+            else:
+                deleted.append(f["id"])
+        url = data.get("@odata.nextLink")
+        if not url:
+            return images, deleted, data.get("@odata.deltaLink")
+    return images, deleted, None
+
+
+def _load_delta_link(user_dir):
+    path = os.path.join(user_dir, DELTA_LINK_FILE)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    return None
+
+
+def _save_delta_link(user_dir, delta_link):
+    path = os.path.join(user_dir, DELTA_LINK_FILE)
+    if delta_link:
+        write_text(path, delta_link)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _load_folders(user_dir):
+    folders = {}
+    path = os.path.join(user_dir, FOLDERS_FILE)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f.read().split("\n"):
+                parts = line.split("\t")
+                if len(parts) == 3:
+                    folders[parts[0]] = (parts[1] or None, parts[2])
+    return folders
+
+
+def _save_folders(user_dir, folders):
+    write_text(os.path.join(user_dir, FOLDERS_FILE),
+               "".join(f"{fid}\t{parent or ''}\t{name}\n" for fid, (parent, name) in folders.items()))
+
+
+def _load_pending(user_dir):
+    """The listing an interrupted sync saved, if it was for the current embedding version."""
+    pending = read_json(os.path.join(user_dir, PENDING_FILE))
+    if pending is None or pending.get("model_version") != manager.embedding_version:
+        return None
+    pending["folders"] = {fid: tuple(entry) for fid, entry in pending["folders"].items()}
+    return pending
+
+
+def _save_pending(user_dir, **listing):
+    write_json(os.path.join(user_dir, PENDING_FILE), dict(listing, model_version=manager.embedding_version))
+
+
+def _clear_pending(user_dir):
+    path = os.path.join(user_dir, PENDING_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _load_retries(user_dir):
+    return read_json(os.path.join(user_dir, RETRY_FILE)) or []
+
+
+def _save_retries(user_dir, failed, others=()):
+    """
+    Keep the items that failed, one attempt more each, for the next sync
+    to try again (the delta link moves past them). An item is dropped after
+    SYNC_RETRY_ATTEMPTS failures. others are kept as they are.
+    """
+    limit = getattr(settings, "SYNC_RETRY_ATTEMPTS", 5)
+    retries = list(others)
+    for item in failed:
+        item["attempts"] = item.get("attempts", 0) + 1
+        if item["attempts"] >= limit:
+            logger.warning("Giving up on %s after %d failed attempts", item["name"], item["attempts"])
+        else:
+            retries.append(item)
+    path = os.path.join(user_dir, RETRY_FILE)
+    if retries:
+        write_json(path, retries)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _with_retries(user_dir, images, deleted, full):
+    """The listed images plus the ones earlier syncs failed on that are still there."""
+    earlier = {item["id"]: item for item in _load_retries(user_dir)}
+    for item in images:
+        if item["id"] in earlier:  # listed again: the new listing wins, the failures still count
+            item["attempts"] = earlier.pop(item["id"]).get("attempts", 0)
+    gone = set(deleted)
+    # A full listing already has every image that is still there
+    retries = [] if full else [item for fid, item in earlier.items() if fid not in gone]
+    if retries:
+        logger.info("Retrying %d images earlier syncs failed on", len(retries))
+    return images + retries
+
+
+def _folder_path(folders, folder_id):
+    """Path of a folder ("Pictures/2023") from walking up to the root; None if the chain is incomplete."""
+    parts = []
+    while folder_id in folders and len(parts) < 256:
+        parent, name = folders[folder_id]
+        if parent is None:
+            return "/".join(reversed(parts))
+        parts.append(name)
+        folder_id = parent
+    return None
+
+
+def _item_path(folders, parent_id, name):
+    folder = _folder_path(folders, parent_id)
+    if folder is None:
+        return None
+    return f"{folder}/{name}" if folder else name
+
+
+def _refresh_paths(user_id, folders):
+    """Re-derive catalogued paths after folders were renamed or moved."""
+    moves = {}
+    for file_id, name, parent_id, old_path in image_locations(user_id):
+        path = _item_path(folders, parent_id, name)
+        if path is not None and path != old_path:
+            moves[file_id] = (name, path)
+    rename_images(user_id, moves)
+    return len(moves)
+
+
+# --------- Applying changes locally ---------
+# (seconds, images) of decode + encode work in the last pipeline run, to
+# price the encodes a sync avoids when it runs none itself
+_encode_cost = None
+
+
+def _release_objects(user_id, user_dir, hashes):
+    """Delete local files whose content no catalogued image refers to any more."""
+    for key in set(hashes) - hashes_in_use(user_id, hashes):
+        path = object_path(user_dir, key)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def remove_items(user_id, user_dir, store, file_ids):
+    """
+    Delete local files, embeddings and catalog rows for items that left
+    OneDrive. Catalog rows go first, so searches stop showing an item even
+    if the sync dies before the rest is cleaned up (a resumed sync does it).
+    """
+    catalogued = stored_files(user_id, file_ids)
+    stale_ids = []
+    for file_id in file_ids:
+        fname = store.name_of(file_id)
+        if fname is None:
+            if file_id in catalogued:
+                stale_ids.append(file_id)
+            continue
+        # Files synced before content addressing are kept under their name
+        path = os.path.join(user_dir, fname)
+        if os.path.isfile(path):
+            try:
+                os.remove(path)
+                logger.info("Deleted local file no longer in OneDrive: %s", fname)
+            except Exception as e:
+                logger.warning("Error deleting %s: %s", fname, e)
+        stale_ids.append(file_id)
+    hashes = hashes_of(user_id, stale_ids)
+    delete_images(user_id, stale_ids)
+    store.delete_many(stale_ids)
+    open_thumbnails(user_dir).delete_many(stale_ids)
+    # A copy elsewhere in the drive keeps the file alive
+    _release_objects(user_id, user_dir, hashes.values())
+    if stale_ids:
+        logger.info("Removed %d stale embeddings", len(stale_ids))
+    return len(stale_ids)
+
+
+def adopt_legacy_files(user_id, user_dir):
+    """
+    Hash the files of images synced before content addressing and move
+    them into the object store, so their content can be matched too.
+    """
+    by_name = {}
+    for file_id, name in unhashed_images(user_id):
+        by_name.setdefault(name, []).append(file_id)
+    hashes = {}
+    for name, file_ids in by_name.items():
+        path = os.path.join(user_dir, name)
+        if os.path.basename(name) != name or not os.path.isfile(path):
+            continue
+        key = file_hash(path)
+        store_object(user_dir, key, path)
+        hashes.update((fid, key) for fid in file_ids)
+    if hashes:
+        set_hashes(user_id, hashes)
+        logger.info("Moved %d previously synced files into the content store", len(hashes))
+    return len(hashes)
+
+
+def _report(progress, stage, done=0, total=0):
+    if progress is not None:
+        progress(stage, done, total)
+
+
+def add_items(user_id, user_dir, store, images, token, refresh_token=None, progress=None, dedup=None,
+              failed=None):
+    """
+    Download and embed added or changed images, writing them to the store
+    and the catalog batch by batch; returns the number written.
+
+    Files are kept by content hash. An image whose content is already
+    catalogued (a copy in another folder, a moved file) takes that vector
+    and those thumbnails, skipping both the download and the encode; one
+    whose file is already local skips the download. Items Graph reports no
+    hash for are hashed after downloading. Savings are counted in dedup.
+    progress, if given, is called as progress(stage, done, total).
+
+    Results are checkpointed every SYNC_CHECKPOINT_ITEMS images, catalog
+    first: an image counts as synced once it is in both the catalog and
+    the store, so a sync that dies in between redoes it (from the
+    catalogued vector) rather than leaving it unsearchable.
+
+    Items that fail to download or embed are appended to failed.
+    """
+    global _encode_cost
+    dedup = dedup if dedup is not None else DedupStats()
+    failed = failed if failed is not None else []
+    version = manager.embedding_version
+    stored = stored_files(user_id, [item["id"] for item in images if item["id"] in store])
+    moved = {}
+    changed = set()
+    wanted = []
+    for item in images:
+        file_id = item["id"]
+        file_name = item["name"]
+        if not is_image(file_name):
+            continue
+        if file_id in stored:
+            old, old_path = stored.get(file_id, ("", None))
+            if store.name_of(file_id) != file_name:
+                # Renamed in OneDrive: keep the vector, update the name
+                store.add(file_id, file_name, store.get(file_id))
+                moved[file_id] = (file_name, item.get("path"))
+            elif item.get("path") is not None and item["path"] != old_path:
+                moved[file_id] = (file_name, item["path"])
+            if not item.get("hash") or not old or item["hash"] == old:
+                continue
+            changed.add(file_id)  # edited in place: new content under the same id
+        wanted.append(dict(item))
+    rename_images(user_id, moved)
+    if not wanted:
+        return 0
+    dedup.items += len(wanted)
+
+    # --- Match content that is already here ---
+    sources = vectors_by_hash(user_id, [item["hash"] for item in wanted if item.get("hash")], version)
+    firsts = {}  # content hash -> the item encoding it in this sync
+    reuse, to_download, to_embed = [], [], []
+    for item in wanted:
+        key = item.get("hash")
+        if key and (key in sources or key in firsts):
+            reuse.append(item)
+        elif key and os.path.exists(object_path(user_dir, key)):
+            firsts[key] = item
+            to_embed.append((item, object_path(user_dir, key)))
+        else:
+            if key:
+                firsts[key] = item
+            to_download.append((item, object_path(user_dir, key) if key else incoming_path(user_dir, item["id"])))
+            continue
+        dedup.skipped_downloads += 1
+        dedup.bytes_saved += item.get("size") or 0
+
+    # --- Download missing files concurrently ---
+    downloader = OneDriveDownloader(token, refresh_token)
+    pending = {item["id"]: item for item, _ in to_download}
+    for folder in set(os.path.dirname(path) for _, path in to_download):
+        os.makedirs(folder, exist_ok=True)
+    downloads = downloader.download_many((item["id"], path) for item, path in to_download)
+    hashed = []
+    for done, (file_id, local_path, ok) in enumerate(downloads, 1):
+        _report(progress, "downloading", done, len(to_download))
+        item = pending[file_id]
+        if not ok:
+            logger.warning("Failed to download: %s", item["name"])
+            failed.append(item)
+            continue
+        if item.get("hash"):
+            to_embed.append((item, local_path))
+        else:
+            item["hash"] = file_hash(local_path)
+            hashed.append((item, store_object(user_dir, item["hash"], local_path)))
+    if to_download:
+        logger.info("%s", downloader.stats)
+    # Only the downloaded bytes show whether these are copies; the encode is still saved
+    sources.update(vectors_by_hash(user_id, [item["hash"] for item, _ in hashed], version))
+    for item, path in hashed:
+        if item["hash"] in sources or item["hash"] in firsts:
+            reuse.append(item)
+        else:
+            firsts[item["hash"]] = item
+            to_embed.append((item, path))
+
+    # --- Embed new content in batches ---
+    thumbs = open_thumbnails(user_dir)
+    made = {}
+    embedded_as = {}  # content hash -> (file_id, vector) encoded in this sync
+    new_files = 0
+    checkpoint = max(getattr(settings, "SYNC_CHECKPOINT_ITEMS", 256), 1)
+
+    def write(rows):
+        # One checkpoint: thumbnails and the catalog, then the store, fsynced
+        thumbs.add_many([(item["id"], made.pop(item["id"], None)) for item, _ in rows])
+        upsert_images(user_id, [image_row(user_id, item, vec, version, item["hash"]) for item, vec in rows])
+        store.add_many([(item["id"], item["name"], vec) for item, vec in rows], durable=True)
+        return len(rows)
+
+    if to_embed:
+        items = {item["id"]: item for item, _ in to_embed}
+
+        def on_decode(file_id, img):
+            # Thumbnails come from the same decoded image that feeds CLIP
+            if file_id not in thumbs or file_id in changed:
+                made[file_id] = make_thumbnails(img)
+
+        pipeline = EmbeddingPipeline(manager.backend, manager.preprocess, manager.device, on_decode=on_decode)
+        embedded = []
+        results = pipeline.run((item["id"], path) for item, path in to_embed)
+        for done, (file_id, embedding, error) in enumerate(results, 1):
+            _report(progress, "embedding", done, len(to_embed))
+            item = items[file_id]
+            if error is not None:
+                made.pop(file_id, None)
+                logger.warning("Error embedding %s: %s", item["name"], error)
+                failed.append(item)
+                continue
+            embedded_as[item["hash"]] = (file_id, embedding)
+            embedded.append((item, embedding))
+            if len(embedded) >= checkpoint:
+                new_files += write(embedded)
+                embedded = []
+        new_files += write(embedded)
+        logger.info("%s", pipeline.summary())
+        if pipeline.encode.items:
+            _encode_cost = (pipeline.decode.seconds + pipeline.encode.seconds, pipeline.encode.items)
+            dedup.encode_seconds += _encode_cost[0]
+            dedup.encoded += _encode_cost[1]
+
+    # --- Items whose content was already embedded ---
+    rows, links = [], []
+    for item in reuse:
+        source = sources.get(item["hash"]) or embedded_as.get(item["hash"])
+        if source is None:
+            failed.append(item)  # the copy it matched failed to embed
+            continue
+        rows.append((item, source[1]))
+        links.append((item["id"], source[0]))
+    if rows:
+        thumbs.delete_many([item["id"] for item, _ in rows if item["id"] in changed])
+        thumbs.link_many(links)
+        for start in range(0, len(rows), checkpoint):
+            new_files += write(rows[start:start + checkpoint])
+        dedup.reused += len(rows)
+    # Files whose content an edit replaced
+    _release_objects(user_id, user_dir, [stored[fid][0] for fid in changed])
+    if dedup.reused and not dedup.encoded and _encode_cost:
+        dedup.encode_seconds, dedup.encoded = _encode_cost
+    return new_files
+
+
+def _thumbnail_file(path):
+    try:
+        with open_image(path, decode_size(input_size=0)) as img:  # only the thumbnails need pixels
+            return make_thumbnails(img)
+    except Exception as e:
+        logger.warning("Error making thumbnails for %s: %s", path, e)
+        return None
+
+
+def backfill_thumbnails(user_id, user_dir, store):
+    """Thumbnails for embedded images synced before thumbnails existed."""
+    thumbs = open_thumbnails(user_dir)
+    lacking = [fid for fid in store.id_to_name() if fid not in thumbs]
+    hashes = hashes_of(user_id, lacking)
+    missing = [(fid, object_path(user_dir, hashes[fid])) for fid in lacking
+               if fid in hashes and os.path.isfile(object_path(user_dir, hashes[fid]))]
+    if not missing:
+        return 0
+    workers = getattr(settings, "EMBED_DECODE_WORKERS", None) or min(8, os.cpu_count() or 1)
+    with ThreadPoolExecutor(workers, thread_name_prefix="thumbnails") as pool:
+        made = list(pool.map(_thumbnail_file, [path for _, path in missing]))
+    thumbs.add_many(list(zip([fid for fid, _ in missing], made)))
+    logger.info("Made thumbnails for %d previously synced images", sum(1 for m in made if m))
+    return len(missing)
+
+
+def _embeddings_stale(store):
+    """
+    True when the stored vectors come from another embedding space (a
+    different CLIP_MODEL_NAME, or a backend whose output isn't compatible
+    with the reference model). Stores from before versioning count as the
+    reference model's.
+    """
+    stored = store.model_version or manager.name
+    return len(store) > 0 and stored != manager.embedding_version
+
+
+def _reset_embeddings(store):
+    """Drop every vector so the next full sync re-embeds from the local files."""
+    logger.info("Embeddings in %s are %s, re-embedding as %s", store.path, store.model_version or manager.name,
+                manager.embedding_version)
+    store.delete_many(list(store.id_to_name()))
+    store.set_model_version(manager.embedding_version)
+
+
+def _finish(user_id, user_dir, store):
+    open_thumbnails(user_dir).compact()
+    update_text_index(user_id, user_dir)
+    # Fold the appends back into one contiguous matrix
+    if store.pending_log_ops:
+        store.compact()
+        update_ann(user_dir, store)
+
+
+# --------- Entry points ---------
+def _open_locked(user_dir):
+    """The user's store, after finishing what a crashed sync left half done. Hold user_lock."""
+    store = open_store(user_dir)
+    store.recover()
+    open_thumbnails(user_dir).recover()
+    recover_ann(user_dir)
+    recover_text_index(user_dir)
+    return store
+
+
+def sync_user(user_id, token, refresh_token=None, progress=None, dedup=None):
+    """
+    Bring a user's local cache in line with OneDrive.
+
+    Uses the saved delta link to fetch only what changed since the last
+    sync. Without one, or when it has expired, the full delta enumeration
+    is used and anything not seen is treated as deleted; if the delta
+    endpoint fails outright the recursive folder crawl is the fallback.
+    What content matching saved is added to dedup (a DedupStats).
+
+    Runs under the user's sync lock. The listing is saved until the sync
+    finishes, so one that was interrupted resumes from it: finished images
+    are skipped and the delta link only moves on at the end.
+    """
+    dedup = dedup if dedup is not None else DedupStats()
+    user_dir = user_cache_dir(user_id)
+    os.makedirs(user_dir, exist_ok=True)
+    with user_lock(user_dir):
+        return _sync_user(user_id, user_dir, token, refresh_token, progress, dedup)
+
+
+def _sync_user(user_id, user_dir, token, refresh_token, progress, dedup):
+    store = _open_locked(user_dir)
+
+    _report(progress, "listing")
+    delta_link = _load_delta_link(user_dir)
+    pending = _load_pending(user_dir)
+    if _embeddings_stale(store):
+        _reset_embeddings(store)
+        delta_link = pending = None  # every image has to be listed again
+    elif store.model_version is None:
+        store.set_model_version(manager.embedding_version)
+    if len(store) and not catalogued_count(user_id):
+        # Library synced before the catalog existed
+        logger.info("Catalogued %d stored embeddings", import_store(user_id, store, store.model_version))
+    adopt_legacy_files(user_id, user_dir)
+
+    if pending is not None:
+        logger.info("Resuming an interrupted sync of %d changed and %d deleted items",
+                    len(pending["images"]), len(pending["deleted"]))
+        images, deleted, new_link = pending["images"], pending["deleted"], pending["new_link"]
+        full, folders, relocated = pending["full"], pending["folders"], pending["relocated"]
+    else:
+        images, deleted, new_link, full, folders, relocated = _list_changes(user_dir, store, token, delta_link)
+        _save_pending(user_dir, images=images, deleted=deleted, new_link=new_link, full=full,
+                      folders=folders, relocated=relocated)
+    removed = remove_items(user_id, user_dir, store, deleted)
+    failed = []
+    new_files = add_items(user_id, user_dir, store, _with_retries(user_dir, images, deleted, full), token,
+                          refresh_token, progress, dedup, failed)
+    if relocated:
+        logger.info("Updated the paths of %d images in renamed or moved folders", _refresh_paths(user_id, folders))
+    _save_folders(user_dir, folders)
+    backfill_thumbnails(user_id, user_dir, store)
+    _report(progress, "indexing")
+    _finish(user_id, user_dir, store)
+    # Failed items are kept for the next sync before the delta link moves past them
+    _save_retries(user_dir, failed)
+    _save_delta_link(user_dir, new_link)
+    _clear_pending(user_dir)
+    kind = "full" if full else "incremental"
+    logger.info("Synced %d new images, removed %d, %d embeddings for user %s (%s, %d changed items%s).",
+                new_files, removed, len(store), user_id, kind, len(images), f", {len(failed)} failed" if failed else "")
+    if dedup.items:
+        logger.info("%s", dedup)
+    return store, user_dir
+
+
+def _list_changes(user_dir, store, token, delta_link):
+    """(images, deleted ids, new delta link, full, folders, relocated) since delta_link."""
+    full = delta_link is None
+    listed = {}
+    try:
+        try:
+            images, deleted, new_link = fetch_delta(token, delta_link, listed)
+        except DeltaExpired:
+            logger.info("Delta link expired, resyncing from scratch")
+            full = True
+            listed = {}
+            images, deleted, new_link = fetch_delta(token, folders=listed)
+    except Exception as e:
+        logger.warning("Delta query failed (%s), falling back to a full crawl", e)
+        full = True
+        images, deleted, new_link = recursive_onedrive_images(token), [], None
+
+    if full:
+        current_ids = set(item["id"] for item in images)
+        deleted = [fid for fid in store.id_to_name() if fid not in current_ids]
+    # Folder paths for the filename index: delta items only name their parent
+    folders = {} if full else _load_folders(user_dir)
+    relocated = any(folders.get(fid, entry) != entry for fid, entry in listed.items())
+    folders.update(listed)
+    for fid in deleted:
+        folders.pop(fid, None)
+    for item in images:
+        if item.get("path") is None:
+            item["path"] = _item_path(folders, item.get("parent_id"), item["name"])
+    return images, deleted, new_link, full, folders, relocated
+
+
+def sync_uploaded_item(user_id, item, token, refresh_token=None, progress=None, dedup=None):
+    """Targeted update after an upload: download and embed just that item."""
+    user_dir = user_cache_dir(user_id)
+    os.makedirs(user_dir, exist_ok=True)
+    with user_lock(user_dir):
+        store = _open_locked(user_dir)
+        if _embeddings_stale(store):
+            return sync_user(user_id, token, refresh_token, progress, dedup)[0]
+        if _load_pending(user_dir) is not None:
+            # Finish the sync that was interrupted first
+            store = sync_user(user_id, token, refresh_token, progress, dedup)[0]
+        if "file" in item and is_image(item.get("name", "")):
+            failed = []
+            add_items(user_id, user_dir, store, [item_fields(item)], token, refresh_token, progress, dedup, failed)
+            _finish(user_id, user_dir, store)
+            _save_retries(user_dir, failed, [r for r in _load_retries(user_dir) if r["id"] != item["id"]])
+    return store
+
+
+def sync_deleted_item(user_id, file_id):
+    """Targeted update after a delete: drop the local file and embedding."""
+    user_dir = user_cache_dir(user_id)
+    with user_lock(user_dir):
+        store = _open_locked(user_dir)
+        remove_items(user_id, user_dir, store, [file_id])
+        _finish(user_id, user_dir, store)
+    return store
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from ..ann import HNSWIndex, IVFIndex, ann_dir, hnswlib, load_ann, update_ann
+from ..embedding_store import EmbeddingStore
+from ..storage import TornFiles
+
+
+def clustered(n, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim))
+    return (centres[rng.integers(0, clusters, n)] + 0.1 * rng.standard_normal((n, dim))).astype(np.float32)
+
+
+class IndexTests:
+    """Shared by both backends; subclasses set cls."""
+
+    cls = None
+
+    def setUp(self):
+        self.vectors = clustered(2000)
+        self.ids = [f"id{i}" for i in range(len(self.vectors))]
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def test_nearest_neighbour_is_a_candidate(self):
+        ann = self.cls().build(self.ids, self.vectors)
+        hits = sum(self.ids[i] in ann.candidates(self.vectors[i], 10) for i in range(0, 2000, 20))
+        self.assertGreaterEqual(hits, 95)
+
+    def test_update_adds_and_removes(self):
+        ann = self.cls().build(self.ids[:1500], self.vectors[:1500])
+        ann.update(self.ids[1500:], self.vectors[1500:], ["id0", "id1"])
+        self.assertEqual(len(ann), 1998)
+        self.assertIn("id1999", ann.candidates(self.vectors[1999], 10))
+        self.assertNotIn("id0", ann.candidates(self.vectors[0], 50))
+
+    def test_save_and_load(self):
+        ann = self.cls().build(self.ids, self.vectors)
+        ann.save(self.dir)
+        loaded = self.cls.load(self.dir)
+        self.assertEqual(len(loaded), len(ann))
+        self.assertEqual(loaded.indexed_prints(), ann.indexed_prints())
+        self.assertEqual(loaded.candidates(self.vectors[7], 10), ann.candidates(self.vectors[7], 10))
+        self.assertEqual(sorted(n for n in os.listdir(self.dir) if n.startswith(".")), [])
+
+
+@override_settings(ANN_NPROBE=1)
+class IVFIndexTests(IndexTests, SimpleTestCase):
+    cls = IVFIndex
+
+    def test_torn_files_are_detected(self):
+        IVFIndex().build(self.ids, self.vectors).save(self.dir)
+        with open(os.path.join(self.dir, "ivf_ids.tsv"), "a") as f:
+            f.write("extra\n")
+        with self.assertRaises(TornFiles):
+            IVFIndex.load(self.dir)
+
+
+@unittest.skipIf(hnswlib is None, "hnswlib is not installed")
+class HNSWIndexTests(IndexTests, SimpleTestCase):
+    cls = HNSWIndex
+
+
+class UpdateAnnTests(SimpleTestCase):
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.user_dir, True)
+        self.vectors = clustered(600)
+        self.store = EmbeddingStore(os.path.join(self.user_dir, "store"), dim=self.vectors.shape[1])
+        self.store.add_many([(f"id{i}", f"{i}.jpg", v) for i, v in enumerate(self.vectors)])
+        self.store.compact()
+
+    def check_changed_vector_is_reindexed(self, backend):
+        with override_settings(ANN_MIN_IMAGES=100, ANN_BACKEND=backend, ANN_NPROBE=1):
+            update_ann(self.user_dir, self.store)
+            # id5 edited in place: now next to id9 instead of its old cluster
+            moved = self.vectors[9] + 0.01
+            self.store.add("id5", "5.jpg", moved)
+            self.store.add("new", "new.jpg", self.vectors[3])
+            self.store.delete("id7")
+            self.store.compact()
+            ann = update_ann(self.user_dir, self.store)
+            self.assertEqual(ann.trained_size, 600)  # updated, not retrained
+            self.assertIn("id5", ann.candidates(moved, 10))
+            self.assertIn("new", ann.candidates(self.vectors[3], 10))
+            self.assertNotIn("id7", ann.candidates(self.vectors[7], 50))
+            loaded = load_ann(self.user_dir)
+            self.assertIn("id5", loaded.candidates(moved, 10))
+            self.assertEqual(len(loaded), 600)
+
+    def test_ivf(self):
+        self.check_changed_vector_is_reindexed("ivf")
+
+    @unittest.skipIf(hnswlib is None, "hnswlib is not installed")
+    def test_hnsw(self):
+        self.check_changed_vector_is_reindexed("hnsw")
+
+    def test_index_without_fingerprints_is_retrained(self):
+        with override_settings(ANN_MIN_IMAGES=100, ANN_BACKEND="ivf"):
+            update_ann(self.user_dir, self.store)
+            os.remove(os.path.join(ann_dir(self.user_dir), "ivf_prints.npy"))
+            self.store.add("new", "new.jpg", self.vectors[3])
+            self.store.compact()
+            ann = update_ann(self.user_dir, self.store)
+            self.assertEqual(ann.trained_size, 601)
+
+    def test_small_libraries_have_no_index(self):
+        with override_settings(ANN_MIN_IMAGES=1000):
+            self.assertIsNone(update_ann(self.user_dir, self.store))
+            self.assertFalse(os.path.exists(ann_dir(self.user_dir)))
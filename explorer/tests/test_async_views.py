@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory, TestCase, override_settings
+
+from .. import mock_graph, views
+from ..identity import GraphUser
+
+
+class AsyncGraphViewTests(TestCase):
+    def setUp(self):
+        self.drive = tempfile.mkdtemp()
+        self.cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.drive, True)
+        self.addCleanup(shutil.rmtree, self.cache, True)
+        os.makedirs(os.path.join(self.drive, "trip"))
+        for name in ("a.jpg", "trip/b.png", "notes.txt"):
+            with open(os.path.join(self.drive, name), "wb") as f:
+                f.write(name.encode() * 100)
+        self.graph = mock_graph.MockGraph(self.drive, token="token").start()
+        self.addCleanup(self.graph.stop)
+        cache_setting = override_settings(ONEDRIVE_CACHE_DIR=self.cache)
+        cache_setting.enable()
+        self.addCleanup(cache_setting.disable)
+        patch = mock.patch.object(views, "GRAPH_API", self.graph.base_url)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_listing_matches_the_threaded_view(self):
+        for folder in ("root", mock_graph.path_to_id("trip")):
+            self.assertEqual(async_to_sync(views.alist_onedrive_items)("token", folder),
+                             views.list_onedrive_items("token", folder))
+        _, parent = async_to_sync(views.alist_onedrive_items)("token", mock_graph.path_to_id("trip"))
+        self.assertEqual(parent, "root")
+
+    def test_revoked_token(self):
+        self.assertEqual(async_to_sync(views.alist_onedrive_items)("revoked"), (None, None))
+
+    def test_proxy_streams_unsynced_images_from_graph(self):
+        request = RequestFactory().get("/proxy-image/x/")
+        request.graph_user = GraphUser(mock_graph.MOCK_USER_ID, "token")
+
+        async def fetch(item_id):
+            response = await views.proxy_image_async(request, item_id)
+            if not response.streaming:
+                return response.status_code, response.content
+            return response.status_code, b"".join([chunk async for chunk in response.streaming_content])
+
+        status, body = async_to_sync(fetch)(mock_graph.path_to_id("trip/b.png"))
+        self.assertEqual((status, body), (200, b"trip/b.png" * 100))
+        self.assertEqual(async_to_sync(fetch)(mock_graph.path_to_id("missing.jpg"))[0], 404)
+
+        request.graph_user = None
+        self.assertEqual(async_to_sync(fetch)("anything")[0], 401)
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import clip
+import torch
+from django.test import SimpleTestCase, override_settings
+
+from ..backends import EagerBackend, OnnxBackend, backend_class, make_backend, onnxruntime, parity
+
+
+class TinyClip(torch.nn.Module):
+    """Both CLIP towers in miniature: 8x8 images and clip.tokenize output to 16-d vectors."""
+
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.visual = SimpleNamespace(input_resolution=8)
+        self.image_proj = torch.nn.Linear(3 * 8 * 8, 16)
+        self.token_embedding = torch.nn.Embedding(49408, 16)
+        self.text_proj = torch.nn.Linear(16, 16)
+
+    def encode_image(self, images):
+        return self.image_proj(images.flatten(1).to(self.image_proj.weight.dtype))
+
+    def encode_text(self, tokens):
+        return self.text_proj(self.token_embedding(tokens).mean(dim=1))
+
+
+class BackendTests(SimpleTestCase):
+    def setUp(self):
+        self.model = TinyClip().eval()
+        self.images = torch.rand(3, 3, 8, 8)
+        self.tokens = clip.tokenize(["a dog", "a photo of the beach", "mountains"])
+
+    def test_backend_names(self):
+        self.assertIs(backend_class("eager"), EagerBackend)
+        with self.assertRaises(ValueError):
+            backend_class("tensorrt")
+
+    def test_torchscript_matches_eager(self):
+        result = parity(make_backend("torchscript", self.model, "cpu"), EagerBackend(self.model, "cpu"),
+                        self.images, self.tokens)
+        self.assertTrue(result["ok"], result)
+
+    def test_int8_leaves_the_shared_model_alone(self):
+        make_backend("int8", self.model, "cpu")
+        self.assertIsInstance(self.model.image_proj, torch.nn.Linear)
+        self.assertEqual(self.model.image_proj.weight.dtype, torch.float32)
+
+    @unittest.skipIf(onnxruntime is None, "onnxruntime is not installed")
+    def test_onnx_export(self):
+        export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_dir, True)
+        reference = EagerBackend(self.model, "cpu")
+        self.model.half().train()
+        with override_settings(CLIP_ONNX_DIR=export_dir):
+            backend = make_backend("onnx", self.model, "cpu", model_name="tiny/clip")
+            # The export works on a copy: the shared model keeps its dtype and mode
+            self.assertEqual(self.model.image_proj.weight.dtype, torch.float16)
+            self.assertTrue(self.model.training)
+            self.assertEqual(sorted(os.listdir(export_dir)), ["tiny-clip-image.onnx", "tiny-clip-text.onnx"])
+            # Later starts reuse the exports
+            stamp = os.stat(os.path.join(export_dir, "tiny-clip-image.onnx")).st_mtime_ns
+            OnnxBackend(self.model, "cpu", model_name="tiny/clip")
+            self.assertEqual(os.stat(os.path.join(export_dir, "tiny-clip-image.onnx")).st_mtime_ns, stamp)
+        self.model.float().eval()
+        result = parity(backend, reference, self.images, self.tokens)
+        self.assertGreater(result["image_min"], 0.99, result)
+        self.assertGreater(result["text_min"], 0.99, result)
@@ -0,0 +1,42 @@
+import threading
+import time
+from unittest import mock
+
+import torch
+from django.test import SimpleTestCase, override_settings
+
+from ..clip_model import ModelManager
+
+
+class TinyModel(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.proj = torch.nn.Linear(2, 2)
+
+
+class ModelManagerTests(SimpleTestCase):
+    def test_loads_lazily_and_once(self):
+        calls = []
+
+        def load(name, device="cpu"):
+            calls.append(name)
+            time.sleep(0.05)  # let the other threads pile up on the lock
+            return TinyModel(), "preprocess"
+
+        manager = ModelManager("ViT-B/32", device="cpu", backend="eager")
+        self.assertFalse(manager.loaded)
+        with mock.patch("clip.load", load):
+            threads = [threading.Thread(target=manager.load) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(calls, ["ViT-B/32"])
+        self.assertTrue(manager.loaded)
+        self.assertEqual(manager.preprocess, "preprocess")
+        self.assertFalse(manager.model.training)
+
+    @override_settings(CLIP_MODEL_NAME="ViT-B/16")
+    def test_embedding_version(self):
+        self.assertEqual(ModelManager(device="cpu", backend="eager").embedding_version, "ViT-B/16")
+        self.assertEqual(ModelManager(device="cpu", backend="int8").embedding_version, "ViT-B/16+int8")
@@ -0,0 +1,63 @@
+import base64
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..content import QuickXorHash, file_hash, graph_hash, object_path, store_object
+
+FOX = b"The quick brown fox jumps over the lazy dog"
+
+
+def quickxor(data):
+    h = QuickXorHash()
+    h.update(data)
+    return base64.b64encode(h.digest()).decode()
+
+
+class QuickXorHashTests(SimpleTestCase):
+    def test_known_values(self):
+        self.assertEqual(quickxor(b""), "AAAAAAAAAAAAAAAAAAAAAAAAAAA=")
+        # One byte lands at bit 0; the length is XORed into the last 8 bytes
+        self.assertEqual(quickxor(b"a"), "YQAAAAAAAAAAAAAAAQAAAAAAAAA=")
+        self.assertEqual(quickxor(FOX), "bMSlbysmxJL6S75XwfMcQZOpcr4=")
+
+    def test_chunking_does_not_matter(self):
+        data = np.random.default_rng(0).integers(0, 256, 5000, dtype=np.uint8).tobytes()
+        whole = QuickXorHash()
+        whole.update(data)
+        for cut in (1, 159, 160, 161, 2500):
+            h = QuickXorHash()
+            h.update(data[:cut])
+            h.update(b"")
+            h.update(data[cut:])
+            self.assertEqual(h.digest(), whole.digest(), cut)
+
+    def test_file_hash_matches_graph_hash(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "wb") as f:
+            f.write(FOX)
+        item = {"file": {"hashes": {"quickXorHash": quickxor(FOX)}}}
+        self.assertEqual(file_hash(path), graph_hash(item))
+        self.assertIsNone(graph_hash({"file": {"hashes": {"sha1Hash": "00"}}}))
+        self.assertIsNone(graph_hash({"file": {"hashes": {"quickXorHash": "not base64!"}}}))
+
+
+class ObjectStoreTests(SimpleTestCase):
+    def test_identical_content_is_stored_once(self):
+        user_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, user_dir, True)
+        key = "6cc4a56f2b26c492fa4bbe57c1f31c4193a972be"
+        for name in ("first", "second"):
+            with open(os.path.join(user_dir, name), "wb") as f:
+                f.write(FOX)
+        dest = store_object(user_dir, key, os.path.join(user_dir, "first"))
+        self.assertEqual(dest, object_path(user_dir, key))
+        self.assertEqual(store_object(user_dir, key, os.path.join(user_dir, "second")), dest)
+        self.assertFalse(os.path.exists(os.path.join(user_dir, "second")))
+        self.assertEqual(store_object(user_dir, key, dest), dest)
+        with open(dest, "rb") as f:
+            self.assertEqual(f.read(), FOX)
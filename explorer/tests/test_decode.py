@@ -0,0 +1,75 @@
+import io
+
+import numpy as np
+from PIL import Image
+from django.test import SimpleTestCase, override_settings
+
+from ..decode import ALPHA_BACKGROUND, EXIF_ORIENTATION, decode_size, open_image, to_rgb
+
+
+def encoded(img, fmt, **kwargs):
+    buf = io.BytesIO()
+    img.save(buf, fmt, **kwargs)
+    buf.seek(0)
+    return buf
+
+
+def gradient(w, h):
+    x = np.linspace(0, 255, w, dtype=np.uint8)
+    return Image.fromarray(np.stack([np.tile(x, (h, 1))] * 3, axis=-1))
+
+
+class ToRgbTests(SimpleTestCase):
+    def test_alpha_is_composited_onto_the_background(self):
+        img = Image.new("RGBA", (2, 1), (255, 0, 0, 255))
+        img.putpixel((1, 0), (255, 0, 0, 0))
+        out = to_rgb(img)
+        self.assertEqual(out.mode, "RGB")
+        self.assertEqual([out.getpixel((0, 0)), out.getpixel((1, 0))], [(255, 0, 0), ALPHA_BACKGROUND])
+        self.assertEqual(to_rgb(Image.new("LA", (1, 1), (0, 0))).getpixel((0, 0)), ALPHA_BACKGROUND)
+
+    def test_palette_transparency(self):
+        img = Image.new("P", (1, 1), 0)
+        img.putpalette([0, 0, 0] * 256)
+        img.info["transparency"] = 0
+        self.assertEqual(to_rgb(img).getpixel((0, 0)), ALPHA_BACKGROUND)
+
+    def test_16_bit_greyscale_is_scaled_not_clipped(self):
+        img = Image.fromarray(np.array([[0, 32768, 65535]], dtype=np.uint16))
+        self.assertEqual([to_rgb(img).getpixel((x, 0))[0] for x in range(3)], [0, 128, 255])
+
+    def test_cmyk(self):
+        self.assertEqual(to_rgb(Image.new("CMYK", (1, 1), (0, 255, 255, 0))).getpixel((0, 0)), (255, 0, 0))
+
+
+class OpenImageTests(SimpleTestCase):
+    def test_jpeg_is_decoded_at_reduced_size(self):
+        data = encoded(gradient(2000, 1000), "JPEG")
+        with open_image(data, min_size=(100, 100)) as img:
+            self.assertEqual(img.mode, "RGB")
+            self.assertGreaterEqual(img.size, (200, 100))
+            self.assertLess(img.width, 500)
+        data.seek(0)
+        with open_image(data) as img:
+            self.assertEqual(img.size, (2000, 1000))
+
+    def test_other_formats_are_reduced_by_whole_factors(self):
+        with open_image(encoded(gradient(2000, 1000), "PNG"), min_size=(100, 100)) as img:
+            self.assertEqual(img.size, (200, 100))
+
+    def test_small_images_keep_their_size(self):
+        with open_image(encoded(gradient(60, 40), "JPEG"), min_size=(100, 100)) as img:
+            self.assertEqual(img.size, (60, 40))
+
+    def test_exif_orientation(self):
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = 6  # stored rotated: needs 90 degrees clockwise
+        with open_image(encoded(gradient(400, 200), "JPEG", exif=exif), min_size=(50, 50)) as img:
+            self.assertEqual(img.size, (50, 100))
+            # The dark left edge of the original ends up at the top
+            self.assertLess(img.getpixel((25, 0))[0], img.getpixel((25, 99))[0])
+
+    def test_decode_size(self):
+        self.assertEqual(decode_size(224), (448, 1024))
+        with override_settings(EMBED_FAST_DECODE=False):
+            self.assertIsNone(decode_size(224))
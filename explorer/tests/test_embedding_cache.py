@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..clip_model import EmbeddingCache, normalize_query
+from ..metrics import EMBEDDING_CACHE_ENCODE_SECONDS, EMBEDDING_CACHE_LOOKUPS
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def test_lru_eviction(self):
+        cache = EmbeddingCache("test-lru", max_entries=2)
+        cache.put(("m", "a"), np.ones(4))
+        cache.put(("m", "b"), np.ones(4))
+        cache.get(("m", "a"))
+        cache.put(("m", "c"), np.ones(4))
+        self.assertIsNone(cache.get(("m", "b")))
+        self.assertIsNotNone(cache.get(("m", "a")))
+        self.assertEqual(cache.stats()["entries"], 2)
+
+    def test_disk_entries_are_shared(self):
+        EmbeddingCache("test-disk", disk_dir=self.dir).put(("m", "beach"), np.arange(4, dtype=np.float32))
+        other = EmbeddingCache("test-disk", disk_dir=self.dir)
+        np.testing.assert_array_equal(other.get(("m", "beach")), np.arange(4))
+        other.get(("m", "beach"))
+        other.get(("m", "forest"))
+        self.assertEqual({k: other.stats()[k] for k in ("hits", "disk_hits", "misses")},
+                         {"hits": 1, "disk_hits": 1, "misses": 1})
+        self.assertAlmostEqual(other.stats()["hit_rate"], 2 / 3)
+
+    def test_concurrent_writers_of_one_key(self):
+        cache = EmbeddingCache("test-threads", disk_dir=self.dir)
+        errors = []
+
+        def write():
+            try:
+                for _ in range(50):
+                    cache.put(("m", "same query"), np.ones(512, dtype=np.float32))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        files = [name for _, _, names in os.walk(self.dir) for name in names]
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].endswith(".npy"))
+
+    def test_metrics(self):
+        cache = EmbeddingCache("test-metrics")
+        cache.get(("m", "x"))
+        cache.put(("m", "x"), np.ones(4))
+        cache.get(("m", "x"))
+        cache.record_encode(3, 0.02)
+        self.assertEqual(EMBEDDING_CACHE_LOOKUPS.value(cache="test-metrics", result="miss"), 1)
+        self.assertEqual(EMBEDDING_CACHE_LOOKUPS.value(cache="test-metrics", result="hit"), 1)
+        self.assertEqual(EMBEDDING_CACHE_ENCODE_SECONDS.count(cache="test-metrics"), 1)
+        self.assertEqual(cache.stats()["avg_encode_ms"], 1000 * 0.02 / 3)
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  Dogs   on the\tBEACH "), "dogs on the beach")
@@ -0,0 +1,145 @@
+import os
+import pickle
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..embedding_store import (
+    INDEX_FILE, LEGACY_EMBEDDINGS, LEGACY_MAPPING, LOG_FILE, LOG_VECTORS_FILE, STORE_DIRNAME, EmbeddingStore,
+    open_store,
+)
+
+
+class EmbeddingStoreTests(SimpleTestCase):
+    dim = 8
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.rng = np.random.default_rng(0)
+
+    def store(self):
+        return EmbeddingStore(self.dir, dim=self.dim)
+
+    def vec(self):
+        return self.rng.standard_normal(self.dim).astype(np.float16)
+
+    def test_add_get_delete(self):
+        store = self.store()
+        a, b = self.vec(), self.vec()
+        store.add_many([("a", "a.jpg", a), ("b", "b.jpg", b)])
+        self.assertEqual(len(store), 2)
+        np.testing.assert_array_equal(store.get("a"), a)
+        self.assertEqual(store.name_of("b"), "b.jpg")
+        store.delete("a")
+        self.assertNotIn("a", store)
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(store.id_to_name(), {"b": "b.jpg"})
+
+    def test_re_adding_replaces_the_vector(self):
+        store = self.store()
+        store.add("a", "a.jpg", self.vec())
+        new = self.vec()
+        store.add("a", "renamed.jpg", new)
+        ids, names, vectors = store.matrix()
+        self.assertEqual((ids, names), (["a"], ["renamed.jpg"]))
+        np.testing.assert_array_equal(vectors[0], new)
+
+    def test_wrong_dimension(self):
+        with self.assertRaises(ValueError):
+            self.store().add("a", "a.jpg", np.zeros(self.dim + 1))
+
+    def test_compact_and_reload(self):
+        store = self.store()
+        vectors = {fid: self.vec() for fid in "abcd"}
+        store.add_many([(fid, f"{fid}.jpg", v) for fid, v in vectors.items()])
+        store.delete("b")
+        store.compact()
+        self.assertEqual(store.pending_log_ops, 0)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, LOG_FILE)))
+        ids, _, matrix = store.matrix()
+        self.assertIsInstance(matrix, np.memmap)  # no copy once compacted
+
+        reopened = self.store()
+        self.assertEqual(sorted(reopened.id_to_name()), ["a", "c", "d"])
+        for fid in "acd":
+            np.testing.assert_array_equal(reopened.get(fid), vectors[fid])
+        # Appends after a compaction land in the log on top of the matrix
+        e = self.vec()
+        reopened.add("e", "e.jpg", e)
+        np.testing.assert_array_equal(self.store().get("e"), e)
+
+    def test_refresh_sees_another_writer(self):
+        reader = self.store()
+        version = reader.version
+        self.store().add("a", "a.jpg", self.vec())
+        self.assertNotIn("a", reader)
+        self.assertIn("a", reader.refresh())
+        self.assertNotEqual(reader.version, version)
+
+    def test_torn_append_is_dropped_and_later_deletes_still_apply(self):
+        store = self.store()
+        store.add_many([("a", "a.jpg", self.vec()), ("b", "b.jpg", self.vec())])
+        # c's row never reached log.bin, then b was deleted
+        with open(os.path.join(self.dir, LOG_FILE), "a") as f:
+            f.write("+\tc\tc.jpg\n-\tb\n")
+        reopened = self.store()
+        self.assertEqual(sorted(reopened.id_to_name()), ["a"])
+
+        # New rows go after the surviving ones, not to the lost c
+        d = self.vec()
+        reopened.add("d", "d.jpg", d)
+        again = self.store()
+        self.assertEqual(sorted(again.id_to_name()), ["a", "d"])
+        np.testing.assert_array_equal(again.get("d"), d)
+
+    def test_rows_without_a_log_line_are_dropped(self):
+        store = self.store()
+        store.add("a", "a.jpg", self.vec())
+        with open(os.path.join(self.dir, LOG_VECTORS_FILE), "ab") as f:
+            f.write(self.vec().tobytes())
+        reopened = self.store()
+        b = self.vec()
+        reopened.add("b", "b.jpg", b)
+        np.testing.assert_array_equal(self.store().get("b"), b)
+
+    def test_interrupted_compaction_is_finished(self):
+        store = self.store()
+        vectors = {fid: self.vec() for fid in "abc"}
+        store.add_many([(fid, f"{fid}.jpg", v) for fid, v in vectors.items()])
+        real_replace = os.replace
+        calls = []
+
+        def crash(src, dst):
+            calls.append(dst)
+            if len(calls) > 2:  # after the journal and the new matrix
+                raise OSError("killed")
+            real_replace(src, dst)
+
+        with mock.patch("explorer.storage.os.replace", crash), self.assertRaises(OSError):
+            store.compact()
+        store = self.store()
+        store.recover()
+        self.assertTrue(os.path.exists(os.path.join(self.dir, INDEX_FILE)))
+        self.assertFalse(os.path.exists(os.path.join(self.dir, LOG_FILE)))
+        for fid, v in vectors.items():
+            np.testing.assert_array_equal(store.get(fid), v)
+        self.assertEqual([n for n in os.listdir(self.dir) if n.endswith(".tmp")], [])
+
+
+class LegacyImportTests(SimpleTestCase):
+    def test_pickles_are_imported_once(self):
+        user_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, user_dir, True)
+        embeddings = {"a": np.ones(512, dtype=np.float32), "b": np.zeros(512, dtype=np.float32)}
+        with open(os.path.join(user_dir, LEGACY_EMBEDDINGS), "wb") as f:
+            pickle.dump(embeddings, f)
+        with open(os.path.join(user_dir, LEGACY_MAPPING), "wb") as f:
+            pickle.dump({"a": "a.jpg"}, f)
+        store = open_store(user_dir)
+        self.assertEqual(store.id_to_name(), {"a": "a.jpg", "b": "b"})
+        self.assertTrue(os.path.exists(os.path.join(user_dir, STORE_DIRNAME, INDEX_FILE)))
+        self.assertEqual(len(open_store(user_dir)), 2)
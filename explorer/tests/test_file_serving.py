@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+from django.test import RequestFactory, SimpleTestCase
+from django.utils.http import http_date
+
+from ..file_serving import serve_bytes, serve_file
+
+DATA = bytes(range(256)) * 4
+
+
+def body(response):
+    return b"".join(response.streaming_content) if response.streaming else response.content
+
+
+class ServeFileTests(SimpleTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".jpg")
+        self.addCleanup(os.remove, self.path)
+        with os.fdopen(fd, "wb") as f:
+            f.write(DATA)
+        self.factory = RequestFactory()
+
+    def serve(self, **headers):
+        response = serve_file(self.factory.get("/image", **headers), self.path)
+        self.addCleanup(response.close)
+        return response
+
+    def test_whole_file(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body(response), DATA)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertTrue(response["Cache-Control"].startswith("private"))
+
+    def test_ranges(self):
+        for header, (start, end) in [("bytes=0-99", (0, 99)), ("bytes=1000-", (1000, 1023)),
+                                     ("bytes=-24", (1000, 1023)), ("bytes=1000-5000", (1000, 1023))]:
+            response = self.serve(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/1024")
+            self.assertEqual(body(response), DATA[start:end + 1])
+
+    def test_unsatisfiable_range(self):
+        for header in ("bytes=1024-", "bytes=-0", "bytes=50-10"):
+            response = self.serve(HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 416, header)
+            self.assertEqual(response["Content-Range"], "bytes */1024")
+
+    def test_multiple_ranges_get_the_whole_file(self):
+        self.assertEqual(self.serve(HTTP_RANGE="bytes=0-1,5-6").status_code, 200)
+
+    def test_not_modified(self):
+        first = self.serve()
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+        self.assertEqual(self.serve(HTTP_IF_MODIFIED_SINCE=first["Last-Modified"]).status_code, 304)
+        self.assertEqual(self.serve(HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_if_range(self):
+        etag = self.serve()["ETag"]
+        self.assertEqual(self.serve(HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag).status_code, 206)
+        # The client's copy is out of date: send it the whole new file
+        self.assertEqual(self.serve(HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"').status_code, 200)
+        self.assertEqual(self.serve(HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=http_date(0)).status_code, 200)
+
+    def test_serve_bytes(self):
+        request = self.factory.get("/thumb", HTTP_IF_NONE_MATCH='"t1"')
+        self.assertEqual(serve_bytes(request, b"x", "image/webp", '"t1"').status_code, 304)
+        response = serve_bytes(self.factory.get("/thumb"), b"x", "image/webp", '"t1"')
+        self.assertEqual((response.status_code, response.content, response["ETag"]), (200, b"x", '"t1"'))
@@ -0,0 +1,76 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from ..jobs import Heartbeat, claim_next, enqueue_delete, enqueue_sync, enqueue_upload, requeue_stale, run_job
+from ..models import SyncJob
+
+
+class EnqueueTests(TestCase):
+    def test_queued_sync_absorbs_later_jobs(self):
+        job = enqueue_sync("u1", "old token")
+        self.assertEqual(enqueue_sync("u1", "new token").pk, job.pk)
+        self.assertEqual(enqueue_upload("u1", "newer token", {"id": "x"}).pk, job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.access_token, "newer token")
+        self.assertEqual(SyncJob.objects.count(), 1)
+        # Another user's sync is a job of its own
+        self.assertNotEqual(enqueue_sync("u2", "token").pk, job.pk)
+
+    def test_identical_item_jobs_are_merged(self):
+        first = enqueue_delete("u1", "token", "a")
+        self.assertEqual(enqueue_delete("u1", "token", "a").pk, first.pk)
+        self.assertNotEqual(enqueue_delete("u1", "token", "b").pk, first.pk)
+        self.assertEqual(SyncJob.objects.count(), 2)
+
+
+class ClaimTests(TestCase):
+    def test_one_running_job_per_user(self):
+        enqueue_delete("u1", "token", "a")
+        enqueue_delete("u1", "token", "b")
+        enqueue_sync("u2", "token")
+        first = claim_next()
+        self.assertEqual((first.user_id, first.status, first.attempts), ("u1", SyncJob.RUNNING, 1))
+        self.assertEqual(claim_next().user_id, "u2")
+        self.assertIsNone(claim_next())
+
+    @override_settings(SYNC_JOB_STALE_SECONDS=60, SYNC_JOB_MAX_ATTEMPTS=2)
+    def test_stale_jobs_are_requeued_then_failed(self):
+        job = enqueue_sync("u1", "token")
+        claim_next()
+        SyncJob.objects.update(heartbeat_at=timezone.now() - timedelta(seconds=30))
+        requeue_stale()
+        self.assertEqual(SyncJob.objects.get(pk=job.pk).status, SyncJob.RUNNING)
+
+        SyncJob.objects.update(heartbeat_at=timezone.now() - timedelta(seconds=120))
+        requeue_stale()
+        self.assertEqual(SyncJob.objects.get(pk=job.pk).status, SyncJob.QUEUED)
+        claim_next()
+        SyncJob.objects.update(heartbeat_at=timezone.now() - timedelta(seconds=120))
+        requeue_stale()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (SyncJob.FAILED, 2))
+
+    def test_failed_job_is_logged_and_recorded(self):
+        enqueue_sync("u1", "token")
+        job = claim_next()
+        with mock.patch("explorer.sync.sync_user", side_effect=RuntimeError("Graph is down")), \
+                self.assertLogs("explorer.jobs", "ERROR") as logs:
+            run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.message, job.access_token), (SyncJob.FAILED, "Graph is down", ""))
+        self.assertIn("RuntimeError: Graph is down", logs.output[0])
+
+
+class HeartbeatTests(TransactionTestCase):
+    def test_beats_while_the_job_runs(self):
+        job = enqueue_sync("u1", "token")
+        claim_next()
+        SyncJob.objects.update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        with Heartbeat(job, interval=0.05):
+            time.sleep(0.3)
+        job.refresh_from_db()
+        self.assertGreater(job.heartbeat_at, timezone.now() - timedelta(minutes=1))
@@ -0,0 +1,31 @@
+from django.test import TestCase, override_settings
+
+from ..metrics import HTTP_REQUESTS, REGISTRY, SPAN_ITEMS, SPAN_SECONDS, span
+
+
+class SpanTests(TestCase):
+    def test_span_is_recorded_when_the_block_raises(self):
+        with self.assertRaises(ValueError), span("test_failing", items=3):
+            raise ValueError
+        self.assertEqual(SPAN_SECONDS.count(span="test_failing"), 1)
+        self.assertEqual(SPAN_ITEMS.value(span="test_failing"), 3)
+        self.assertIn('explorer_span_seconds_count{span="test_failing"} 1', REGISTRY.render())
+
+
+class MetricsViewTests(TestCase):
+    def test_off_by_default(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    @override_settings(METRICS_ENABLED=True, METRICS_TOKEN="secret")
+    def test_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("# TYPE explorer_http_requests_total counter", response.content.decode())
+
+    def test_unknown_methods_share_one_label(self):
+        before = HTTP_REQUESTS.value(view="metrics", method="other", status=404)
+        self.client.generic("BREW", "/metrics")
+        self.client.generic("PROPFIND", "/metrics")
+        self.assertEqual(HTTP_REQUESTS.value(view="metrics", method="other", status=404), before + 2)
+        self.assertEqual(HTTP_REQUESTS.value(view="metrics", method="BREW", status=404), 0)
@@ -0,0 +1,66 @@
+import numpy as np
+import torch
+from PIL import Image
+from django.test import SimpleTestCase
+
+from ..pipeline import EmbeddingPipeline
+
+
+class Model:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    def encode_image(self, images):
+        if self.fail:
+            raise RuntimeError("out of memory")
+        self.batches.append(len(images))
+        return images * 2
+
+
+def opener(path):
+    if path.startswith("bad"):
+        raise OSError(f"cannot identify image file {path!r}")
+    value = int(path.split(".")[0])
+    return Image.new("RGB", (4, 4), (value, value, value))
+
+
+def preprocess(img):
+    return torch.tensor([float(img.getpixel((0, 0))[0])])
+
+
+class EmbeddingPipelineTests(SimpleTestCase):
+    def pipeline(self, model, batch_size=4, **kwargs):
+        return EmbeddingPipeline(model, preprocess, "cpu", batch_size=batch_size, workers=3, opener=opener, **kwargs)
+
+    def test_results_in_input_order_with_failures(self):
+        paths = [f"{i}.jpg" if i % 3 else f"bad{i}.jpg" for i in range(20)]
+        model = Model()
+        results = list(self.pipeline(model).run(enumerate(paths)))
+        self.assertEqual([key for key, _, _ in results], list(range(20)))
+        for key, embedding, error in results:
+            if key % 3:
+                self.assertIsNone(error)
+                np.testing.assert_array_equal(embedding, [key * 2])
+            else:
+                self.assertIsNone(embedding)
+                self.assertIsInstance(error, OSError)
+        # Failed decodes don't take a slot in a batch
+        self.assertEqual(model.batches, [4, 4, 4, 1])
+
+    def test_encode_failure_fails_the_batch(self):
+        results = list(self.pipeline(Model(fail=True)).run(enumerate(["1.jpg", "2.jpg"])))
+        self.assertEqual([(key, embedding) for key, embedding, _ in results], [(0, None), (1, None)])
+        self.assertTrue(all(isinstance(error, RuntimeError) for _, _, error in results))
+
+    def test_on_decode_sees_every_image(self):
+        seen = []
+        pipeline = self.pipeline(Model(), on_decode=lambda key, img: seen.append((key, img.size)))
+        list(pipeline.run(enumerate(["1.jpg", "bad.jpg", "2.jpg"])))
+        self.assertEqual(sorted(seen), [(0, (4, 4)), (2, (4, 4))])
+        self.assertEqual(pipeline.encode.items, 2)
+
+    def test_stopping_early(self):
+        results = self.pipeline(Model(), batch_size=2).run((i, f"{i}.jpg") for i in range(1000))
+        self.assertEqual(next(results)[0], 0)
+        results.close()  # must not hang on the feeder
@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ..quantize import BinaryCodes, Int8Codes, full_precision_rows, hamming
+from ..search import SearchIndex, top_k
+
+
+class CodecTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        self.rows = rng.standard_normal((300, 64)).astype(np.float32)
+        self.q = rng.standard_normal(64).astype(np.float32)
+        self.q /= np.linalg.norm(self.q)
+        self.exact = (self.rows / np.linalg.norm(self.rows, axis=1, keepdims=True)) @ self.q
+
+    def test_int8_is_close(self):
+        codes = Int8Codes(self.rows)
+        self.assertEqual(codes.codes.dtype, np.int8)
+        np.testing.assert_allclose(codes.scores(self.q), self.exact, atol=0.02)
+
+    def test_binary_tracks_the_angle(self):
+        # 64 sign bits are a rough estimate, good enough to shortlist for re-ranking
+        scores = BinaryCodes(self.rows).scores(self.q)
+        self.assertGreater(np.corrcoef(scores, self.exact)[0, 1], 0.5)
+        self.assertEqual(scores.dtype, np.float32)
+
+    def test_hamming(self):
+        a = np.packbits(np.array([[1, 0, 1, 1, 0, 0, 0, 1] * 8], dtype=bool), axis=1)
+        b = np.packbits(np.array([1, 1, 1, 0, 0, 0, 0, 0] * 8, dtype=bool))
+        self.assertEqual(hamming(a, b).tolist(), [3 * 8])
+
+    def test_full_precision_rows_on_disk(self):
+        path = os.path.join(tempfile.mkdtemp(), "rerank.npy")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path), True)
+        rows = full_precision_rows(self.rows, path)
+        self.assertIsInstance(rows, np.memmap)
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["rerank.npy"])
+        np.testing.assert_allclose(np.linalg.norm(np.asarray(rows, dtype=np.float32), axis=1), 1.0, atol=1e-3)
+
+
+class QuantizedRerankTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((2000, 128)).astype(np.float32)
+        self.ids = [f"id{i}" for i in range(len(self.vectors))]
+        self.query = rng.standard_normal(128).astype(np.float32)
+        exact = SearchIndex(self.ids, self.ids, self.vectors)
+        self.exact_scores = exact.score(self.query)
+
+    def index(self, quantization, rerank):
+        return SearchIndex(self.ids, self.ids, self.vectors, quantization=quantization, rerank=rerank)
+
+    def test_reranked_rows_come_first_with_exact_scores(self):
+        for quantization in ("int8", "binary"):
+            index = self.index(quantization, 100)
+            scores = index.score(self.query)
+            ranked = top_k(scores, 100)
+            exact = index.score_rows(self.query, ranked)[ranked]
+            np.testing.assert_array_equal(scores[ranked], exact)
+            np.testing.assert_allclose(exact, self.exact_scores[ranked], atol=1e-2)
+            # Above every row that wasn't re-ranked
+            rest = np.setdiff1d(np.arange(len(scores)), ranked)
+            self.assertLess(scores[rest].max(), scores[ranked].min())
+
+    def test_top_results_match_float32(self):
+        expected = top_k(self.exact_scores, 10).tolist()
+        for quantization in ("int8", "binary"):
+            self.assertEqual(top_k(self.index(quantization, 400).score(self.query), 10).tolist(), expected)
+
+    def test_rerank_within_candidate_rows(self):
+        rows = np.arange(0, 2000, 2)
+        scores = self.index("int8", 50).score(self.query, rows)
+        self.assertEqual(top_k(scores, 5, rows).tolist(), top_k(self.exact_scores, 5, rows).tolist())
@@ -0,0 +1,65 @@
+import numpy as np
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from ..result_cache import RESULT_CACHE_ALIAS, CachedResults, Ranking, get_ranking, result_key, store_ranking
+from ..search import SearchIndex, rank
+
+
+class ResultKeyTests(SimpleTestCase):
+    def test_key_parts(self):
+        key = result_key("u1", "Beach ", "all", ("clip", 3))
+        self.assertEqual(key, result_key("u1", "beach", "all", ("clip", 3)))
+        self.assertNotEqual(key, result_key("u1", "beach", "all", ("clip", 4)))
+        self.assertNotEqual(key, result_key("u2", "beach", "all", ("clip", 3)))
+        self.assertNotEqual(key, result_key("u1", "beach", "photos", ("clip", 3)))
+        # File ids and hashes are case sensitive
+        self.assertNotEqual(result_key("u1", "AbC", "all", 1, kind="item"),
+                            result_key("u1", "abc", "all", 1, kind="item"))
+
+
+class CachedResultsTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        self.ids = [f"id{i}" for i in range(100)]
+        self.index = SearchIndex(self.ids, [f"{i}.jpg" for i in range(100)],
+                                 rng.standard_normal((100, 16)).astype(np.float32))
+        self.results = rank(self.index, rng.standard_normal(16).astype(np.float32))
+        self.addCleanup(caches[RESULT_CACHE_ALIAS].clear)
+
+    def cached(self, depth, reranks):
+        def rerank(depth):
+            reranks.append(depth)
+            return Ranking.from_results(self.results, depth)
+
+        ranking = Ranking.from_results(self.results, depth)
+        return CachedResults(ranking, self.index, lambda index, row, score: (index.ids[row], score), rerank)
+
+    def test_round_trip(self):
+        key = result_key("u1", "beach", "all", 1)
+        self.assertIsNone(get_ranking(key))
+        store_ranking(key, Ranking.from_results(self.results, 20))
+        ranking = get_ranking(key)
+        self.assertEqual((ranking.rows.dtype, ranking.scores.dtype), (np.int32, np.float32))
+        self.assertEqual((len(ranking.rows), ranking.total, ranking.complete), (20, 100, False))
+
+    def test_pages_match_the_live_ranking(self):
+        reranks = []
+        cached = self.cached(30, reranks)
+        self.assertEqual(len(cached), 100)
+        self.assertEqual([fid for fid, _ in cached[10:20]], [fid for _, fid, _, _ in self.results[10:20]])
+        self.assertEqual(reranks, [])
+        self.assertEqual(cached[-1][0], self.results[-1][1])
+        with self.assertRaises(IndexError):
+            cached[100]
+
+    def test_deeper_pages_rerank(self):
+        reranks = []
+        cached = self.cached(20, reranks)
+        cached[0:20]
+        self.assertEqual(reranks, [])
+        page = cached[40:60]
+        self.assertEqual(reranks, [60])
+        self.assertEqual([fid for fid, _ in page], [fid for _, fid, _, _ in self.results[40:60]])
+        cached[50:60]
+        self.assertEqual(reranks, [60])
@@ -0,0 +1,74 @@
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from ..search import SearchIndex, fuse, rank, top_k
+
+
+class TopKTests(SimpleTestCase):
+    def test_descending_and_stable(self):
+        scores = np.array([0.1, 0.9, 0.5, 0.9, 0.3], dtype=np.float32)
+        self.assertEqual(top_k(scores, 3).tolist(), [1, 3, 2])
+        self.assertEqual(top_k(scores, 10).tolist(), [1, 3, 2, 4, 0])
+        self.assertEqual(top_k(scores, 0).tolist(), [])
+
+    def test_candidates(self):
+        scores = np.array([0.1, 0.9, 0.5, 0.8, 0.3], dtype=np.float32)
+        self.assertEqual(top_k(scores, 2, np.array([0, 2, 4])).tolist(), [2, 4])
+
+    def test_matches_a_full_sort(self):
+        scores = np.random.default_rng(0).random(1000).astype(np.float32)
+        self.assertEqual(top_k(scores, 25).tolist(), np.argsort(-scores)[:25].tolist())
+
+
+class RankedResultsTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        vectors = rng.standard_normal((50, 16)).astype(np.float32)
+        self.ids = [f"id{i}" for i in range(50)]
+        self.index = SearchIndex(self.ids, [f"{i}.jpg" for i in range(50)], vectors)
+        self.query = rng.standard_normal(16).astype(np.float32)
+        self.expected = np.argsort(-self.index.score(self.query), kind="stable")
+
+    def test_pages_follow_the_full_ranking(self):
+        results = rank(self.index, self.query)
+        self.assertEqual(len(results), 50)
+        page = results[10:20]
+        self.assertEqual([fid for _, fid, _, _ in page], [self.ids[r] for r in self.expected[10:20]])
+        self.assertEqual(results[-1][1], self.ids[self.expected[-1]])
+        with self.assertRaises(IndexError):
+            results[50]
+
+    def test_predicate_limits_candidates(self):
+        results = rank(self.index, self.query, predicate=lambda name: int(name.split(".")[0]) % 2 == 0)
+        self.assertEqual(len(results), 25)
+        self.assertTrue(all(int(fid[2:]) % 2 == 0 for _, fid, _, _ in results[0:25]))
+        scores = [score for _, _, score, _ in results[0:25]]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_vectors_are_normalized(self):
+        scores = self.index.score(self.query * 10)
+        self.assertLessEqual(float(np.abs(scores).max()), 1.0 + 1e-5)
+
+
+
+class FuseTests(SimpleTestCase):
+    scores = np.array([0.9, 0.8, 0.7, 0.6, -np.inf], dtype=np.float32)
+    candidates = np.array([0, 1, 2, 3])
+
+    @override_settings(SEARCH_RRF_K=60)
+    def test_rrf(self):
+        fused = fuse(self.scores, self.candidates, np.array([3]), np.array([1.0], dtype=np.float32), "rrf")
+        # Row 3 is last by similarity but the only filename match, so it comes first
+        self.assertEqual(top_k(fused, 4).tolist(), [3, 0, 1, 2])
+        self.assertAlmostEqual(float(fused[3]), 1 / 64 + 1 / 61, places=6)
+        self.assertEqual(fused[4], -np.inf)
+
+    @override_settings(SEARCH_TEXT_WEIGHT=0.5)
+    def test_blend(self):
+        fused = fuse(self.scores, self.candidates, np.array([2]), np.array([1.0], dtype=np.float32), "blend")
+        np.testing.assert_allclose(fused[self.candidates], [0.5, 1 / 3, 1 / 6 + 0.5, 0.0], atol=1e-6)
+        self.assertEqual(fused[4], -np.inf)
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            fuse(self.scores, self.candidates, np.array([0]), np.array([1.0], dtype=np.float32), "max")
@@ -0,0 +1,96 @@
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..catalog import image_row, upsert_images
+from ..clip_model import image_cache, image_cache_key, manager
+from ..content import QuickXorHash
+from ..identity import ACCESS_TOKEN, EXPIRES_AT, USER_ID
+from ..index_registry import REGISTRY
+from ..result_cache import RESULT_CACHE_ALIAS
+
+PHOTO = b"the bytes of a.jpg"
+
+
+def quickxor(data):
+    h = QuickXorHash()
+    h.update(data)
+    return h.hexdigest()
+
+
+@override_settings(ANN_MIN_IMAGES=10 ** 9)
+class MoreLikeThisTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, True)
+        cache_setting = override_settings(ONEDRIVE_CACHE_DIR=cache_dir)
+        cache_setting.enable()
+        self.addCleanup(cache_setting.disable)
+        REGISTRY.clear()
+        caches[RESULT_CACHE_ALIAS].clear()
+
+        rng = np.random.default_rng(0)
+        self.vectors = {f"id{i}": rng.standard_normal(512) for i in range(30)}
+        self.vectors["id1"] = self.vectors["id0"] + 0.1 * rng.standard_normal(512)
+        upsert_images("u1", [
+            image_row("u1", {"id": fid, "name": f"{fid}.jpg"}, v, manager.embedding_version,
+                      quickxor(PHOTO) if fid == "id0" else "")
+            for fid, v in self.vectors.items()])
+        session = self.client.session
+        session.update({ACCESS_TOKEN: "token", EXPIRES_AT: time.time() + 3600, USER_ID: "u1"})
+        session.save()
+
+    def names(self, response):
+        return [name for name, *_ in response.context["images"]]
+
+    def test_similar_to_an_indexed_image(self):
+        response = self.client.get(reverse("similar", args=["id0"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["similar_to"], "id0.jpg")
+        names = self.names(response)
+        self.assertEqual(names[0], "id1.jpg")
+        self.assertNotIn("id0.jpg", names)
+        self.assertEqual(response.context["page_obj"].paginator.count, 29)
+
+    def test_unknown_image(self):
+        self.assertEqual(self.client.get(reverse("similar", args=["nope"])).status_code, 404)
+
+    def test_signed_out(self):
+        self.client.logout()
+        self.assertRedirects(self.client.get(reverse("similar", args=["id0"])), reverse("login"),
+                             fetch_redirect_response=False)
+
+    def test_upload_of_library_content_is_not_encoded(self):
+        upload = SimpleUploadedFile("query.jpg", PHOTO, content_type="image/jpeg")
+        with mock.patch("explorer.views.encode_image_bytes", side_effect=AssertionError("encoded")):
+            response = self.client.post(reverse("similar_upload"), {"image": upload}, follow=True)
+        self.assertEqual(response.redirect_chain[-1][0], reverse("similar_image", args=[quickxor(PHOTO)]))
+        self.assertEqual(self.names(response)[:2], ["id0.jpg", "id1.jpg"])
+
+    def test_new_upload_is_encoded_once(self):
+        data = b"a photo from elsewhere"
+        key = image_cache_key(quickxor(data))
+
+        def encode(data, content_hash):
+            image_cache.put(key, self.vectors["id5"])
+            return self.vectors["id5"]
+
+        with mock.patch("explorer.views.encode_image_bytes", side_effect=encode) as encoder:
+            for _ in range(2):
+                upload = SimpleUploadedFile("query.jpg", data, content_type="image/jpeg")
+                response = self.client.post(reverse("similar_upload"), {"image": upload}, follow=True)
+                self.assertEqual(self.names(response)[0], "id5.jpg")
+        self.assertEqual(encoder.call_count, 1)
+
+    def test_upload_limits(self):
+        with override_settings(SIMILAR_UPLOAD_MAX_BYTES=4):
+            upload = SimpleUploadedFile("query.jpg", PHOTO, content_type="image/jpeg")
+            self.assertEqual(self.client.post(reverse("similar_upload"), {"image": upload}).status_code, 413)
+        self.assertEqual(self.client.get(reverse("similar_image", args=["0" * 40])).status_code, 404)
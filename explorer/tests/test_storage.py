@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..storage import (
+    LockTimeout, atomic_write, recover, replace_together, temp_path, user_lock, write_text, write_together,
+)
+
+
+class AtomicWriteTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.path = os.path.join(self.dir, "file.txt")
+
+    def test_failed_write_keeps_the_old_file(self):
+        write_text(self.path, "old")
+        with self.assertRaises(RuntimeError), atomic_write(self.path) as f:
+            f.write("half")
+            raise RuntimeError("died")
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "old")
+        self.assertEqual(os.listdir(self.dir), ["file.txt"])
+
+    def test_temp_names_differ_per_thread(self):
+        names = [temp_path(self.path)]
+        thread = threading.Thread(target=lambda: names.append(temp_path(self.path)))
+        thread.start()
+        thread.join()
+        self.assertNotEqual(names[0], names[1])
+
+
+class ReplaceTogetherTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.journal = os.path.join(self.dir, "save.journal")
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def read(self, name):
+        with open(self.path(name)) as f:
+            return f.read()
+
+    def stage(self, **files):
+        """Write each file's new contents to its temp path; the (tmp, dest) renames."""
+        renames = []
+        for name, text in files.items():
+            tmp = temp_path(self.path(name))
+            with open(tmp, "w") as f:
+                f.write(text)
+            renames.append((tmp, self.path(name)))
+        return renames
+
+    def test_replaces_and_removes(self):
+        write_text(self.path("a"), "old a")
+        write_text(self.path("stale"), "x")
+        replace_together(self.journal, self.stage(a="new a", b="new b"), [self.path("stale")])
+        self.assertEqual((self.read("a"), self.read("b")), ("new a", "new b"))
+        self.assertFalse(os.path.exists(self.path("stale")))
+        self.assertFalse(os.path.exists(self.journal))
+        self.assertFalse(recover(self.journal))
+
+    def test_recover_finishes_an_interrupted_replace(self):
+        write_text(self.path("a"), "old a")
+        write_text(self.path("b"), "old b")
+        renames = self.stage(a="new a", b="new b")
+        # Died after renaming the first file (the journal itself is written with a rename too)
+        real_replace = os.replace
+        calls = []
+
+        def crash(src, dst):
+            calls.append(dst)
+            if len(calls) > 2:
+                raise OSError("killed")
+            real_replace(src, dst)
+
+        with mock.patch("explorer.storage.os.replace", crash), self.assertRaises(OSError):
+            replace_together(self.journal, renames)
+        self.assertEqual((self.read("a"), self.read("b")), ("new a", "old b"))
+
+        self.assertTrue(recover(self.journal))
+        self.assertEqual((self.read("a"), self.read("b")), ("new a", "new b"))
+        self.assertFalse(os.path.exists(self.journal))
+
+
+    def test_write_together_cleans_up_when_a_writer_fails(self):
+        write_text(self.path("a"), "old a")
+
+        def broken(tmp):
+            raise OSError("disk full")
+
+        with self.assertRaises(OSError):
+            write_together(self.journal, [(self.path("a"), lambda tmp: write_text(tmp, "new a")),
+                                          (self.path("b"), broken)])
+        self.assertEqual(sorted(os.listdir(self.dir)), ["a"])
+        self.assertEqual(self.read("a"), "old a")
+
+
+class UserLockTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+
+    def test_reentrant_in_one_thread(self):
+        with user_lock(self.dir), user_lock(self.dir):
+            pass
+
+    def test_other_threads_wait_then_time_out(self):
+        errors = []
+
+        def contend():
+            try:
+                with user_lock(self.dir, timeout=0.1):
+                    pass
+            except LockTimeout as e:
+                errors.append(e)
+
+        with user_lock(self.dir):
+            thread = threading.Thread(target=contend)
+            thread.start()
+            thread.join()
+        self.assertEqual(len(errors), 1)
+        # Released: the next taker gets it straight away
+        thread = threading.Thread(target=contend)
+        thread.start()
+        thread.join()
+        self.assertEqual(len(errors), 1)
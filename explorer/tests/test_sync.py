@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import numpy as np
+import torch
+from PIL import Image
+from django.test import TestCase, override_settings
+
+from .. import mock_graph, sync
+from ..models import OneDriveImage
+
+
+class FakeClip:
+    """Stands in for clip_model.manager: a 512-d "embedding" of the image's pixels, no weights to load."""
+
+    name = embedding_version = "test-clip"
+    device = "cpu"
+
+    def preprocess(self, img):
+        return torch.from_numpy(np.asarray(img.resize((16, 16)), dtype=np.float32).reshape(-1)[:512] + 1)
+
+    @property
+    def backend(self):
+        return self
+
+    def encode_image(self, images):
+        return images
+
+
+# --------- Delta sync against MockGraph ---------
+@override_settings(EMBED_FAST_DECODE=False, DOWNLOAD_MAX_RETRIES=0, ANN_MIN_IMAGES=10 ** 9)
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        self.drive = tempfile.mkdtemp()
+        self.cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.drive, True)
+        self.addCleanup(shutil.rmtree, self.cache, True)
+        os.makedirs(os.path.join(self.drive, "trip"))
+        for i, name in enumerate(["a.jpg", "b.jpg", "trip/c.png"]):
+            self.photo(name, i)
+        self.graph = mock_graph.MockGraph(self.drive).start()
+        self.addCleanup(self.graph.stop)
+        cache_setting = override_settings(ONEDRIVE_CACHE_DIR=self.cache)
+        cache_setting.enable()
+        self.addCleanup(cache_setting.disable)
+        for patch in (mock.patch.object(sync, "GRAPH_API", self.graph.base_url),
+                      mock.patch("explorer.downloader.GRAPH_API", self.graph.base_url),
+                      mock.patch.object(sync, "manager", FakeClip())):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.failing = set()
+        content = mock_graph.MockGraphHandler._content
+
+        def flaky_content(handler, full):
+            if os.path.relpath(full, self.drive) in self.failing:
+                return handler._send_json({"error": {"code": "generalException"}}, status=500)
+            return content(handler, full)
+
+        patch = mock.patch.object(mock_graph.MockGraphHandler, "_content", flaky_content)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def photo(self, name, seed):
+        pixels = np.random.default_rng(seed).integers(0, 256, (48, 64, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(self.drive, name))
+
+    def sync(self):
+        return sync.sync_user(mock_graph.MOCK_USER_ID, "token")
+
+    def synced_names(self):
+        return sorted(OneDriveImage.objects.filter(user_id=mock_graph.MOCK_USER_ID).values_list("name", flat=True))
+
+    def test_full_then_incremental(self):
+        store, user_dir = self.sync()
+        self.assertEqual(len(store), 3)
+        self.assertEqual(self.synced_names(), ["a.jpg", "b.jpg", "c.png"])
+        self.assertTrue(os.path.exists(os.path.join(user_dir, sync.DELTA_LINK_FILE)))
+
+        os.remove(os.path.join(self.drive, "b.jpg"))
+        self.photo("trip/d.jpg", 3)
+        requests = self.graph.requests
+        store, _ = self.sync()
+        self.assertEqual(sorted(store.id_to_name().values()), ["a.jpg", "c.png", "d.jpg"])
+        self.assertEqual(self.synced_names(), ["a.jpg", "c.png", "d.jpg"])
+        # The delta listing is one request; only d.jpg is downloaded
+        self.assertEqual(self.graph.requests - requests, 2)
+
+    def test_failed_download_is_retried(self):
+        self.failing.add("a.jpg")
+        _, user_dir = self.sync()
+        self.assertEqual(self.synced_names(), ["b.jpg", "c.png"])
+        with open(os.path.join(user_dir, sync.RETRY_FILE)) as f:
+            self.assertEqual([item["name"] for item in json.load(f)], ["a.jpg"])
+
+        # Nothing changed in OneDrive, so only the retry brings a.jpg in
+        self.failing.clear()
+        store, _ = self.sync()
+        self.assertEqual(len(store), 3)
+        self.assertEqual(self.synced_names(), ["a.jpg", "b.jpg", "c.png"])
+        self.assertFalse(os.path.exists(os.path.join(user_dir, sync.RETRY_FILE)))
+
+    def test_copies_reuse_the_existing_vector(self):
+        store, user_dir = self.sync()
+        shutil.copy(os.path.join(self.drive, "a.jpg"), os.path.join(self.drive, "trip", "copy.jpg"))
+        requests = self.graph.requests
+        store, _ = self.sync()
+        # Only the delta listing: the copy is neither downloaded nor encoded
+        self.assertEqual(self.graph.requests - requests, 1)
+        ids = {name: fid for fid, name in store.id_to_name().items()}
+        np.testing.assert_array_equal(store.get(ids["copy.jpg"]), store.get(ids["a.jpg"]))
+        objects = [name for _, _, names in os.walk(os.path.join(user_dir, "objects")) for name in names]
+        self.assertEqual(len(objects), 3)
+
+    @override_settings(SYNC_RETRY_ATTEMPTS=2)
+    def test_gives_up_after_retry_attempts(self):
+        self.failing.add("a.jpg")
+        _, user_dir = self.sync()
+        self.sync()
+        self.assertFalse(os.path.exists(os.path.join(user_dir, sync.RETRY_FILE)))
+        self.failing.clear()
+        self.sync()
+        self.assertEqual(self.synced_names(), ["b.jpg", "c.png"])
+
@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from ..text_index import TextIndex, tokenize
+
+
+class TokenizeTests(SimpleTestCase):
+    def test_ascii(self):
+        self.assertEqual(tokenize("IMG_2023-Beach.jpg"), ["img", "2023", "beach", "jpg"])
+
+    def test_accents_and_other_scripts(self):
+        self.assertEqual(tokenize("Đà Lạt 2023.jpg"), ["đà", "lạt", "2023", "jpg"])
+        self.assertEqual(tokenize("東京タワー.jpg"), ["東京タワー", "jpg"])
+        self.assertEqual(tokenize("Straße"), ["strasse"])
+
+    def test_normalized_forms_match(self):
+        # Decomposed "é" and full-width letters tokenize like their plain forms
+        self.assertEqual(tokenize("Cafe\u0301"), ["café"])
+        self.assertEqual(tokenize("ＩＭＧ１"), ["img1"])
+
+
+class TextIndexTests(SimpleTestCase):
+    names = ["Đà Lạt 2023.jpg", "london.jpg", "tokyo.png", "東京タワー.jpg", "beach-sunset.jpg", "Café.png"]
+    paths = ["/Vietnam", "/Trips", "/Trips", "/日本", "/Summer/beach", "/"]
+
+    def setUp(self):
+        self.ids = [f"id{i}" for i in range(len(self.names))]
+        self.index = TextIndex.build(self.ids, self.names, self.paths)
+
+    def names_for(self, query):
+        ids, scores = self.index.search(query)
+        self.assertEqual(list(scores), sorted(scores, reverse=True))
+        return [self.names[self.ids.index(fid)] for fid in ids]
+
+    def test_accented_name(self):
+        self.assertEqual(self.names_for("Đà Lạt"), ["Đà Lạt 2023.jpg"])
+        self.assertEqual(self.names_for("lạt"), ["Đà Lạt 2023.jpg"])
+
+    def test_cjk_name_and_folder(self):
+        self.assertEqual(self.names_for("東京"), ["東京タワー.jpg"])
+        self.assertEqual(self.names_for("タワー"), ["東京タワー.jpg"])
+        self.assertEqual(self.names_for("日本"), ["東京タワー.jpg"])
+
+    def test_single_characters_only_match_whole_tokens(self):
+        self.assertEqual(self.names_for("l"), [])
+        self.assertEqual(self.names_for("t"), [])
+
+    def test_prefix_and_substring(self):
+        self.assertEqual(self.names_for("be"), ["beach-sunset.jpg"])
+        self.assertEqual(self.names_for("unse"), ["beach-sunset.jpg"])
+        self.assertEqual(self.names_for("café"), ["Café.png"])
+
+    def test_name_outranks_folder(self):
+        index = TextIndex.build(["a", "b"], ["beach.jpg", "x.jpg"], ["/", "/beach"])
+        self.assertEqual(index.search("beach")[0], ["a", "b"])
+
+    def test_save_and_load(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, True)
+        self.index.version = 7
+        self.index.save(path)
+        loaded = TextIndex.load(path)
+        self.assertEqual(loaded.version, 7)
+        for query in ("Đà Lạt", "東京", "be", "trips"):
+            self.assertEqual(loaded.search(query)[0], self.index.search(query)[0])
@@ -0,0 +1,84 @@
+import io
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+from django.test import SimpleTestCase
+
+from ..index_registry import REGISTRY
+from ..thumbnails import PACK_FILE, ThumbnailStore, get_thumbnails, make_thumbnails, thumb_dir
+
+
+def thumbs(fid, sizes=(512, 256, 128)):
+    return {size: f"{fid}@{size}".encode() * 10 for size in sizes}
+
+
+class ThumbnailStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.user_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.user_dir, True)
+        self.path = thumb_dir(self.user_dir)
+
+    def store(self):
+        return ThumbnailStore(self.path)
+
+    def test_make_thumbnails(self):
+        out = make_thumbnails(Image.new("RGB", (1000, 500), "red"), sizes=(128, 256), fmt="JPEG")
+        self.assertEqual(sorted(out), [128, 256])
+        self.assertEqual(Image.open(io.BytesIO(out[256])).size, (256, 128))
+        self.assertEqual(Image.open(io.BytesIO(out[128])).size, (128, 64))
+
+    def test_smallest_size_that_fits(self):
+        store = self.store()
+        store.add_many([("a", thumbs("a")), ("b", thumbs("b", (128,)))])
+        self.assertEqual(store.get("a", 200)[0], thumbs("a")[256])
+        self.assertEqual(store.get("a", 1024)[0], thumbs("a")[512])
+        self.assertEqual(store.get("b", 512)[0], thumbs("b")[128])
+        self.assertIsNone(store.get("missing", 128))
+        self.assertNotEqual(store.get("a", 128)[1], store.get("b", 128)[1])
+
+    def test_links_share_bytes(self):
+        store = self.store()
+        store.add_many([("a", thumbs("a"))])
+        store.link_many([("copy", "a"), ("orphan", "missing")])
+        reopened = self.store()
+        self.assertEqual(reopened.get("copy", 128), reopened.get("a", 128))
+        self.assertNotIn("orphan", reopened)
+        self.assertEqual(reopened.live_bytes, sum(len(v) for v in thumbs("a").values()))
+
+    def test_compaction_starts_a_new_generation(self):
+        store = self.store()
+        store.add_many([(fid, thumbs(fid)) for fid in "abc"])
+        reader = self.store()
+        etag = reader.get("c", 128)[1]
+        store.delete_many(["a", "b"])
+        self.assertFalse(store.compact(min_dead_fraction=0.9))
+        self.assertTrue(store.compact())
+        self.assertEqual(store.generation, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.path, PACK_FILE)))
+        # A reader still on the old generation finds the new pack
+        data, new_etag = reader.get("c", 128)
+        self.assertEqual(data, thumbs("c")[128])
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(sorted(self.store()._entries), ["c"])
+
+    def test_index_lines_without_their_bytes_are_ignored(self):
+        store = self.store()
+        store.add_many([("a", thumbs("a"))])
+        with open(os.path.join(self.path, "index.tsv"), "a") as f:
+            f.write("+\tb\t128\t100000\t10\n")
+        reopened = self.store()
+        self.assertNotIn("b", reopened)
+        reopened.add_many([("c", thumbs("c"))])
+        self.assertEqual(self.store().get("c", 128)[0], thumbs("c")[128])
+
+    def test_served_stores_are_in_the_index_registry(self):
+        self.addCleanup(REGISTRY.discard, ("thumbs", self.path))
+        served = get_thumbnails(self.user_dir)
+        self.assertIs(get_thumbnails(self.user_dir), served)
+        self.store().add_many([(fid, thumbs(fid)) for fid in "ab"])
+        reloaded = get_thumbnails(self.user_dir)
+        self.assertIsNot(reloaded, served)
+        self.assertEqual(len(reloaded), 2)
+        self.assertGreater(reloaded.nbytes, 0)
@@ -0,0 +1,258 @@
+import bisect
+import logging
+import math
+import os
+import re
+import unicodedata
+from collections import defaultdict
+import numpy as np
+
+from .catalog import library_version, text_fields
+from .index_registry import REGISTRY, strings_nbytes
+from .storage import TornFiles, recover, remove_temps, write_together
+
+logger = logging.getLogger(__name__)
+
+TEXT_INDEX_DIRNAME = "text_index"
+JOURNAL_FILE = "save.journal"  # present only while a save swaps its files in
+TOKEN_RE = re.compile(r"[^\W_]+")  # runs of Unicode letters and digits
+FORMAT = 2  # bumped when tokenizing changes, so indexes saved by older code are rebuilt
+
+# Match quality per query token, before idf weighting
+EXACT, PREFIX, SUBSTRING = 1.0, 0.8, 0.6
+# Fields: filename tokens count fully, folder path tokens less
+FIELDS = (("n", 1.0), ("p", 0.5))
+
+
+def normalize(text):
+    """NFKC-normalized and casefolded, so full-width, composed and decomposed forms match."""
+    return unicodedata.normalize("NFKC", text or "").casefold()
+
+
+def tokenize(text):
+    """
+    Letter and digit runs of normalize(text), in any script:
+    "IMG_2023-Beach.jpg" -> ["img", "2023", "beach", "jpg"], "Đà Lạt.jpg" -> ["đà", "lạt", "jpg"].
+    """
+    return TOKEN_RE.findall(normalize(text))
+
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def _read_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().split("\n")[:-1]
+
+
+def _write_lines(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("".join(f"{line}\n" for line in lines))
+
+
+def _write_npy(path, array):
+    with open(path, "wb") as f:  # np.save(path) would append ".npy" to a temporary name
+        np.save(f, array)
+
+
+class TextIndex:
+    """
+    Inverted index over image filenames and folder paths. Each field maps
+    whole tokens ("nw:beach") and their trigrams ("ng:bea") to posting
+    lists of documents, so a query only touches the documents that share
+    its terms: whole-token hits directly, longer tokens as substrings via
+    the intersection of their trigram postings (checked against the text),
+    two-character ones as prefixes through a sorted token vocabulary.
+    A single character only matches as a whole token.
+    """
+
+    def __init__(self, ids, texts, terms, offsets, postings):
+        self.ids = list(ids)
+        self.texts = texts          # {"n": [normalized names], "p": [normalized paths]}
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets      # postings of term i: postings[offsets[i]:offsets[i + 1]]
+        self.postings = postings
+        self.vocab = {field: sorted(t[3:] for t in terms if t.startswith(f"{field}w:")) for field, _ in FIELDS}
+        self.version = None         # library version the documents were read at
+
+    @classmethod
+    def build(cls, ids, names, paths):
+        lists = defaultdict(list)
+        for doc, (name, path) in enumerate(zip(names, paths)):
+            doc_terms = set()
+            for field, text in (("n", name), ("p", path)):
+                for token in tokenize(text):
+                    doc_terms.add(f"{field}w:{token}")
+                    doc_terms.update(f"{field}g:{gram}" for gram in trigrams(token))
+            # Documents are visited in order, so every list comes out sorted
+            for term in doc_terms:
+                lists[term].append(doc)
+        terms = sorted(lists)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(lists[t]) for t in terms])
+        postings = np.empty(int(offsets[-1]), dtype=np.int32)
+        for i, term in enumerate(terms):
+            postings[offsets[i]:offsets[i + 1]] = lists[term]
+        texts = {"n": [normalize(n) for n in names], "p": [normalize(p) for p in paths]}
+        return cls(ids, texts, terms, offsets, postings)
+
+    @classmethod
+    def from_catalog(cls, user_id):
+        version = library_version(user_id)  # read first: rows are at least this new
+        ids, names, paths = text_fields(user_id)
+        index = cls.build(ids, names, paths)
+        index.version = version
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        """Approximate memory use: postings, terms and vocabularies, ids and texts."""
+        terms = list(self.terms)
+        return (self.postings.nbytes + self.offsets.nbytes + strings_nbytes(self.ids)
+                + sum(strings_nbytes(texts) for texts in self.texts.values())
+                + 2 * strings_nbytes(terms) + 100 * len(terms))
+
+    def _postings(self, term):
+        i = self.terms.get(term)
+        if i is None:
+            return np.empty(0, dtype=np.int32)
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def _match_token(self, field, token):
+        """{doc: quality} for documents whose field contains token."""
+        matched = dict.fromkeys(self._postings(f"{field}w:{token}").tolist(), EXACT)
+        if len(token) >= 3:
+            grams = sorted((self._postings(f"{field}g:{g}") for g in trigrams(token)), key=len)
+            candidates = grams[0]
+            for other in grams[1:]:
+                if not len(candidates):
+                    break
+                candidates = np.intersect1d(candidates, other, assume_unique=True)
+            texts = self.texts[field]
+            for doc in candidates.tolist():
+                if doc not in matched and token in texts[doc]:
+                    matched[doc] = SUBSTRING
+        elif len(token) > 1:  # a single character would prefix-match half the library
+            vocab = self.vocab[field]
+            start = bisect.bisect_left(vocab, token)
+            for word in vocab[start:bisect.bisect_left(vocab, token + "\uffff")]:
+                if word != token:
+                    for doc in self._postings(f"{field}w:{word}").tolist():
+                        matched.setdefault(doc, PREFIX)
+        return matched
+
+    def search(self, query):
+        """
+        (file ids, scores) of the documents matching any query token, best
+        first. A document scores the idf-weighted match quality of each
+        token it contains, summed over tokens and fields and scaled so the
+        best possible match is 1.0.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self.ids:
+            return [], np.empty(0, dtype=np.float32)
+        scores = defaultdict(float)
+        best = 0.0
+        for token in tokens:
+            top_idf = 0.0
+            for field, weight in FIELDS:
+                matched = self._match_token(field, token)
+                if not matched:
+                    continue
+                idf = math.log(1 + len(self.ids) / len(matched))
+                top_idf = max(top_idf, weight * idf)
+                for doc, quality in matched.items():
+                    scores[doc] += weight * quality * idf
+            best += top_idf or math.log(1 + len(self.ids))
+        docs = sorted(scores, key=lambda d: (-scores[d], self.texts["n"][d]))
+        return ([self.ids[d] for d in docs],
+                np.asarray([scores[d] / best for d in docs], dtype=np.float32))
+
+    # --------- Persistence ---------
+    def save(self, path):
+        """
+        Swap the files in together (storage.write_together), meta.tsv with
+        the version and counts last; load checks the counts, so a reader
+        that catches the swap midway falls back to the catalog.
+        """
+        os.makedirs(path, exist_ok=True)
+        terms = sorted(self.terms, key=self.terms.get)
+        docs = [f"{fid}\t{name}\t{p}" for fid, name, p in zip(self.ids, self.texts["n"], self.texts["p"])]
+        meta = [str(self.version), str(len(docs)), str(len(terms)), str(len(self.postings)), str(FORMAT)]
+        write_together(os.path.join(path, JOURNAL_FILE), [
+            (os.path.join(path, "offsets.npy"), lambda tmp: _write_npy(tmp, self.offsets)),
+            (os.path.join(path, "postings.npy"), lambda tmp: _write_npy(tmp, self.postings)),
+            (os.path.join(path, "terms.tsv"), lambda tmp: _write_lines(tmp, terms)),
+            (os.path.join(path, "docs.tsv"), lambda tmp: _write_lines(tmp, docs)),
+            (os.path.join(path, "meta.tsv"), lambda tmp: _write_lines(tmp, meta)),
+        ])
+
+    @classmethod
+    def load(cls, path):
+        meta = _read_lines(os.path.join(path, "meta.tsv"))
+        if len(meta) < 5 or int(meta[4]) != FORMAT:
+            raise ValueError(f"Filename index in {path} was built by an older tokenizer")
+        ids, names, paths = [], [], []
+        for line in _read_lines(os.path.join(path, "docs.tsv")):
+            fid, name, p = line.split("\t")
+            ids.append(fid)
+            names.append(name)
+            paths.append(p)
+        index = cls(ids, {"n": names, "p": paths}, _read_lines(os.path.join(path, "terms.tsv")),
+                    np.load(os.path.join(path, "offsets.npy")), np.load(os.path.join(path, "postings.npy")))
+        index.version = int(meta[0])
+        if [int(n) for n in meta[1:4]] != [len(ids), len(index.terms), len(index.postings)]:
+            raise TornFiles(f"Filename index files in {path} don't match")
+        return index
+
+
+def text_index_dir(user_dir):
+    return os.path.join(user_dir, TEXT_INDEX_DIRNAME)
+
+
+def recover_text_index(user_dir):
+    """Finish a save a crash interrupted and drop its temporary files. Hold the user's sync lock."""
+    path = text_index_dir(user_dir)
+    if os.path.isdir(path):
+        if recover(os.path.join(path, JOURNAL_FILE)):
+            logger.info("Finished an interrupted save of %s", path)
+        remove_temps(path)
+
+
+def update_text_index(user_id, user_dir):
+    """Rebuild the user's filename index during sync, once the catalog has moved past it."""
+    path = text_index_dir(user_dir)
+    try:
+        meta = _read_lines(os.path.join(path, "meta.tsv"))
+        built = int(meta[0]) if int(meta[4]) == FORMAT else None
+    except (FileNotFoundError, IndexError, ValueError):
+        built = None
+    if built == library_version(user_id):
+        return None
+    index = TextIndex.from_catalog(user_id)
+    index.save(path)
+    logger.info("Built filename index over %d images (%d terms)", len(index), len(index.terms))
+    return index
+
+
+# --------- Per-process cache ---------
+def get_text_index(user_id, user_dir, version):
+    """
+    The user's filename index at catalog version `version`: the one sync
+    saved, or, if that is missing or behind, one built here from the catalog.
+    """
+    def load():
+        index = None
+        try:
+            index = TextIndex.load(text_index_dir(user_dir))
+        except (FileNotFoundError, IndexError, ValueError):
+            pass
+        if index is None or index.version != version:
+            index = TextIndex.from_catalog(user_id)
+        return index
+
+    return REGISTRY.get(("text", user_id, user_dir), version, load)
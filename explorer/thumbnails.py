@@ -0,0 +1,316 @@
+import io
+import os
+import threading
+from PIL import Image
+from django.conf import settings
+
+from .index_registry import REGISTRY, strings_nbytes
+from .storage import fsync_dir, recover, remove_temps, sync_file, temp_path, write_text
+
+THUMB_DIRNAME = "thumbs"
+
+# Files inside <user_dir>/thumbs/
+PACK_FILE = "thumbs.bin"       # encoded thumbnails, back to back
+INDEX_FILE = "index.tsv"       # "+<TAB>id<TAB>size<TAB>offset<TAB>length" or "-<TAB>id"
+GENERATION_FILE = "generation.txt"  # the current pack and index; each compaction starts a new one
+JOURNAL_FILE = "compact.journal"    # only left by compactions of older versions
+
+
+def generation_name(name, generation):
+    """thumbs.bin / index.tsv, then thumbs.1.bin / index.1.tsv after the first compaction, ..."""
+    if not generation:
+        return name
+    base, ext = os.path.splitext(name)
+    return f"{base}.{generation}{ext}"
+
+CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+
+def thumbnail_sizes():
+    """Longest-edge sizes in pixels, largest first."""
+    return sorted(getattr(settings, "THUMBNAIL_SIZES", (128, 256, 512)), reverse=True)
+
+
+def thumbnail_format():
+    return getattr(settings, "THUMBNAIL_FORMAT", "WEBP").upper()
+
+
+def thumb_dir(user_dir):
+    return os.path.join(user_dir, THUMB_DIRNAME)
+
+
+def make_thumbnails(img, sizes=None, fmt=None, quality=None):
+    """
+    Encode an already decoded PIL image at each size. Each size is reduced
+    from the previous (larger) one, so the original is only resampled once.
+    Returns {size: bytes}.
+    """
+    sizes = sizes or thumbnail_sizes()
+    fmt = fmt or thumbnail_format()
+    quality = quality or getattr(settings, "THUMBNAIL_QUALITY", 80)
+    base = img.convert("RGB")
+    out = {}
+    for size in sorted(sizes, reverse=True):
+        base.thumbnail((size, size), Image.LANCZOS)
+        buf = io.BytesIO()
+        base.save(buf, fmt, quality=quality)
+        out[size] = buf.getvalue()
+    return out
+
+
+def read_generation(path):
+    try:
+        with open(os.path.join(path, GENERATION_FILE), "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def store_signature(path):
+    """(generation, stat of its pack, stat of its index): changes whenever a store is written to."""
+    sig = [read_generation(path)]
+    for name in (PACK_FILE, INDEX_FILE):
+        try:
+            st = os.stat(os.path.join(path, generation_name(name, sig[0])))
+            sig.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append(None)
+    return tuple(sig)
+
+
+class ThumbnailStore:
+    """
+    Per-user thumbnail store: every size of every image appended to one
+    pack file, located through a small append-only index. Replacing or
+    deleting an image only appends index lines; compact() rewrites the pack
+    once more than half of it is dead.
+
+    A compaction writes the pack and index of a new generation under new
+    names and then switches generation.txt over, so a reader never pairs a
+    pack with another generation's index. The generation is part of the
+    ETag, since offsets are only meaningful within one pack.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_generation(self):
+        return read_generation(self.path)
+
+    @property
+    def _pack(self):
+        return self._file(generation_name(PACK_FILE, self.generation))
+
+    @property
+    def _index(self):
+        return self._file(generation_name(INDEX_FILE, self.generation))
+
+    def _signature(self):
+        return store_signature(self.path)
+
+    def _load(self):
+        for _ in range(3):
+            self._sig = self._signature()
+            self.generation = self._sig[0]
+            self._load_generation()
+            if self._read_generation() == self.generation:
+                return
+            # A compaction switched generations (and may have deleted these files) while we read
+
+    def _load_generation(self):
+        entries = {}
+        try:
+            pack_size = os.path.getsize(self._pack)
+        except FileNotFoundError:
+            pack_size = 0
+        if os.path.exists(self._index):
+            with open(self._index, "r", encoding="utf-8") as f:
+                for line in f.read().split("\n"):
+                    op = line.split("\t")
+                    if op[0] == "+" and len(op) == 5:
+                        offset, length = int(op[3]), int(op[4])
+                        # An index line whose bytes never reached the pack is ignored
+                        if offset + length <= pack_size:
+                            entries.setdefault(op[1], {})[int(op[2])] = (offset, length)
+                    elif op[0] == "-" and len(op) >= 2:
+                        entries.pop(op[1], None)
+        self._entries = entries
+        self._pack_size = pack_size
+
+    def recover(self):
+        """
+        Drop what an interrupted compaction left: temporary files and the
+        pack and index of generations other than the current one (see
+        EmbeddingStore.recover). Hold the user's sync lock.
+        """
+        recover(self._file(JOURNAL_FILE))
+        remove_temps(self.path)
+        with self._lock:
+            self._load()
+        self._remove_other_generations()
+
+    def _remove_other_generations(self):
+        current = {generation_name(PACK_FILE, self.generation), generation_name(INDEX_FILE, self.generation)}
+        for name in os.listdir(self.path):
+            if name.startswith(("thumbs.", "index.")) and name.endswith((".bin", ".tsv")) and name not in current:
+                try:
+                    os.remove(self._file(name))
+                except OSError:  # still open by a reader on Windows; the next recover retries
+                    pass
+
+    def refresh(self):
+        """Reload if another process has written since we loaded."""
+        if self._signature() != self._sig:
+            with self._lock:
+                self._load()
+        return self
+
+    # --------- Read API ---------
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, file_id):
+        return file_id in self._entries
+
+    @property
+    def nbytes(self):
+        # The in-memory index: ids, then a small dict per image holding an (offset, length) tuple per size
+        n_sizes = sum(len(sizes) for sizes in self._entries.values())
+        return strings_nbytes(list(self._entries)) + len(self._entries) * 232 + n_sizes * 112
+
+    @property
+    def live_bytes(self):
+        # Linked images share their bytes (see link_many)
+        return sum(length for _, length in set(loc for sizes in self._entries.values() for loc in sizes.values()))
+
+    def get(self, file_id, size):
+        """
+        (bytes, etag) of the smallest stored size >= size (else the largest),
+        or None if the image has no thumbnails.
+        """
+        for attempt in range(2):
+            generation, sizes = self.generation, self._entries.get(file_id)
+            if not sizes:
+                return None
+            fits = [s for s in sizes if s >= size]
+            chosen = min(fits) if fits else max(sizes)
+            offset, length = sizes[chosen]
+            try:
+                with open(self._file(generation_name(PACK_FILE, generation)), "rb") as f:
+                    f.seek(offset)
+                    data = f.read(length)
+            except FileNotFoundError:
+                if attempt:
+                    raise
+                self.refresh()  # compacted since we loaded: look it up in the new generation
+                continue
+            return data, f'"t{chosen}-{generation:x}-{offset:x}-{length:x}"'
+
+    # --------- Write API ---------
+    def add_many(self, entries):
+        """Append (file_id, {size: bytes}) pairs."""
+        entries = [(fid, thumbs) for fid, thumbs in entries if thumbs]
+        if not entries:
+            return
+        lines = []
+        offset = self._pack_size
+        # Pack first: an index line without its bytes is ignored on load
+        with open(self._pack, "ab") as f:
+            if f.tell() != offset:
+                f.truncate(offset)
+                f.seek(offset)
+            for fid, thumbs in entries:
+                sizes = {}
+                for size, data in thumbs.items():
+                    f.write(data)
+                    sizes[size] = (offset, len(data))
+                    lines.append(f"+\t{fid}\t{size}\t{offset}\t{len(data)}\n")
+                    offset += len(data)
+                self._entries[fid] = sizes
+        with open(self._index, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+        self._pack_size = offset
+        self._sig = self._signature()
+
+    def link_many(self, pairs):
+        """
+        Give each (file_id, source_id) pair's file_id the thumbnails of
+        source_id (an image with the same content) without writing them again.
+        """
+        lines = []
+        for fid, source in pairs:
+            sizes = self._entries.get(source)
+            if not sizes or fid == source:
+                continue
+            self._entries[fid] = dict(sizes)
+            lines.extend(f"+\t{fid}\t{size}\t{offset}\t{length}\n" for size, (offset, length) in sizes.items())
+        if not lines:
+            return
+        with open(self._index, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+        self._sig = self._signature()
+
+    def delete_many(self, file_ids):
+        file_ids = [fid for fid in file_ids if fid in self._entries]
+        if not file_ids:
+            return
+        with open(self._index, "a", encoding="utf-8") as f:
+            f.write("".join(f"-\t{fid}\n" for fid in file_ids))
+        for fid in file_ids:
+            del self._entries[fid]
+        self._sig = self._signature()
+
+    def compact(self, min_dead_fraction=0.5):
+        """Rewrite the pack with only live thumbnails once enough of it is dead."""
+        live = self.live_bytes
+        if self._pack_size == 0 or self._pack_size - live <= min_dead_fraction * self._pack_size:
+            return False
+        new = self.generation + 1
+        new_pack = self._file(generation_name(PACK_FILE, new))
+        new_index = self._file(generation_name(INDEX_FILE, new))
+        tmp_pack, tmp_index = temp_path(new_pack), temp_path(new_index)
+        lines = []
+        offset = 0
+        moved = {}  # old offset -> new offset, so linked thumbnails stay shared
+        with open(self._pack, "rb") as src, open(tmp_pack, "wb") as dst:
+            for fid, sizes in self._entries.items():
+                for size, (old_offset, length) in sizes.items():
+                    if old_offset not in moved:
+                        src.seek(old_offset)
+                        dst.write(src.read(length))
+                        moved[old_offset] = offset
+                        offset += length
+                    lines.append(f"+\t{fid}\t{size}\t{moved[old_offset]}\t{length}\n")
+            sync_file(dst)
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            f.write("".join(lines))
+            sync_file(f)
+        # Nothing reads the new generation's files until generation.txt names it
+        os.replace(tmp_pack, new_pack)
+        os.replace(tmp_index, new_index)
+        fsync_dir(self.path)
+        write_text(self._file(GENERATION_FILE), str(new))
+        with self._lock:
+            self._load()
+        self._remove_other_generations()
+        return True
+
+
+# --------- Serving ---------
+def open_thumbnails(user_dir):
+    return ThumbnailStore(thumb_dir(user_dir))
+
+
+def get_thumbnails(user_dir):
+    """
+    ThumbnailStore for serving, held in the index registry (so it counts
+    against SEARCH_INDEX_MEMORY_MB) and reloaded when sync has written to it.
+    """
+    path = thumb_dir(user_dir)
+    return REGISTRY.get(("thumbs", path), store_signature(path), lambda: ThumbnailStore(path))
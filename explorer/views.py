@@ -1,122 +1,34 @@
 from django.shortcuts import render, redirect
 from django.core.paginator import Paginator
 from django.conf import settings
-from msal import ConfidentialClientApplication
 from django.views.decorators.csrf import csrf_exempt
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, JsonResponse
 from django.urls import reverse
-import requests, uuid, numpy as np, pickle, os, time
-import torch
-from PIL import Image
-
-from .clip_model import encode_text, encode_image_from_url, model, preprocess, device
-
-# --------- New Helper to Get User ID ---------
-def get_user_id(request):
-    token = request.session.get('access_token')
-    headers = {"Authorization": f"Bearer {token}"}
-    resp = requests.get("https://graph.microsoft.com/v1.0/me", headers=headers)
-    if resp.status_code == 200:
-        return resp.json().get("id", "default")
-    return "default"
-
-# --------- The Sync Function ---------
-def sync_onedrive_images(request):
-    token = request.session.get('access_token')
-    user_id = get_user_id(request)
-    user_dir = os.path.join("/tmp/onedrive_cache", str(user_id))
-    os.makedirs(user_dir, exist_ok=True)
-    embedding_path = os.path.join(user_dir, "clip_embeddings.pkl")
-    mapping_path = os.path.join(user_dir, "file_id_to_name.pkl")
-
-    # MSAL app instance for token refresh
-    msal_app = ConfidentialClientApplication(
-        settings.MICROSOFT_CLIENT_ID,
-        authority=settings.MICROSOFT_AUTHORITY,
-        client_credential=settings.MICROSOFT_CLIENT_SECRET,
-    )
-
-    # Load or initialize embedding cache and ID-name mapping
-    if os.path.exists(embedding_path):
-        with open(embedding_path, "rb") as f:
-            embedding_cache = pickle.load(f)
-    else:
-        embedding_cache = {}
-
-    if os.path.exists(mapping_path):
-        with open(mapping_path, "rb") as f:
-            file_id_to_name = pickle.load(f)
-    else:
-        file_id_to_name = {}
-
-    images = recursive_onedrive_images(token)
-    current_ids = set(item["id"] for item in images)
-    id_name_new = {item["id"]: item["name"] for item in images}
-
-    # --- Remove deleted files and embeddings ---
-    files_on_disk = set(os.listdir(user_dir))
-    for file_id, fname in list(file_id_to_name.items()):
-        if file_id not in current_ids:
-            # Remove local file if present
-            path = os.path.join(user_dir, fname)
-            if os.path.exists(path):
-                try:
-                    os.remove(path)
-                    print(f"Deleted local file no longer in OneDrive: {fname}")
-                except Exception as e:
-                    print(f"Error deleting {fname}: {e}")
-            # Remove mapping and embedding
-            embedding_cache.pop(file_id, None)
-            del file_id_to_name[file_id]
-            print(f"Removed stale embedding/mapping for {file_id}")
-
-    new_files = 0
-    for item in images:
-        file_id = item["id"]
-        file_name = item["name"]
-        ext = os.path.splitext(file_name)[1].lower()
-        if ext not in [".jpg", ".jpeg", ".png"]:
-            continue
-        local_path = os.path.join(user_dir, file_name)  # Save with original file name
-        file_id_to_name[file_id] = file_name  # Update mapping
-        if not os.path.exists(local_path):
-            content = download_onedrive_file(file_id, token, msal_app, request)
-            if content:
-                with open(local_path, "wb") as f:
-                    f.write(content)
-                print(f"Downloaded: {file_name}")
-            else:
-                print(f"Failed to download: {file_name}")
-                continue
-        if file_id not in embedding_cache:
-            try:
-                img = preprocess(Image.open(local_path)).unsqueeze(0).to(device)
-                with torch.no_grad():
-                    embedding = model.encode_image(img).cpu().numpy()
-                embedding_cache[file_id] = embedding
-                new_files += 1
-                print(f"Embedded: {file_name}")
-            except Exception as e:
-                print(f"Error embedding {file_name}: {e}")
-
-    # Save caches/mapping
-    with open(embedding_path, "wb") as f:
-        pickle.dump(embedding_cache, f)
-    with open(mapping_path, "wb") as f:
-        pickle.dump(file_id_to_name, f)
-    print(f"Synced {new_files} new images and updated {len(file_id_to_name)} mappings for user {user_id}.")
-
-    return embedding_cache, user_dir, file_id_to_name
-
+import uuid, os, time, mimetypes, logging, asyncio
+import numpy as np
+from asgiref.sync import sync_to_async
+
+from .clip_model import cached_image_embedding, encode_image_bytes, encode_text, manager
+from .embedding_store import user_cache_dir
+from .search import get_library_index, rank
+from .catalog import image_file, vectors_by_hash
+from .content import QuickXorHash, object_path
+from .result_cache import CachedResults, Ranking, get_ranking, result_key, store_ranking
+from .ann import get_ann
+from .text_index import get_text_index
+from .graph import GRAPH_API, async_graph_client, graph_session
+from .file_serving import astream_graph_content, serve_bytes, serve_file, stream_graph_content
+from .thumbnails import CONTENT_TYPES, get_thumbnails, thumbnail_format
+from .identity import complete_login, job_session_key, msal_app
+from .jobs import enqueue_sync, enqueue_upload, enqueue_delete, user_jobs
+from .metrics import metrics_response, observe
+
+logger = logging.getLogger(__name__)
 
 # ------------- Django Auth Views ---------------
 def login(request):
     request.session["state"] = str(uuid.uuid4())
-    app = ConfidentialClientApplication(
-        settings.MICROSOFT_CLIENT_ID,
-        authority=settings.MICROSOFT_AUTHORITY,
-        client_credential=settings.MICROSOFT_CLIENT_SECRET,
-    )
+    app = msal_app()
     auth_url = app.get_authorization_request_url(
         scopes=settings.MICROSOFT_SCOPE,
         state=request.session["state"],
@@ -128,20 +40,11 @@ def callback(request):
     if request.GET.get('state') != request.session.get("state"):
         return redirect("/")
     code = request.GET.get("code")
-    app = ConfidentialClientApplication(
-        settings.MICROSOFT_CLIENT_ID,
-        authority=settings.MICROSOFT_AUTHORITY,
-        client_credential=settings.MICROSOFT_CLIENT_SECRET,
-    )
-    result = app.acquire_token_by_authorization_code(
-        code,
-        scopes=settings.MICROSOFT_SCOPE,
-        redirect_uri=settings.MICROSOFT_REDIRECT_URI
-    )
+    # Token, expiry, MSAL cache and user id all go into the session once here
+    result = complete_login(request, code)
     if "access_token" in result:
-        request.session["access_token"] = result["access_token"]
-        # Call sync after login
-        sync_onedrive_images(request)
+        # Queue a sync for the background worker instead of blocking the login
+        enqueue_sync(request.session["user_id"], result["access_token"], job_session_key(request))
         return redirect("/")
     else:
         return render(request, "explorer/error.html", {"error": result.get("error_description")})
@@ -150,168 +53,228 @@ def logout(request):
     request.session.flush()
     return redirect("https://login.microsoftonline.com/common/oauth2/v2.0/logout?post_logout_redirect_uri=http://localhost:8000/")
 
-def home(request):
-    import mimetypes
-
-    # Debug: Print device information for CLIP model
-    if torch.cuda.is_available():
-        print("CLIP Model is running on GPU:", torch.cuda.get_device_name(0))
-    else:
-        print("CLIP Model is running on CPU")
+# Map filter_type to allowed file extensions
+FILTER_MAP = {
+    "All": None,
+    "Document": (".pdf", ".doc", ".docx", ".txt", ".ppt", ".pptx", ".xls", ".xlsx"),
+    "Image": (".jpg", ".jpeg", ".png", ".bmp", ".gif"),
+    "Audio": (".mp3", ".wav", ".aac", ".ogg", ".m4a"),
+    "Video": (".mp4", ".avi", ".mov", ".mkv", ".flv"),
+}
+
+def filter_predicate(filter_type):
+    """Filename predicate for a filter, or None when everything passes."""
+    exts = FILTER_MAP.get(filter_type)
+    if not exts:
+        return None
+    return lambda filename: filename.lower().endswith(exts)
+
+def ranked_page(request, user_id, query, kind, filter_type, query_vector, exclude_file_id=None):
+    """
+    One page of ranked results for a query and the stage timings.
 
-    token = request.session.get("access_token")
-    if not token:
-        return redirect("login")
+    query_vector() returns the query embedding; it is only called when the
+    ranking isn't cached. Text queries (kind "text") are also matched
+    against filenames; "item" and "image" queries rank by similarity alone.
+    """
+    user_dir = user_cache_dir(user_id)
+    predicate = filter_predicate(filter_type)
+
+    def make_row(index, row, score):
+        img_url = reverse('proxy_image', args=[index.ids[row]])
+        thumb_url = reverse('thumbnail', args=[index.ids[row], settings.THUMBNAIL_GRID_SIZE])
+        similar_url = reverse('similar', args=[index.ids[row]])
+        return (index.names[row], img_url, score, thumb_url, similar_url)
+
+    def rerank(depth=None):
+        # One matrix-vector product, fused with filename / folder matches
+        start = time.perf_counter()
+        vector = query_vector()
+        timings["encode"] = (time.perf_counter() - start) * 1000
+        # Large libraries only score the candidates the ANN index returns
+        ann_rows = None
+        if len(index) >= settings.ANN_MIN_IMAGES:
+            start = time.perf_counter()
+            ann = get_ann(user_dir)
+            if ann is not None:
+                ann_rows = index.rows_for(ann.candidates(vector, settings.ANN_CANDIDATES))
+            timings["ann"] = (time.perf_counter() - start) * 1000
+        text_index = get_text_index(user_id, user_dir, index.version) if kind == "text" else None
+        exclude = None if exclude_file_id is None else index.rows_for([exclude_file_id])
+        results = rank(index, vector, query if kind == "text" else "", predicate, make_row, ann_rows,
+                       text_index=text_index, timings=timings, exclude_rows=exclude)
+        start = time.perf_counter()
+        ranking = Ranking.from_results(results, depth)
+        timings["top_k"] = (time.perf_counter() - start) * 1000
+        store_ranking(key, ranking)
+        return ranking
+
+    # Ranked row ids are cached per (user, query, filter, catalog version);
+    # paging through them only builds rows and URLs for the page shown
+    timings = {}
+    start = time.perf_counter()
+    index = get_library_index(user_id, manager.embedding_version)
+    timings["index"] = (time.perf_counter() - start) * 1000
+    key = result_key(user_id, query, filter_type, (manager.embedding_version, index.version), kind)
+    ranking = get_ranking(key)
+    cached = ranking is not None
+    if not cached:
+        ranking = rerank()
+    sorted_images = CachedResults(ranking, index, make_row, rerank)
+    logger.debug("Candidates: %d, filename matches: %d%s", len(sorted_images), ranking.text_matches,
+                 " (cached)" if cached else "")
+
+    paginator = Paginator(sorted_images, 20)  # 20 per page
+    page_obj = paginator.get_page(request.GET.get("page", 1))
+    start = time.perf_counter()
+    images = list(page_obj.object_list)
+    timings["page"] = (time.perf_counter() - start) * 1000
+    for stage, ms in timings.items():
+        observe(f"search_{stage}", ms / 1000)
+    return page_obj, images, timings
+
+def render_results(request, page_obj, images, timings, **context):
+    start = time.perf_counter()
+    response = render(request, "explorer/index.html", dict(context, images=images, page_obj=page_obj))
+    timings["render"] = (time.perf_counter() - start) * 1000
+    observe("render", timings["render"] / 1000)
+    response["Server-Timing"] = ", ".join(f"{stage};dur={ms:.2f}" for stage, ms in timings.items())
+    logger.debug("Stage timings: %s", " | ".join(f"{stage} {ms:.1f}ms" for stage, ms in timings.items()))
+    return response
+
+def search_results(request, user, query, filter_type):
+    """The search branch of home: encoding the query, scoring and rendering (all blocking work)."""
+    logger.debug("Search query: %s | Filter: %s", query, filter_type)
+    page_obj, images, timings = ranked_page(
+        request, user.user_id, query, "text", filter_type, lambda: encode_text(query).numpy())
+    return render_results(request, page_obj, images, timings, query=query, filter_type=filter_type)
+
+def browse_page(request, all_items, parent_id, folder_id, filter_type):
+    """The browse branch of home, once the folder's items are listed."""
+    predicate = filter_predicate(filter_type)
+    # Filter files in folder view (skip for folders)
+    filtered_items = []
+    for item in all_items:
+        if item['type'] == 'folder' or predicate is None or predicate(item['name']):
+            filtered_items.append(item)
+    paginator = Paginator(filtered_items, 20)
+    page_obj = paginator.get_page(request.GET.get("page", 1))
+    return render(request, "explorer/index.html", {
+        "items": page_obj.object_list,
+        "page_obj": page_obj,
+        "folder_id": folder_id,
+        "parent_id": parent_id,
+        "filter_type": filter_type,
+    })
 
-    # Validate token
-    headers = {"Authorization": f"Bearer {token}"}
-    check = requests.get("https://graph.microsoft.com/v1.0/me", headers=headers)
-    if check.status_code == 401:
-        request.session.flush()
+def home(request):
+    # Signed-in user and a fresh token, from GraphIdentityMiddleware
+    user = request.graph_user
+    if user is None:
         return redirect("login")
 
     query = request.GET.get("query", "").strip()
-    page = request.GET.get("page", 1)
     folder_id = request.GET.get("folder", "root")
-
     # Get filter parameter from GET, default to 'All'
     filter_type = request.GET.get("filter", "All")
 
-    # Paths for embedding and mapping
-    user_id = get_user_id(request)
-    user_dir = os.path.join("/tmp/onedrive_cache", str(user_id))
-    embedding_path = os.path.join(user_dir, "clip_embeddings.pkl")
-    mapping_path = os.path.join(user_dir, "file_id_to_name.pkl")
-
-    # Load caches
-    if os.path.exists(embedding_path):
-        with open(embedding_path, "rb") as f:
-            embedding_cache = pickle.load(f)
-    else:
-        embedding_cache = {}
-
-    if os.path.exists(mapping_path):
-        with open(mapping_path, "rb") as f:
-            file_id_to_name = pickle.load(f)
-    else:
-        file_id_to_name = {}
-
-    # Map filter_type to allowed file extensions
-    FILTER_MAP = {
-        "All": None,
-        "Document": (".pdf", ".doc", ".docx", ".txt", ".ppt", ".pptx", ".xls", ".xlsx"),
-        "Image": (".jpg", ".jpeg", ".png", ".bmp", ".gif"),
-        "Audio": (".mp3", ".wav", ".aac", ".ogg", ".m4a"),
-        "Video": (".mp4", ".avi", ".mov", ".mkv", ".flv"),
-    }
-
-    def passes_filter(filename):
-        if filter_type == "All":
-            return True
-        exts = FILTER_MAP.get(filter_type)
-        if not exts:
-            return True
-        return filename.lower().endswith(exts)
-
     # ----------- MAIN SEARCH BRANCH -----------
     if query:
-        overall_start_time = time.time()
-        prev_query = request.session.get("last_query", None)
-        prev_results = request.session.get("last_results", None)
-        prev_filter = request.session.get("last_filter", None)
-
-        # Only use cache if both query and filter match last search
-        if prev_query == query and prev_results and prev_filter == filter_type:
-            sorted_images = prev_results
-            print("Using cached search results for:", query, "with filter:", filter_type)
-        else:
-            print(f"Search query: {query} | Filter: {filter_type}")
-
-            # Load candidate items (filtered)
-            items = []
-            for fid, fname in file_id_to_name.items():
-                if passes_filter(fname) and fid in embedding_cache:
-                    items.append({
-                        "id": fid,
-                        "name": fname,
-                    })
-            print("Cached local items found (after filter):", len(items))
-
-            filename_matches = []
-            semantic_matches = []
-            matched_ids = set()
-
-            query_lower = query.lower()
-
-            # ---- Filename Matches ----
-            for item in items:
-                if query_lower in item["name"].lower():
-                    img_url = reverse('proxy_image', args=[item["id"]])
-                    filename_matches.append((item["name"], img_url, 1.0, None))
-                    matched_ids.add(item["id"])
-
-            # ---- Semantic Matches ----
-            text_features = encode_text(query).numpy()
-            text_norm = text_features / np.linalg.norm(text_features)
-            for item in items:
-                if item["id"] in matched_ids:
-                    continue
-                image_vector = embedding_cache[item["id"]]
-                image_norm = image_vector / np.linalg.norm(image_vector)
-                score = float(np.dot(text_norm, image_norm.T))
-                img_url = reverse('proxy_image', args=[item["id"]])
-                semantic_matches.append((item["name"], img_url, score, None))
-
-            print("Filename matches:", len(filename_matches), "Semantic matches:", len(semantic_matches))
-            semantic_matches.sort(key=lambda x: -x[2])
-            filename_matches.sort(key=lambda x: x[0].lower())
-
-            sorted_images = filename_matches + semantic_matches
-            request.session["last_query"] = query
-            request.session["last_results"] = sorted_images
-            request.session["last_filter"] = filter_type
-
-        overall_end_time = time.time()
-        print("Complete time for retrieval (all steps): {:.2f} seconds".format(overall_end_time - overall_start_time))
-
-        paginator = Paginator(sorted_images, 20)  # 20 per page
-        page_obj = paginator.get_page(page)
-        return render(request, "explorer/index.html", {
-            "images": page_obj.object_list,
-            "page_obj": page_obj,
-            "query": query,
-            "filter_type": filter_type,
-        })
+        return search_results(request, user, query, filter_type)
 
     # ----------- BROWSE FOLDER BRANCH -----------
-    else:
-        all_items, parent_id = list_onedrive_items(token, folder_id)
-        # Filter files in folder view (skip for folders)
-        filtered_items = []
-        for item in all_items:
-            if item['type'] == 'folder' or passes_filter(item['name']):
-                filtered_items.append(item)
-        paginator = Paginator(filtered_items, 20)
-        page_obj = paginator.get_page(page)
-        return render(request, "explorer/index.html", {
-            "items": page_obj.object_list,
-            "page_obj": page_obj,
-            "folder_id": folder_id,
-            "parent_id": parent_id,
-            "filter_type": filter_type,
-        })
+    all_items, parent_id = list_onedrive_items(user.access_token, folder_id)
+    if all_items is None:
+        # Token revoked on the Microsoft side
+        request.session.flush()
+        return redirect("login")
+    return browse_page(request, all_items, parent_id, folder_id, filter_type)
 
-# Keep your utility functions as they are...
-def list_onedrive_items(token, folder_id='root'):
-    # ... (same as your code)
-    url = f"https://graph.microsoft.com/v1.0/me/drive/items/{folder_id}/children?$expand=thumbnails"
-    headers = {"Authorization": f"Bearer {token}"}
-    resp = requests.get(url, headers=headers)
-    if resp.status_code == 401:
-        return None, None
-    data = resp.json().get("value", [])
+async def home_async(request):
+    """
+    home for ASGI servers (see ASYNC_VIEWS). Browsing awaits Graph on the
+    shared async client instead of holding a thread; searches (CLIP
+    encoding and scoring) and template rendering run in a worker thread,
+    off the event loop.
+    """
+    user = request.graph_user
+    if user is None:
+        return redirect("login")
+    query = request.GET.get("query", "").strip()
+    folder_id = request.GET.get("folder", "root")
+    filter_type = request.GET.get("filter", "All")
+    if query:
+        return await sync_to_async(search_results)(request, user, query, filter_type)
+    all_items, parent_id = await alist_onedrive_items(user.access_token, folder_id)
+    if all_items is None:
+        await sync_to_async(request.session.flush)()
+        return redirect("login")
+    return await sync_to_async(browse_page)(request, all_items, parent_id, folder_id, filter_type)
+
+# ----------- "More like this" -----------
+def similar(request, item_id):
+    """Images most like an indexed one, ranked from its stored vector (no download, no encode)."""
+    user = request.graph_user
+    if user is None:
+        return redirect("login")
+    index = get_library_index(user.user_id, manager.embedding_version)
+    rows = index.rows_of([item_id])
+    if rows[0] < 0:
+        return HttpResponse("That image hasn't been indexed yet.", status=404)
+    vector = index.vector(rows[0])
+    filter_type = request.GET.get("filter", "All")
+    page_obj, images, timings = ranked_page(
+        request, user.user_id, item_id, "item", filter_type, lambda: vector, exclude_file_id=item_id)
+    return render_results(request, page_obj, images, timings, filter_type=filter_type,
+                          similar_to=index.names[rows[0]])
+
+def query_image_vector(user_id, content_hash):
+    """Embedding of a query image by content hash: a library image with that content, or an earlier upload."""
+    found = vectors_by_hash(user_id, [content_hash], manager.embedding_version)
+    if content_hash in found:
+        return found[content_hash][1].astype(np.float32)
+    return cached_image_embedding(content_hash)
+
+def similar_upload(request):
+    """Embed an uploaded query image once, then show its results at similar_image."""
+    user = request.graph_user
+    if user is None:
+        return redirect("login")
+    upload = request.FILES.get("image")
+    if request.method != "POST" or upload is None:
+        return redirect("home")
+    if upload.size > settings.SIMILAR_UPLOAD_MAX_BYTES:
+        return HttpResponse("That image is too large to search with.", status=413)
+    data = upload.read()
+    digest = QuickXorHash()
+    digest.update(data)
+    content_hash = digest.hexdigest()
+    if query_image_vector(user.user_id, content_hash) is None:
+        try:
+            encode_image_bytes(data, content_hash)
+        except Exception as e:
+            return HttpResponse(f"Could not read that image: {e}", status=400)
+    return redirect("similar_image", content_hash)
+
+def similar_image(request, content_hash):
+    user = request.graph_user
+    if user is None:
+        return redirect("login")
+    vector = query_image_vector(user.user_id, content_hash)
+    if vector is None:
+        # Fell out of the query image cache
+        return HttpResponse("Please upload the image again.", status=404)
+    filter_type = request.GET.get("filter", "All")
+    page_obj, images, timings = ranked_page(
+        request, user.user_id, content_hash, "image", filter_type, lambda: vector)
+    return render_results(request, page_obj, images, timings, filter_type=filter_type,
+                          similar_to="your image")
+
+# ----------- Graph helpers -----------
+def folder_entries(data):
+    """Browse entries for the driveItems of a children listing."""
     results = []
-    for item in data:
+    for item in data.get("value", []):
         thumbnails = item.get("thumbnails", [])
         thumbnail_url = None
         if thumbnails and "medium" in thumbnails[0]:
@@ -322,49 +285,48 @@ def list_onedrive_items(token, folder_id='root'):
             "type": "folder" if "folder" in item else "file",
             "thumbnail": thumbnail_url
         })
+    return results
+
+def parent_of(folder):
+    parent_ref = folder.get("parentReference", {})
+    return parent_ref.get("id", "root") if parent_ref else "root"
+
+def list_onedrive_items(token, folder_id='root'):
+    url = f"{GRAPH_API}/me/drive/items/{folder_id}/children?$expand=thumbnails"
+    headers = {"Authorization": f"Bearer {token}"}
+    resp = graph_session().get(url, headers=headers)
+    if resp.status_code == 401:
+        return None, None
+    results = folder_entries(resp.json())
     parent_id = None
     if folder_id != "root":
-        folder_url = f"https://graph.microsoft.com/v1.0/me/drive/items/{folder_id}"
-        folder_resp = requests.get(folder_url, headers=headers)
+        folder_url = f"{GRAPH_API}/me/drive/items/{folder_id}"
+        folder_resp = graph_session().get(folder_url, headers=headers)
         if folder_resp.status_code == 200:
-            parent_ref = folder_resp.json().get("parentReference", {})
-            parent_id = parent_ref.get("id", "root") if parent_ref else "root"
+            parent_id = parent_of(folder_resp.json())
     return results, parent_id
 
-def recursive_onedrive_images(token, folder_id='root'):
-    """
-    Recursively find all images in all folders on OneDrive (no limit).
-    """
+async def alist_onedrive_items(token, folder_id='root'):
+    """list_onedrive_items on the async client, with the children and parent lookups in flight together."""
+    client = async_graph_client()
     headers = {"Authorization": f"Bearer {token}"}
-    url = f"https://graph.microsoft.com/v1.0/me/drive/items/{folder_id}/children?$top=200"
-    images = []
-
-    while url:
-        resp = requests.get(url, headers=headers)
-        if resp.status_code != 200:
-            print(f"Error fetching folder {folder_id}: {resp.status_code}")
-            return images
-        data = resp.json()
-        files = data.get("value", [])
-        for f in files:
-            name = f.get("name", "")
-            if 'folder' in f:
-                # Recursively get images in subfolders
-                images.extend(recursive_onedrive_images(token, folder_id=f['id']))
-            elif name.lower().endswith(('.jpg', '.jpeg', '.png')):
-                images.append({
-                    "name": name,
-                    "id": f.get("id"),
-                })
-        url = data.get("@odata.nextLink", None)  # This will page until all files are fetched
-
-    return images
-
+    children = client.get(f"{GRAPH_API}/me/drive/items/{folder_id}/children?$expand=thumbnails", headers=headers)
+    if folder_id == "root":
+        resp, folder_resp = await children, None
+    else:
+        resp, folder_resp = await asyncio.gather(
+            children, client.get(f"{GRAPH_API}/me/drive/items/{folder_id}", headers=headers))
+    if resp.status_code == 401:
+        return None, None
+    parent_id = None
+    if folder_resp is not None and folder_resp.status_code == 200:
+        parent_id = parent_of(folder_resp.json())
+    return folder_entries(resp.json()), parent_id
 
 def get_thumbnail_url(token, file_id):
-    url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}/thumbnails"
+    url = f"{GRAPH_API}/me/drive/items/{file_id}/thumbnails"
     headers = {"Authorization": f"Bearer {token}"}
-    resp = requests.get(url, headers=headers)
+    resp = graph_session().get(url, headers=headers)
     if resp.status_code == 200:
         thumbs = resp.json().get("value", [])
         if thumbs and "medium" in thumbs[0]:
@@ -376,20 +338,21 @@ def get_thumbnail_url(token, file_id):
 @csrf_exempt
 def upload_file(request):
     if request.method == "POST" and request.FILES.get('file'):
-        token = request.session.get("access_token")
-        if not token:
+        user = request.graph_user
+        if user is None:
             return redirect("login")
+        token = user.access_token
         folder_id = request.POST.get("folder_id", "root")
         uploaded_file = request.FILES['file']
-        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{folder_id}:/"+uploaded_file.name+":/content"
+        url = f"{GRAPH_API}/me/drive/items/{folder_id}:/"+uploaded_file.name+":/content"
         headers = {
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/octet-stream"
         }
-        resp = requests.put(url, headers=headers, data=uploaded_file.read())
+        resp = graph_session().put(url, headers=headers, data=uploaded_file.read())
         if resp.status_code in [200, 201]:
-            # After upload, re-sync!
-            sync_onedrive_images(request)
+            # Queue embedding of just the uploaded file
+            enqueue_upload(user.user_id, token, resp.json(), job_session_key(request))
             return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
         else:
             return render(request, "explorer/error.html", {"error": f"Upload failed: {resp.status_code} {resp.text}"})
@@ -399,70 +362,108 @@ def upload_file(request):
 @csrf_exempt
 def delete_file(request, file_id):
     if request.method == "POST":
-        token = request.session.get("access_token")
-        if not token:
+        user = request.graph_user
+        if user is None:
             return redirect("login")
-        url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}"
+        token = user.access_token
+        url = f"{GRAPH_API}/me/drive/items/{file_id}"
         headers = {
             "Authorization": f"Bearer {token}"
         }
-        resp = requests.delete(url, headers=headers)
+        resp = graph_session().delete(url, headers=headers)
         if resp.status_code in [204, 200]:
-            # After delete, re-sync!
-            sync_onedrive_images(request)
+            # Queue removal of just the deleted file
+            enqueue_delete(user.user_id, token, file_id, job_session_key(request))
             return HttpResponseRedirect(request.META.get('HTTP_REFERER', '/'))
         else:
             return render(request, "explorer/error.html", {"error": f"Delete failed: {resp.status_code} {resp.text}"})
     else:
         return redirect("home")
 
+def metrics(request):
+    """Counters and latency histograms for Prometheus (this process only)."""
+    if not settings.METRICS_ENABLED:
+        return HttpResponse("Not found", status=404)
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponse("Unauthorized", status=401)
+    return metrics_response()
+
+def sync_status(request):
+    """Background sync progress for the current user, polled by the UI."""
+    if request.graph_user is None:
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+    jobs = user_jobs(request.graph_user.user_id)
+    active = [job.as_dict() for job in jobs if job.status in ("queued", "running")]
+    return JsonResponse({
+        "syncing": bool(active),
+        "active": active,
+        "latest": jobs[0].as_dict() if jobs else None,
+    })
+
+def local_image_path(user_id, item_id):
+    """
+    (path, content type) of a synced item's local copy, found through its
+    catalogued content hash, or None.
+    """
+    found = image_file(user_id, item_id)
+    if not found:
+        return None
+    name, content_hash = found
+    user_dir = user_cache_dir(user_id)
+    if content_hash:
+        path = object_path(user_dir, content_hash)
+    elif os.path.basename(name) == name:
+        path = os.path.join(user_dir, name)  # synced before files were kept by hash
+    else:
+        return None
+    return (path, mimetypes.guess_type(name)[0]) if os.path.isfile(path) else None
+
 def proxy_image(request, item_id):
     # Serve local file if available, else fallback to OneDrive
-    user_id = get_user_id(request)
-    user_dir = os.path.join("/tmp/onedrive_cache", str(user_id))
-    for ext in ['.jpg', '.jpeg', '.png']:
-        local_path = os.path.join(user_dir, item_id + ext)
-        if os.path.exists(local_path):
-            with open(local_path, "rb") as f:
-                return HttpResponse(f.read(), content_type="image/jpeg")
-    # Fallback to OneDrive API (if not yet synced)
-    access_token = request.session.get('access_token')
-    if not access_token:
+    user = request.graph_user
+    if user is None:
         return HttpResponse("Unauthorized", status=401)
-    url = f"https://graph.microsoft.com/v1.0/me/drive/items/{item_id}/content"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    resp = requests.get(url, headers=headers, stream=True)
-    if resp.status_code != 200:
+    local = local_image_path(user.user_id, item_id)
+    if local:
+        return serve_file(request, *local)
+    # Fallback to OneDrive API (if not yet synced)
+    url = f"{GRAPH_API}/me/drive/items/{item_id}/content"
+    headers = {"Authorization": f"Bearer {user.access_token}"}
+    if "Range" in request.headers:
+        headers["Range"] = request.headers["Range"]
+    resp = graph_session().get(url, headers=headers, stream=True)
+    if resp.status_code not in (200, 206):
+        resp.close()
         return HttpResponse("Failed to fetch image.", status=resp.status_code)
-    content_type = resp.headers.get('Content-Type', 'image/jpeg')
-    return HttpResponse(resp.content, content_type=content_type)
-
+    return stream_graph_content(resp)
 
+async def proxy_image_async(request, item_id):
+    """proxy_image for ASGI servers: the Graph fallback streams through the async client."""
+    user = request.graph_user
+    if user is None:
+        return HttpResponse("Unauthorized", status=401)
+    local = await sync_to_async(local_image_path)(user.user_id, item_id)
+    if local:
+        return serve_file(request, *local)
+    url = f"{GRAPH_API}/me/drive/items/{item_id}/content"
+    headers = {"Authorization": f"Bearer {user.access_token}"}
+    if "Range" in request.headers:
+        headers["Range"] = request.headers["Range"]
+    client = async_graph_client()
+    resp = await client.send(client.build_request("GET", url, headers=headers), stream=True,
+                             follow_redirects=True)
+    if resp.status_code not in (200, 206):
+        await resp.aclose()
+        return HttpResponse("Failed to fetch image.", status=resp.status_code)
+    return astream_graph_content(resp)
 
-def download_onedrive_file(file_id, token, msal_app, request, max_retries=2):
-    """
-    Download a file from OneDrive, handling token expiration and auto-refresh.
-    Updates session access_token if refreshed.
-    """
-    url = f"https://graph.microsoft.com/v1.0/me/drive/items/{file_id}/content"
-    headers = {"Authorization": f"Bearer {token}"}
-    for attempt in range(max_retries):
-        resp = requests.get(url, headers=headers)
-        if resp.status_code == 200:
-            return resp.content
-        elif resp.status_code == 401:
-            print("Access token expired, attempting refresh...")
-            # Attempt to refresh token
-            result = msal_app.acquire_token_silent(settings.MICROSOFT_SCOPE, account=None)
-            if result and "access_token" in result:
-                token = result["access_token"]
-                request.session["access_token"] = token
-                headers["Authorization"] = f"Bearer {token}"
-                continue
-            else:
-                print("Failed to refresh token. User must login again.")
-                break
-        else:
-            print(f"Failed to fetch image {file_id}, status: {resp.status_code}")
-            break
-    return None
\ No newline at end of file
+def thumbnail(request, item_id, size):
+    # Thumbnails are made during sync; fall back to the full image until then
+    if request.graph_user is None:
+        return HttpResponse("Unauthorized", status=401)
+    found = get_thumbnails(user_cache_dir(request.graph_user.user_id)).get(item_id, size)
+    if found is None:
+        return redirect('proxy_image', item_id=item_id)
+    data, etag = found
+    return serve_bytes(request, data, CONTENT_TYPES.get(thumbnail_format(), "image/jpeg"), etag)
@@ -12,5 +12,19 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_retrieval.settings')
+# Route Graph-bound views to their async versions (see ASYNC_VIEWS)
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
+
+# Load the CLIP model now rather than on the first search
+from django.conf import settings
+
+if settings.CLIP_WARMUP:
+    from explorer.clip_model import manager
+    manager.warmup()
+
+# And the search indexes of the busiest users
+if settings.SEARCH_INDEX_PRELOAD_USERS:
+    from explorer.index_registry import preload
+    preload()
@@ -29,11 +29,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'explorer.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'explorer.identity.GraphIdentityMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -67,6 +69,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Sync workers and web requests share this file
+        'OPTIONS': {'timeout': 20},
     }
 }
 
@@ -123,4 +127,157 @@ MICROSOFT_TENANT_ID = os.getenv('MICROSOFT_TENANT_ID')
 MICROSOFT_AUTHORITY = 'https://login.microsoftonline.com/common'
 MICROSOFT_SCOPE = ['User.Read', 'Files.Read']
 MICROSOFT_REDIRECT_URI = os.getenv('MICROSOFT_REDIRECT_URI')
+TOKEN_REFRESH_MARGIN = 300   # refresh access tokens this many seconds before they expire
 
+# Microsoft Graph endpoint; point at `manage.py mock_graph` for local testing
+GRAPH_API_BASE = os.getenv('GRAPH_API_BASE', 'https://graph.microsoft.com/v1.0')
+
+# Async views: under an ASGI server (asgi.py turns this on) home's folder
+# browsing and proxy_image's Graph fallback await Graph on one pooled
+# httpx.AsyncClient per process instead of holding a thread per request.
+# WSGI keeps the threaded views. Compare with `manage.py bench_asgi`.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '0') == '1'
+GRAPH_ASYNC_MAX_CONNECTIONS = int(os.getenv('GRAPH_ASYNC_MAX_CONNECTIONS', 100))
+
+# OneDrive downloads during sync
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', 8))
+DOWNLOAD_MAX_RETRIES = 5
+
+# Background sync jobs (run with `manage.py run_sync_worker`)
+# A running job's heartbeat is touched every SYNC_JOB_HEARTBEAT_SECONDS by a
+# thread of its own; a job without one for SYNC_JOB_STALE_SECONDS is requeued.
+# Keep that well above SYNC_LOCK_TIMEOUT and the heartbeat interval.
+SYNC_JOB_HEARTBEAT_SECONDS = 30
+SYNC_JOB_STALE_SECONDS = 1200
+SYNC_JOB_MAX_ATTEMPTS = 3
+# Syncs of one user hold a lock on its cache dir, so a second one (another
+# worker, a requeued job) waits up to SYNC_LOCK_TIMEOUT seconds for it.
+# Results are written to the catalog and the store (fsynced) every
+# SYNC_CHECKPOINT_ITEMS images; an interrupted sync resumes from there.
+SYNC_LOCK_TIMEOUT = 600
+SYNC_CHECKPOINT_ITEMS = int(os.getenv('SYNC_CHECKPOINT_ITEMS', 256))
+# Images that fail to download or embed are retried by the next syncs,
+# up to SYNC_RETRY_ATTEMPTS times, while the delta link moves on
+SYNC_RETRY_ATTEMPTS = 5
+
+# Per-user OneDrive downloads and embedding stores
+ONEDRIVE_CACHE_DIR = os.getenv('ONEDRIVE_CACHE_DIR', '/tmp/onedrive_cache')
+CATALOG_BATCH_SIZE = 500      # OneDriveImage rows per bulk_create / bulk_update
+IMAGE_CACHE_MAX_AGE = 86400   # browser cache lifetime of proxied images, in seconds
+
+# Thumbnails made by sync (longest edge in px). Result tiles are 120x90,
+# so the grid asks for 128; /thumbnail/<id>/<size>/ serves any of them
+THUMBNAIL_SIZES = (128, 256, 512)
+THUMBNAIL_GRID_SIZE = 128
+THUMBNAIL_FORMAT = 'WEBP'     # or 'JPEG'
+THUMBNAIL_QUALITY = 80
+
+# Approximate nearest-neighbour search for large libraries.
+# ANN_BACKEND: "auto" (HNSW if hnswlib is installed, else IVF), "ivf" or "hnsw"
+ANN_MIN_IMAGES = int(os.getenv('ANN_MIN_IMAGES', 50000))
+ANN_BACKEND = os.getenv('ANN_BACKEND', 'auto')
+ANN_NPROBE = 16          # IVF lists probed per query
+ANN_CANDIDATES = 2000    # HNSW neighbours fetched per query
+
+# Filename / folder matches (an inverted index built during sync) are fused
+# with CLIP similarity into one ranking. SEARCH_FUSION: "rrf" (reciprocal-rank
+# fusion with constant SEARCH_RRF_K) or "blend" (SEARCH_TEXT_WEIGHT of the
+# filename score plus the rest of the min-max scaled similarity).
+SEARCH_FUSION = os.getenv('SEARCH_FUSION', 'rrf')
+SEARCH_RRF_K = 60
+SEARCH_TEXT_WEIGHT = 0.3
+
+# How search indexes hold each library's vectors in memory: "float32" (exact,
+# 2 KB per 512-d image), "int8" (512 bytes) or "binary" (sign bits, 64 bytes).
+# Quantized indexes re-score their best SEARCH_RERANK_CANDIDATES rows exactly
+# from a float16 copy memory-mapped from the user's cache dir. Keep it at or
+# above RESULT_CACHE_DEPTH; binary needs a deeper re-rank than int8 for the
+# same recall. Compare the modes with `bench_quantization`.
+SEARCH_QUANTIZATION = os.getenv('SEARCH_QUANTIZATION', 'float32')
+SEARCH_RERANK_CANDIDATES = 2000
+
+# Search, filename, ANN and thumbnail indexes are held per process in one registry,
+# least recently used evicted first (across users) to stay within
+# SEARCH_INDEX_MEMORY_MB; sizes are estimates. The WSGI/ASGI entry points
+# preload the indexes of the SEARCH_INDEX_PRELOAD_USERS users with the most
+# live sessions. Hits, misses, evictions and resident bytes are on /metrics.
+SEARCH_INDEX_MEMORY_MB = int(os.getenv('SEARCH_INDEX_MEMORY_MB', 1024))
+SEARCH_INDEX_PRELOAD_USERS = int(os.getenv('SEARCH_INDEX_PRELOAD_USERS', 8))
+
+# CLIP variant (any name clip.available_models() lists) and device. The model
+# is loaded on first use; with CLIP_WARMUP the WSGI/ASGI entry points load
+# and warm it up before serving, so the first search doesn't pay for it.
+# Changing the variant needs a full re-sync: embeddings aren't comparable.
+CLIP_MODEL_NAME = os.getenv('CLIP_MODEL_NAME', 'ViT-B/32')
+CLIP_DEVICE = os.getenv('CLIP_DEVICE') or None
+CLIP_WARMUP = os.getenv('CLIP_WARMUP', '1') == '1'
+
+# Inference backend: "eager" (reference), "int8" (dynamic quantization, CPU),
+# "torchscript", "compile" (torch.compile) or "onnx" (needs onnx + onnxruntime).
+# int8 vectors are versioned apart from the others, so switching to or from
+# it re-embeds each library on its next sync. Compare with `bench_backends`.
+CLIP_BACKEND = os.getenv('CLIP_BACKEND', 'eager')
+CLIP_ONNX_DIR = os.getenv('CLIP_ONNX_DIR', '/tmp/clip_onnx')
+
+# Query text embeddings: in-process LRU size, plus an optional directory
+# shared by all worker processes (unset to disable the on-disk layer)
+TEXT_EMBEDDING_CACHE_SIZE = 1024
+TEXT_EMBEDDING_CACHE_DIR = os.getenv('TEXT_EMBEDDING_CACHE_DIR') or None
+
+# "More like this" with an uploaded image: embeddings of recent query images
+# are kept (by content hash) so paging and repeat searches don't re-encode
+IMAGE_EMBEDDING_CACHE_SIZE = 256
+SIMILAR_UPLOAD_MAX_BYTES = 20 * 1024 * 1024
+
+# Ranked search results, cached server-side per (user, query, filter, store
+# version). Entries hold the top RESULT_CACHE_DEPTH row ids and scores
+# (~8 bytes per row); deeper pages re-rank. Point 'search_results' at a
+# shared backend (Redis, Memcached) to share results between processes.
+RESULT_CACHE_DEPTH = 1000
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'search_results': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'search-results',
+        'TIMEOUT': int(os.getenv('RESULT_CACHE_TTL', 600)),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('RESULT_CACHE_SIZE', 256))},
+    },
+}
+
+# Sync embedding pipeline. Unset values are sized from os.cpu_count()
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', 32))
+EMBED_DECODE_WORKERS = int(os.getenv('EMBED_DECODE_WORKERS', 0)) or None
+EMBED_TORCH_THREADS = int(os.getenv('EMBED_TORCH_THREADS', 0)) or None
+# Decode photos at reduced size (JPEG DCT scaling, then whole-factor reduce),
+# keeping EMBED_DECODE_GAP times the pixels CLIP and the thumbnails need.
+# EXIF orientation, alpha, CMYK and 16-bit images are handled either way
+EMBED_FAST_DECODE = os.getenv('EMBED_FAST_DECODE', '1') == '1'
+EMBED_DECODE_GAP = float(os.getenv('EMBED_DECODE_GAP', 2.0))
+
+# Prometheus metrics at /metrics: span timings (Graph calls, downloads,
+# decode, preprocess, encode, search stages, rendering), request counts and
+# the query embedding caches' hits, misses and encode time.
+# Numbers are per process. Off unless METRICS_ENABLED=1, since they reveal
+# traffic and timings; set METRICS_TOKEN to also require
+# "Authorization: Bearer <token>".
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '0') == '1'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or None
+
+# ?profile=1 on any request saves a cProfile dump to PROFILE_DIR, ?profile=text
+# returns the top functions instead of the page. Off unless PROFILE_REQUESTS=1,
+# since anyone who can reach the server could otherwise trigger it.
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', '0') == '1'
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/explorer_profiles')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'explorer': {'handlers': ['console'], 'level': os.getenv('EXPLORER_LOG_LEVEL', 'INFO')},
+    },
+}
@@ -1,15 +1,28 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
-from explorer.views import home, login, callback, logout, upload_file, delete_file, proxy_image
+from explorer.views import (
+    home, login, callback, logout, upload_file, delete_file, proxy_image, sync_status, thumbnail,
+    similar, similar_upload, similar_image, metrics, home_async, proxy_image_async,
+)
+
+# Under ASGI the Graph-bound views await Graph instead of blocking (settings.ASYNC_VIEWS)
+async_views = settings.ASYNC_VIEWS
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('', home, name='home'),
+    path('', home_async if async_views else home, name='home'),
     path('login/', login, name='login'),
     path('callback/', callback, name='callback'),
     path('logout/', logout, name='logout'),
     path('upload/', upload_file, name='upload_file'),
     path('delete/<str:file_id>/', delete_file, name='delete_file'),
-    path('proxy-image/<str:item_id>/', proxy_image, name='proxy_image'),
+    path('proxy-image/<str:item_id>/', proxy_image_async if async_views else proxy_image, name='proxy_image'),
+    path('thumbnail/<str:item_id>/<int:size>/', thumbnail, name='thumbnail'),
+    path('sync-status/', sync_status, name='sync_status'),
+    path('metrics', metrics, name='metrics'),
+    path('similar/<str:item_id>/', similar, name='similar'),
+    path('similar-image/', similar_upload, name='similar_upload'),
+    path('similar-image/<str:content_hash>/', similar_image, name='similar_image'),
 ]
@@ -14,3 +14,15 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_retrieval.settings')
 
 application = get_wsgi_application()
+
+# Load the CLIP model now rather than on the first search
+from django.conf import settings
+
+if settings.CLIP_WARMUP:
+    from explorer.clip_model import manager
+    manager.warmup()
+
+# And the search indexes of the busiest users
+if settings.SEARCH_INDEX_PRELOAD_USERS:
+    from explorer.index_registry import preload
+    preload()